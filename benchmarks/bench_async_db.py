@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, func
+
+import models
+from database import SessionLocal, AsyncSessionLocal, async_engine
+
+
+# Compares concurrent-request throughput of the two database paths the routers can use.
+# "sync" runs the query through SessionLocal inside a coroutine, exactly like the handlers
+# did before; every query blocks the event loop, so concurrent requests are served one by one.
+# "async" runs the same query through AsyncSessionLocal, so requests overlap while they wait
+# on PostgreSQL.
+#
+# Usage: python benchmarks/bench_async_db.py --requests 200 --concurrency 20 --delay 0.02
+# --delay adds pg_sleep() to every query to stand in for a slow admin listing.
+
+
+def build_queries(delay):
+    query = (
+        select(models.Todos.id, models.Todos.start_time, models.Todos.end_time, models.Todos.uzman_id)
+        .where(models.Todos.is_delete == False)
+        .order_by(models.Todos.id)
+        .limit(100)
+    )
+    if delay:
+        return [select(func.pg_sleep(delay)), query]
+    return [query]
+
+
+async def sync_request(queries):
+    db = SessionLocal()
+    try:
+        for query in queries:
+            db.execute(query).all()
+    finally:
+        db.close()
+
+
+async def async_request(queries):
+    async with AsyncSessionLocal() as db:
+        for query in queries:
+            (await db.execute(query)).all()
+
+
+async def run(handler, queries, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler(queries)
+
+    # Warm up the pools so connection setup is not measured
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sync vs async database path throughput")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds of pg_sleep per query")
+    args = parser.parse_args()
+
+    queries = build_queries(args.delay)
+    print(f"{args.requests} requests, concurrency {args.concurrency}, query delay {args.delay}s")
+    for name, handler in (("sync ", sync_request), ("async", async_request)):
+        elapsed = await run(handler, queries, args.requests, args.concurrency)
+        print(f"{name}: {elapsed:8.3f}s  {args.requests / elapsed:9.1f} req/s")
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
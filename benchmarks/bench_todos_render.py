@@ -0,0 +1,101 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from fastapi.templating import Jinja2Templates
+
+
+# Render-time regression benchmark for templates/todos.html.
+# The listing used to resolve names by looping over every customer, expert, status and charge
+# for each row, i.e. O(rows x reference rows). Rows now arrive with the names already joined in,
+# so render time must grow linearly with the row count and stay flat as reference tables grow.
+# The script renders the real template with synthetic rows and exits non-zero when the per-row
+# cost at the largest size exceeds --max-growth times the cost at the smallest size.
+#
+# Usage: python benchmarks/bench_todos_render.py --rows 50 200 1000 --reference 10 1000
+
+
+# Enough of a request for layout.html's url_for('static', ...) calls
+class TemplateRequest:
+    def url_for(self, name, **path_params):
+        return f"/{name}{path_params.get('path', '')}"
+
+
+def make_rows(count):
+    start = datetime(2024, 1, 1, 9)
+    return [
+        {
+            "id": i,
+            "start_time": start + timedelta(hours=i),
+            "end_time": start + timedelta(hours=i, minutes=45),
+            "description": f"appointment {i}",
+            "uzman_id": i % 10,
+            "musteri_id": i,
+            "status_id": i % 4,
+            "charge_id": i % 5,
+            "musteri_ad": f"customer {i}",
+            "uzman_ad": f"expert {i % 10}",
+            "status_name": f"status {i % 4}",
+            "charge_total": Decimal("120.00"),
+        }
+        for i in range(count)
+    ]
+
+
+def make_reference(count):
+    uzm = [{"id": i, "ad": f"expert {i}", "is_delete": False} for i in range(count)]
+    sts = [{"id": i, "status_name": f"status {i}", "is_delete": False} for i in range(min(count, 10))]
+    return uzm, sts
+
+
+def render_time(template, rows, uzm, sts, repeat):
+    context = {
+        "request": TemplateRequest(), "todos": rows, "uzm": uzm, "sts": sts,
+        "user": {"id": 1, "username": "admin", "user_role": "admin"},
+        "next_url": "?after=x", "prev_url": None,
+        "filters": {"uzman_id": None, "status_id": None, "date_from": None, "date_to": None},
+    }
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        template.render(context)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="todos.html render-time scaling")
+    parser.add_argument("--rows", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--reference", type=int, nargs="+", default=[10, 1000],
+                        help="sizes of the expert reference list")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-growth", type=float, default=2.0,
+                        help="allowed per-row cost ratio between the largest and smallest case")
+    args = parser.parse_args()
+
+    template = Jinja2Templates(directory=os.path.join(ROOT, "templates")).get_template("todos.html")
+
+    per_row = []
+    print(f"{'rows':>6} {'reference':>10} {'render ms':>10} {'us/row':>8}")
+    for reference in args.reference:
+        uzm, sts = make_reference(reference)
+        for count in args.rows:
+            elapsed = render_time(template, make_rows(count), uzm, sts, args.repeat)
+            per_row.append(elapsed / count)
+            print(f"{count:>6} {reference:>10} {elapsed * 1000:>10.2f} {elapsed / count * 1e6:>8.1f}")
+
+    # The smallest case carries the fixed page overhead, so compare against the cheapest per-row cost
+    growth = per_row[-1] / min(per_row)
+    print(f"per-row cost growth: {growth:.2f}x (limit {args.max_growth}x)")
+    if growth > args.max_growth:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
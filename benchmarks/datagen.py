@@ -0,0 +1,181 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, time as day_time, timedelta
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passlib.context import CryptContext
+from sqlalchemy import insert, text
+
+import importer
+import migrate
+import models
+from database import SessionLocal
+
+
+# Synthetic data for the benchmark scenarios: N experts, M customers and K todos spread over the
+# years before --anchor-date and the months after it, written to the database in DATABASE_URL with
+# COPY. Bookings are cut from hourly working-hour slots, so the no-overlap constraint always holds.
+# The same --seed and --anchor-date always produce the same data, so runs on different days,
+# machines or commits compare.
+#
+# Every generated user has the password BENCH_PASSWORD: the admin is 'bench-admin' and the
+# experts are 'bench-expert-1' ... 'bench-expert-N'.
+#
+# Usage: python benchmarks/datagen.py --experts 20 --customers 5000 --todos 200000 --years 3 --reset
+
+BENCH_PASSWORD = "bench"
+
+# Day the data is laid out around; fixed rather than today, so the data does not change from day to
+# day. benchmarks/run.py must be given the same --anchor-date.
+DEFAULT_ANCHOR_DATE = date(2025, 1, 1)
+ADMIN_USERNAME = "bench-admin"
+
+STATUSES = {0: "open", 1: "completed", 2: "cancelled", 3: "no show"}
+CHARGES = {0: Decimal("0"), 1: Decimal("100"), 2: Decimal("250")}
+
+# First hour of the working-day slots and their number; bookings last 30 to 60 minutes
+FIRST_SLOT_HOUR = 9
+SLOTS_PER_DAY = 9
+
+TABLES = ("todos", "todo_series", "documents", "customers", "users", "charge", "status", "change_versions",
+          "revenue_rollups")
+
+
+def expert_username(number):
+    return f"bench-expert-{number}"
+
+
+# Working days in [first, last], Monday to Friday
+def working_days(first, last):
+    days = []
+    day = first
+    while day <= last:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def load_reference_data(db, experts, rounds):
+    # One bcrypt hash shared by every user; hashing per user would dominate the run
+    hashed = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds).hash(BENCH_PASSWORD)
+    users = [dict(username=ADMIN_USERNAME, email="admin@bench.local", role="admin", uzman=True, ad="Bench", soyad="Admin")]
+    users += [dict(username=expert_username(i), email=f"expert{i}@bench.local", role="user", uzman=True,
+                   ad=f"Expert{i}", soyad="Bench") for i in range(1, experts + 1)]
+    users.append(dict(username="bench-secretary", email="secretary@bench.local", role="user", sekreter=True,
+                      ad="Secretary", soyad="Bench"))
+    db.execute(insert(models.Users), [
+        {"tc": None, "telno": None, "owner": False, "uzman": False, "sekreter": False, "is_active": True,
+         "is_delete": False, "hashed_password": hashed, **user} for user in users
+    ])
+    db.execute(insert(models.Status), [
+        {"id": status_id, "status_name": name, "is_active": True, "is_delete": False} for status_id, name in STATUSES.items()
+    ])
+    db.execute(insert(models.Charge), [
+        {"id": charge_id, "charge_name": f"charge {charge_id}", "net": net, "tax": net * Decimal("0.2"),
+         "total": net * Decimal("1.2"), "is_active": True, "is_delete": False} for charge_id, net in CHARGES.items()
+    ])
+    # The ids above were given explicitly; later inserts through the app take the next ones
+    for table in ("status", "charge"):
+        db.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"))
+
+
+def load_customers(db, customers, rng):
+    db.execute(insert(models.Customers), [
+        {"tc": 10_000_000 + i, "ad": f"Customer{i}", "soyad": rng.choice(("Kaya", "Yilmaz", "Demir", "Sahin")),
+         "email": f"customer{i}@bench.local", "telno": f"555{i:07d}", "is_active": True, "is_delete": False}
+        for i in range(1, customers + 1)
+    ])
+
+
+# Yields todo rows, expert by expert, each expert's bookings on distinct hourly slots
+def generate_todos(todos, expert_ids, customer_ids, sekreter_id, days, anchor, rng):
+    slots = len(days) * SLOTS_PER_DAY
+    per_expert, extra = divmod(todos, len(expert_ids))
+    for index, uzman_id in enumerate(expert_ids):
+        count = min(per_expert + (index < extra), slots)
+        for slot in sorted(rng.sample(range(slots), count)):
+            day, hour = divmod(slot, SLOTS_PER_DAY)
+            start = datetime.combine(days[day], day_time(FIRST_SLOT_HOUR + hour))
+            past = days[day] < anchor
+            yield {
+                "start_time": start,
+                "end_time": start + timedelta(minutes=rng.choice((30, 45, 60))),
+                "uzman_id": uzman_id,
+                "sekreter_id": sekreter_id,
+                "musteri_id": rng.choice(customer_ids),
+                "charge_id": rng.choice(tuple(CHARGES)),
+                "status_id": rng.choices((1, 2, 3), (85, 10, 5))[0] if past else 0,
+                "is_delete": rng.random() < 0.02,
+                "description": f"bench booking {slot}",
+            }
+
+
+def generate(experts, customers, todos, years, future_days, seed, anchor, reset, rounds, batch_size):
+    rng = random.Random(seed)
+    days = working_days(anchor - timedelta(days=365 * years), anchor + timedelta(days=future_days))
+
+    migrate.migrate()
+    with SessionLocal() as db:
+        if reset:
+            db.execute(text(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE"))
+
+        started = time.perf_counter()
+        load_reference_data(db, experts, rounds)
+        load_customers(db, customers, rng)
+        db.flush()
+
+        expert_ids = list(db.scalars(text("SELECT id FROM users WHERE username LIKE 'bench-expert-%' ORDER BY id")))
+        customer_ids = list(db.scalars(text("SELECT id FROM customers WHERE email LIKE '%@bench.local' ORDER BY id")))
+        sekreter_id = db.scalar(text("SELECT id FROM users WHERE username = 'bench-secretary'"))
+
+        loaded = 0
+        batch = []
+        for row in generate_todos(todos, expert_ids, customer_ids, sekreter_id, days, anchor, rng):
+            batch.append(row)
+            if len(batch) == batch_size:
+                importer.load_todos(db, batch)
+                loaded += len(batch)
+                batch = []
+        if batch:
+            importer.load_todos(db, batch)
+            loaded += len(batch)
+        db.commit()
+
+    # Fresh statistics, so the planner sees the generated distribution rather than an empty table
+    with SessionLocal() as db:
+        db.execute(text("ANALYZE"))
+        db.commit()
+
+    print(f"{experts} experts, {customers} customers, {loaded} todos over {len(days)} working days "
+          f"loaded in {time.perf_counter() - started:.1f}s (seed {seed}, anchor date {anchor})")
+    print(f"log in as {ADMIN_USERNAME} or {expert_username(1)}..{expert_username(experts)} with password '{BENCH_PASSWORD}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark data")
+    parser.add_argument("--experts", type=int, default=20)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--todos", type=int, default=100_000)
+    parser.add_argument("--years", type=int, default=3, help="years of bookings before the anchor date")
+    parser.add_argument("--future-days", type=int, default=90, help="days of bookings after the anchor date")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--anchor-date", type=date.fromisoformat, default=DEFAULT_ANCHOR_DATE,
+                        help="day the data is laid out around, YYYY-MM-DD")
+    parser.add_argument("--reset", action="store_true", help="empty the application tables first")
+    parser.add_argument("--rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", "12")),
+                        help="bcrypt cost of the generated password hashes")
+    parser.add_argument("--batch-size", type=int, default=importer.IMPORT_BATCH_SIZE * 10)
+    args = parser.parse_args()
+
+    generate(args.experts, args.customers, args.todos, args.years, args.future_days, args.seed,
+             args.anchor_date, args.reset, args.rounds, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
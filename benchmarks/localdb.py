@@ -0,0 +1,96 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+
+# Throwaway local PostgreSQL for benchmark runs, so results do not depend on a shared server.
+# It uses initdb/pg_ctl from PATH (or from PG_BIN); when those are missing and the optional
+# pgserver package is installed, its bundled binaries are used instead. The server listens on a
+# Unix socket inside the data directory only. The printed DATABASE_URL is meant to be exported for
+# datagen, run and the application itself.
+#
+# SQLite cannot stand in for PostgreSQL here: the schema relies on an exclusion constraint
+# (btree_gist), arrays, COPY, LISTEN/NOTIFY and the asyncpg driver. The server needs the contrib
+# extensions (btree_gist) installed.
+#
+# Usage: python benchmarks/localdb.py start --dir /tmp/bench-pg
+#        export DATABASE_URL=...   (as printed)
+#        python benchmarks/localdb.py stop --dir /tmp/bench-pg
+
+DATABASE_NAME = "bench"
+
+
+def pg_bin_dir():
+    if os.getenv("PG_BIN"):
+        return os.getenv("PG_BIN")
+    initdb = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("No PostgreSQL binaries found: put initdb and pg_ctl on PATH, set PG_BIN, "
+                 "or pip install -r benchmarks/requirements.txt")
+    return os.path.join(os.path.dirname(pgserver.__file__), "pginstall", "bin")
+
+
+def database_url(data_dir):
+    return f"postgresql://postgres:@/{DATABASE_NAME}?host={os.path.abspath(data_dir)}"
+
+
+def start(data_dir, settings):
+    bin_dir = pg_bin_dir()
+    data_dir = os.path.abspath(data_dir)
+    if not os.path.exists(os.path.join(data_dir, "PG_VERSION")):
+        subprocess.run([os.path.join(bin_dir, "initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust",
+                        "--encoding=UTF8"], check=True, stdout=subprocess.DEVNULL)
+        fresh = True
+    else:
+        fresh = False
+
+    options = f"-k {data_dir} -c listen_addresses='' " + " ".join(f"-c {setting}" for setting in settings)
+    subprocess.run([os.path.join(bin_dir, "pg_ctl"), "-D", data_dir, "-o", options,
+                    "-l", os.path.join(data_dir, "server.log"), "-w", "start"], check=True, stdout=subprocess.DEVNULL)
+
+    if fresh:
+        # Connect to the maintenance database to create the benchmark one
+        import psycopg2
+        for _ in range(50):
+            try:
+                connection = psycopg2.connect(dbname="postgres", user="postgres", host=data_dir)
+                break
+            except psycopg2.OperationalError:
+                time.sleep(0.1)
+        connection.autocommit = True
+        connection.cursor().execute(f"CREATE DATABASE {DATABASE_NAME}")
+        connection.close()
+
+    print(f"DATABASE_URL={database_url(data_dir)}")
+
+
+def stop(data_dir):
+    subprocess.run([os.path.join(pg_bin_dir(), "pg_ctl"), "-D", os.path.abspath(data_dir), "-m", "fast", "stop"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start or stop a local PostgreSQL for benchmarks")
+    parser.add_argument("action", choices=("start", "stop", "url"))
+    parser.add_argument("--dir", default=os.path.join(os.getenv("TMPDIR", "/tmp"), "bench-pg"), help="data directory")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="server setting, e.g. --set shared_buffers=256MB (repeatable)")
+    args = parser.parse_args()
+
+    if args.action == "start":
+        start(args.dir, args.set)
+    elif args.action == "stop":
+        stop(args.dir)
+    else:
+        print(f"DATABASE_URL={database_url(args.dir)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+import httpx
+
+import datagen
+import scenarios
+
+
+# Load test of the main pages against the data of benchmarks/datagen.py, reporting throughput and
+# p50/p95/p99 latency per scenario. Without --url the application runs in this process through
+# httpx's ASGI transport (lifespan included), which measures the application without a server
+# or network in between; with --url it drives a running deployment, e.g. uvicorn with several workers.
+#
+# Results can be kept as a named baseline (benchmarks/baselines/NAME.json) and later runs compared
+# against it; the comparison exits with status 1 when a scenario's p95 latency or throughput is
+# worse than the baseline by more than --tolerance percent.
+#
+# Usage: python benchmarks/run.py --requests 500 --concurrency 10 --save-baseline main
+#        python benchmarks/run.py --requests 500 --concurrency 10 --compare main
+#        python benchmarks/run.py --url http://localhost:8000 --scenario calendar_admin --scenario todos
+
+BASELINES_DIR = Path(__file__).resolve().parent / "baselines"
+
+
+# Nearest-rank percentile of sorted values
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+async def run_scenario(client, state, scenario, expected, requests, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for number in counter:
+            started = time.perf_counter()
+            try:
+                response = await scenario(client, state, number)
+                failed = response.status_code not in expected
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def run(args):
+    if args.url:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=args.concurrency))
+        base_url = args.url
+        lifespan = None
+    else:
+        # The application resolves templates/ and static/ relative to the working directory
+        os.chdir(ROOT)
+        import main
+        transport = httpx.ASGITransport(app=main.app)
+        base_url = "http://bench"
+        lifespan = main.lifespan(main.app)
+        await lifespan.__aenter__()
+
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+            state = await scenarios.prepare(client, args.seed, args.anchor_date)
+            for name in args.scenario or scenarios.SCENARIOS:
+                scenario, expected = scenarios.SCENARIOS[name]
+                # A short warm-up fills connection pools and caches the way a running server has them
+                await run_scenario(client, state, scenario, expected, args.warmup, args.concurrency)
+                results[name] = await run_scenario(client, state, scenario, expected, args.requests, args.concurrency)
+                print_result(name, results[name])
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+    return results
+
+
+def print_result(name, result):
+    print(f"{name:<16} {result['throughput']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f} ms  "
+          f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']}")
+
+
+def save_baseline(name, args, results):
+    BASELINES_DIR.mkdir(exist_ok=True)
+    path = BASELINES_DIR / f"{name}.json"
+    path.write_text(json.dumps({
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": platform.node(),
+        "python": platform.python_version(),
+        "target": args.url or "in-process",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "anchor_date": args.anchor_date.isoformat(),
+        "results": results,
+    }, indent=2) + "\n")
+    print(f"Baseline written to {path}")
+
+
+# Prints the change against the baseline per scenario; returns the scenarios that regressed
+def compare(name, args, results):
+    baseline = json.loads((BASELINES_DIR / f"{name}.json").read_text())
+    print(f"\nAgainst baseline '{name}' ({baseline['created']}, {baseline['requests']} requests, "
+          f"concurrency {baseline['concurrency']}):")
+    if (baseline["requests"], baseline["concurrency"]) != (args.requests, args.concurrency):
+        print("warning: the baseline was recorded with other --requests/--concurrency values")
+    if baseline.get("anchor_date") != args.anchor_date.isoformat():
+        print("warning: the baseline was recorded against data with another --anchor-date")
+    regressions = []
+    for scenario, result in results.items():
+        before = baseline["results"].get(scenario)
+        if before is None:
+            print(f"{scenario:<16} not in the baseline")
+            continue
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        throughput_change = (result["throughput"] - before["throughput"]) / before["throughput"] * 100
+        regressed = p95_change > args.tolerance or -throughput_change > args.tolerance or result["errors"] > before["errors"]
+        print(f"{scenario:<16} p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms ({p95_change:+.1f}%)  "
+              f"throughput {before['throughput']:.1f} -> {result['throughput']:.1f} req/s ({throughput_change:+.1f}%)"
+              f"{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(scenario)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark scenarios")
+    parser.add_argument("--url", help="base URL of a running server; default: the app in this process")
+    parser.add_argument("--scenario", action="append", choices=list(scenarios.SCENARIOS),
+                        help="scenario to run (repeatable); default: all")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each scenario")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--anchor-date", type=date.fromisoformat, default=datagen.DEFAULT_ANCHOR_DATE,
+                        help="anchor date the benchmark data was generated with (datagen.py --anchor-date)")
+    parser.add_argument("--save-baseline", metavar="NAME", help="store the results as benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare the results with a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=10, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, args, results)
+    if args.compare:
+        regressions = compare(args.compare, args, results)
+        if regressions:
+            sys.exit(f"Regressed beyond {args.tolerance:g}%: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import random
+from datetime import datetime, timedelta
+
+from datagen import ADMIN_USERNAME, BENCH_PASSWORD, expert_username
+
+
+# Scripted request scenarios for benchmarks/run.py, written against the data of benchmarks/datagen.py.
+# A scenario is an async function (client, state, number) sending one request and returning the
+# response; run.py calls it REQUESTS times from CONCURRENCY tasks and times each call. A response
+# with a status outside the scenario's expected ones counts as an error.
+#
+# state is built once per run by prepare(): the session cookies of the admin and of one expert,
+# the ids of experts and customers seen in the data, and a seeded random generator, so the
+# sequence of requests is the same from run to run.
+
+# Months of data the calendar scenarios page through, counted back from the month of the anchor date
+# the data was generated around (datagen.py --anchor-date)
+CALENDAR_MONTHS = 24
+
+
+class State:
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.admin = {}
+        self.expert = {}
+        self.expert_ids = []
+        self.customer_ids = []
+        self.months = []
+        # Free slots for event_add, far in the future and different on every run
+        self.next_slot = datetime(2100, 1, 1) + timedelta(hours=random.SystemRandom().randrange(24 * 365 * 500))
+
+
+async def login(client, username):
+    response = await client.post("/auth/", data={"email": username, "password": BENCH_PASSWORD})
+    token = response.cookies.get("access_token")
+    # Requests pass the cookie of their user explicitly, so nothing may linger in the client's jar
+    client.cookies.clear()
+    if response.status_code != 302 or token is None:
+        raise RuntimeError(f"Could not log in as {username}: is the benchmark data loaded (benchmarks/datagen.py)?")
+    return {"cookie": f"access_token={token}"}
+
+
+def month_window(first):
+    following = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return {"start": first.isoformat() + "T00:00:00", "end": following.isoformat() + "T00:00:00"}
+
+
+async def prepare(client, seed, anchor):
+    state = State(seed)
+    state.admin = await login(client, ADMIN_USERNAME)
+    state.expert = await login(client, expert_username(1))
+
+    first = anchor.replace(day=1)
+    for _ in range(CALENDAR_MONTHS):
+        state.months.append(month_window(first))
+        first = (first - timedelta(days=1)).replace(day=1)
+
+    # Ids for event_add, taken from a past month that has bookings
+    response = await client.get("/calendar/events", params=state.months[1], headers=state.admin)
+    response.raise_for_status()
+    events = response.json()
+    state.expert_ids = sorted({event["uzman_id"] for event in events})
+    state.customer_ids = sorted({event["musteri_id"] for event in events})
+    return state
+
+
+async def calendar_admin(client, state, number):
+    return await client.get("/calendar/events", params=state.rng.choice(state.months), headers=state.admin)
+
+
+async def calendar_expert(client, state, number):
+    return await client.get("/calendar/events", params=state.rng.choice(state.months), headers=state.expert)
+
+
+# First page of the todo list, alternately unfiltered, for one expert and for one status
+async def todos(client, state, number):
+    # What the filter form sends when nothing is picked
+    params = {"uzman_id": "", "status_id": "", "date_from": "", "date_to": ""}
+    if number % 3 == 1 and state.expert_ids:
+        params["uzman_id"] = state.rng.choice(state.expert_ids)
+    elif number % 3 == 2:
+        params["status_id"] = state.rng.choice((0, 1, 2, 3))
+    return await client.get("/todos/", params=params, headers=state.admin)
+
+
+async def home(client, state, number):
+    return await client.get("/home/", headers=state.admin)
+
+
+# A full login, password check included, cycling through the first experts
+async def login_form(client, state, number):
+    response = await client.post("/auth/", data={"email": expert_username(1 + number % 5), "password": BENCH_PASSWORD})
+    client.cookies.clear()
+    return response
+
+
+# One new 30 minute booking per request, each on its own slot so none of them conflict
+async def event_add(client, state, number):
+    start = state.next_slot
+    state.next_slot += timedelta(hours=1)
+    return await client.post("/calendar/event_add", headers=state.admin, data={
+        "description": "bench event_add",
+        "start_time": start.strftime("%Y-%m-%dT%H:%M"),
+        "end_time": (start + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M"),
+        "uzman_id": state.rng.choice(state.expert_ids),
+        "musteri_id": state.rng.choice(state.customer_ids),
+    })
+
+
+# name -> (scenario, expected status codes)
+SCENARIOS = {
+    "calendar_admin": (calendar_admin, {200}),
+    "calendar_expert": (calendar_expert, {200}),
+    "todos": (todos, {200}),
+    "home": (home, {200}),
+    "login": (login_form, {302}),
+    "event_add": (event_add, {302}),
+}
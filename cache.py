@@ -0,0 +1,256 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+import models
+from database import AsyncSessionLocal
+
+# Upper bound for the cached /calendar/events payloads, in approximate bytes
+EVENT_CACHE_MAX_BYTES = int(os.getenv("EVENT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Seconds the reference lists (experts, secretaries, customers, charges, statuses) are served from memory
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "300"))
+
+# Seconds a computed home page dashboard summary is reused
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+
+# Verified access tokens kept by get_current_user
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+
+
+# Rough in-memory footprint of a cached entry, used to enforce the cache's memory cap.
+# Entries are lists of event dicts or, for the iCalendar feeds, lists of rendered bytes chunks.
+def estimate_size(events):
+    size = sys.getsizeof(events)
+    for event in events:
+        size += sys.getsizeof(event)
+        if isinstance(event, dict):
+            for value in event.values():
+                size += sys.getsizeof(value)
+    return size
+
+
+# Two windows overlap unless one ends before the other starts; None means unbounded
+def windows_overlap(start_a, end_a, start_b, end_b):
+    if end_a is not None and start_b is not None and end_a <= start_b:
+        return False
+    if end_b is not None and start_a is not None and end_b <= start_a:
+        return False
+    return True
+
+
+# In-process LRU cache for /calendar/events results and the rendered per-expert iCalendar feeds.
+# Keys are (scope, expert filter, status filter, window start, window end), where scope is the
+# expert id for users restricted to their own bookings, 'ics' for feeds and the role name otherwise.
+# Entries may carry a tag (the response ETag); a lookup with a different tag is a miss, which keeps
+# workers from serving windows another worker has changed since.
+class EventCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (events, size, tag), least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, tag=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[2] != tag:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, events, tag=None):
+        size = estimate_size(events)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (events, size, tag)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    # Drops every cached window that may contain a booking of this expert in [start, end)
+    def invalidate(self, uzman_id, start=None, end=None):
+        with self.lock:
+            for key in list(self.entries):
+                _, expert_filter, _, window_start, window_end = key
+                if expert_filter is not None and expert_filter != uzman_id:
+                    continue
+                if windows_overlap(window_start, window_end, start, end):
+                    self._remove(key)
+
+    # Used when data shown in every event changes (customer or expert names)
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes,
+                    "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+
+event_cache = EventCache(EVENT_CACHE_MAX_BYTES)
+
+
+# Small TTL cache with explicit invalidation, for data read on every page but rarely written
+class TTLCache:
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # record=False leaves the hit/miss counters alone (used for re-checks under a lock)
+    def get(self, key, record=True):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += record
+                return None
+            self.entries.move_to_end(key)
+            self.hits += record
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            if self.maxsize is not None:
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+
+    # Drops the given keys, or everything when called without keys
+    def invalidate(self, *keys):
+        with self.lock:
+            if not keys:
+                self.entries.clear()
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+# Verified JWT claims keyed by the sha256 digest of the token, so raw tokens are never held.
+# Entries expire with the token itself (its exp claim, wall-clock seconds). Revocations are stored in
+# the database and checked before claims are cached (routers/web_auth.py); revoking drops the
+# matching cached claims in every worker, so a hit is always valid.
+class TokenCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # digest -> (exp, claims), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.revocations = 0
+        # Changes on every revocation; claims verified before a revocation are not cached after it
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, digest):
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None or entry[0] <= time.time():
+                self.entries.pop(digest, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, digest, claims, exp, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries.pop(digest, None)
+            self.entries[digest] = (exp, claims)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def revoke_token(self, digest):
+        with self.lock:
+            self.revocations += 1
+            self.generation += 1
+            self.entries.pop(digest, None)
+
+    def revoke_user(self, user_id):
+        with self.lock:
+            self.revocations += 1
+            self.generation += 1
+            for digest, (_, claims) in list(self.entries.items()):
+                if claims["id"] == user_id:
+                    del self.entries[digest]
+
+    # Used when revocations may have been missed (the notification connection was lost)
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                    "revocations": self.revocations}
+
+
+# Queries behind the reference lists rendered into the page dropdowns.
+# Only the columns the templates use are selected, and rows are cached as plain dicts,
+# so cached data never holds on to a session or to fields such as hashed_password.
+REFERENCE_QUERIES = {
+    "uzm": select(models.Users.id, models.Users.ad, models.Users.soyad, models.Users.email,
+                  models.Users.is_active, models.Users.is_delete).where(models.Users.uzman == True),
+    "sek": select(models.Users.id, models.Users.ad, models.Users.soyad, models.Users.email,
+                  models.Users.is_active, models.Users.is_delete).where(models.Users.sekreter == True),
+    "chg": select(models.Charge.id, models.Charge.charge_name, models.Charge.net, models.Charge.tax,
+                  models.Charge.total, models.Charge.is_active, models.Charge.is_delete).where(models.Charge.is_active == True),
+    "sts": select(models.Status.id, models.Status.status_name, models.Status.is_active,
+                  models.Status.is_delete).where(models.Status.is_active == True),
+}
+
+reference_cache = TTLCache(REFERENCE_CACHE_TTL)
+reference_lock = asyncio.Lock()
+
+# Dashboard summaries keyed by (role scope, day); bounded since every expert has their own entry
+dashboard_cache = TTLCache(DASHBOARD_CACHE_TTL, maxsize=1024)
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+# Returns the requested reference lists in order, loading the missing ones in a single session
+async def reference_data(*names):
+    lists = {name: reference_cache.get(name) for name in names}
+    missing = [name for name, rows in lists.items() if rows is None]
+    if missing:
+        # One loader at a time, so a burst of page views after an invalidation runs the queries once
+        async with reference_lock:
+            async with AsyncSessionLocal() as db:
+                for name in missing:
+                    rows = reference_cache.get(name, record=False)
+                    if rows is None:
+                        result = await db.execute(REFERENCE_QUERIES[name])
+                        rows = [dict(row) for row in result.mappings()]
+                        reference_cache.set(name, rows)
+                    lists[name] = rows
+    return tuple(lists[name] for name in names)
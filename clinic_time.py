@@ -0,0 +1,30 @@
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+# Bookings are stored as naive wall-clock times of the clinic, the way the booking forms enter them.
+
+# IANA name of the clinic's timezone (e.g. Europe/Istanbul); the server's local timezone when unset
+CLINIC_TIMEZONE = ZoneInfo(os.environ["CLINIC_TIMEZONE"]) if os.getenv("CLINIC_TIMEZONE") else None
+
+
+# Aware datetimes are converted to the clinic's wall-clock time; naive ones already are
+def to_clinic_time(value):
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(CLINIC_TIMEZONE).replace(tzinfo=None)
+
+
+# Naive UTC time of a clinic wall-clock time, for comparing with UTC timestamps such as change times
+def clinic_to_utc(value):
+    return value.replace(tzinfo=CLINIC_TIMEZONE).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# Current wall-clock time of the clinic, comparable with stored booking times
+def clinic_now():
+    return datetime.now(CLINIC_TIMEZONE).replace(tzinfo=None)
+
+
+# Clinic-local date, which turns at the clinic's midnight rather than UTC's
+def clinic_today():
+    return clinic_now().date()
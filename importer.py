@@ -0,0 +1,344 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import func, insert, or_, select
+
+import models
+from clinic_time import to_clinic_time
+import scheduling
+import live
+import versions
+from cache import event_cache
+from database import SessionLocal
+
+# Bulk appointment import from CSV or iCalendar files.
+#
+# CSV files need a header row with at least start_time, end_time, uzman and musteri columns;
+# description, status_id, charge_id and sekreter are optional. Times are ISO 8601; the app stores
+# the clinic's wall-clock time, so naive values are kept and values with an offset are converted
+# to CLINIC_TIMEZONE (clinic_time.py). uzman, musteri and sekreter hold an email address or a tc
+# number.
+#
+# In .ics files every VEVENT is one appointment: DTSTART/DTEND give the times (floating ones are
+# kept, UTC and TZID ones converted to CLINIC_TIMEZONE), SUMMARY and DESCRIPTION the description,
+# ORGANIZER the expert and the first ATTENDEE the customer (mailto: address or tc). X-STATUS-ID
+# and X-CHARGE-ID optionally carry the status and charge.
+#
+# Records are validated in batches of IMPORT_BATCH_SIZE (one lookup per table per batch) and
+# loaded into todos with a single COPY inside one transaction. By default nothing is loaded
+# when any record is invalid; the report lists the errors per source line either way.
+#
+# Usage: python importer.py bookings.csv [--dry-run] [--skip-invalid]
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+# Defaults used by the booking forms when no status or charge is given
+DEFAULT_STATUS_ID = 0
+DEFAULT_CHARGE_ID = None
+
+TODO_COLUMNS = ("start_time", "end_time", "uzman_id", "sekreter_id", "musteri_id",
+                "charge_id", "status_id", "is_delete", "description")
+
+
+# Yields (line number, record) pairs from a CSV file
+def parse_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    for record in reader:
+        yield reader.line_num, {key.strip().lower(): (value or "").strip()
+                                for key, value in record.items() if key is not None}
+
+
+# Content lines with folded continuation lines joined back, numbered by their first physical line
+def unfold_ics(text):
+    number, current = 0, None
+    for index, line in enumerate(text.splitlines(), start=1):
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield number, current
+        number, current = index, line
+    if current is not None:
+        yield number, current
+
+
+def unescape_ics(value):
+    return (value.replace("\\n", "\n").replace("\\N", "\n")
+            .replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\"))
+
+
+# DTSTART/DTEND whose TZID names no known time zone; validation reports it against the line
+class UnknownTimeZone(ValueError):
+    def __init__(self, tzid):
+        super().__init__(f"unknown time zone {tzid!r}")
+
+
+# DTSTART/DTEND value to a naive clinic wall-clock datetime; the raw value is kept when it does
+# not parse, so validation reports it against the right line
+def parse_ics_datetime(value, params):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is None and "TZID" in params:
+        tzid = params["TZID"].strip('"')
+        try:
+            parsed = parsed.replace(tzinfo=ZoneInfo(tzid))
+        except (ValueError, ZoneInfoNotFoundError):
+            return UnknownTimeZone(tzid)
+    return to_clinic_time(parsed)
+
+
+# Yields (line number, record) pairs, one per VEVENT of an iCalendar file
+def parse_ics(text):
+    record = None
+    for number, line in unfold_ics(text):
+        if line == "BEGIN:VEVENT":
+            record, start = {}, number
+        elif line == "END:VEVENT" and record is not None:
+            yield start, record
+            record = None
+        elif record is not None and ":" in line:
+            head, value = line.split(":", 1)
+            name, *params = head.split(";")
+            params = dict(param.split("=", 1) for param in params if "=" in param)
+            name = name.upper()
+            if name == "DTSTART":
+                record["start_time"] = parse_ics_datetime(value, params)
+            elif name == "DTEND":
+                record["end_time"] = parse_ics_datetime(value, params)
+            elif name in ("SUMMARY", "DESCRIPTION"):
+                text_value = unescape_ics(value).strip()
+                record["description"] = " ".join(filter(None, [record.get("description"), text_value]))
+            elif name == "ORGANIZER":
+                record["uzman"] = value.removeprefix("mailto:").removeprefix("MAILTO:")
+            elif name == "ATTENDEE" and "musteri" not in record:
+                record["musteri"] = value.removeprefix("mailto:").removeprefix("MAILTO:")
+            elif name == "X-STATUS-ID":
+                record["status_id"] = value
+            elif name == "X-CHARGE-ID":
+                record["charge_id"] = value
+
+
+# Picks the parser from the file name, falling back to sniffing the content
+def read_records(filename, content):
+    text = content.decode("utf-8-sig") if isinstance(content, bytes) else content
+    if (filename or "").lower().endswith(".ics") or text.lstrip().startswith("BEGIN:VCALENDAR"):
+        return parse_ics(text)
+    return parse_csv(text)
+
+
+def to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, UnknownTimeZone):
+        raise value
+    return to_clinic_time(datetime.fromisoformat(value))
+
+
+def to_id(value, default):
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+# A person reference is a tc number when it is all digits and an email address otherwise
+def person_key(value):
+    value = (value or "").strip()
+    return int(value) if value.isdigit() else value.lower()
+
+
+# Maps person keys to ids with one query per table; keys matching several rows map to None
+def resolve_people(db, model, keys, *criteria):
+    tcs = {key for key in keys if isinstance(key, int)}
+    emails = {key for key in keys if isinstance(key, str) and key}
+    if not tcs and not emails:
+        return {}
+    query = (
+        select(model.id, model.tc, func.lower(model.email))
+        .where(model.is_delete.isnot(True), *criteria)
+        .where(or_(model.tc.in_(list(tcs)), func.lower(model.email).in_(list(emails))))
+    )
+    found = {}
+    for person_id, tc, email in db.execute(query):
+        for key in (tc, email):
+            if key in keys:
+                found[key] = person_id if found.get(key, person_id) == person_id else None
+    return found
+
+
+# Validates one batch of records; returns the todo rows and the per-line error entries
+def validate_batch(db, batch, reference_ids, sekreter_id):
+    people = {"uzman": set(), "musteri": set(), "sekreter": set()}
+    for _, record in batch:
+        for field, keys in people.items():
+            if record.get(field):
+                keys.add(person_key(record[field]))
+
+    experts = resolve_people(db, models.Users, people["uzman"], models.Users.uzman == True)
+    customers = resolve_people(db, models.Customers, people["musteri"])
+    secretaries = resolve_people(db, models.Users, people["sekreter"], models.Users.sekreter == True)
+
+    rows, errors = [], []
+    for line, record in batch:
+        problems = []
+
+        def lookup(field, resolved, label):
+            if not record.get(field):
+                problems.append(f"{field} is required")
+                return None
+            person_id = resolved.get(person_key(record[field]))
+            if person_id is None:
+                reason = "matches several records" if person_key(record[field]) in resolved else "not found"
+                problems.append(f"{label} {record[field]!r} {reason}")
+            return person_id
+
+        times = {}
+        for field in ("start_time", "end_time"):
+            if not record.get(field):
+                problems.append(f"{field} is required")
+                continue
+            try:
+                times[field] = to_datetime(record[field])
+            except UnknownTimeZone as error:
+                problems.append(f"{field}: {error}")
+            except (TypeError, ValueError):
+                problems.append(f"invalid {field} {record[field]!r}")
+        if len(times) == 2 and times["end_time"] <= times["start_time"]:
+            problems.append("end_time must be after start_time")
+
+        uzman_id = lookup("uzman", experts, "expert")
+        musteri_id = lookup("musteri", customers, "customer")
+        row_sekreter_id = lookup("sekreter", secretaries, "secretary") if record.get("sekreter") else sekreter_id
+
+        ids = {}
+        for field, default in (("status_id", DEFAULT_STATUS_ID), ("charge_id", DEFAULT_CHARGE_ID)):
+            try:
+                ids[field] = to_id(record.get(field), default)
+            except ValueError:
+                problems.append(f"invalid {field} {record[field]!r}")
+                continue
+            if ids[field] is not None and ids[field] not in reference_ids[field]:
+                problems.append(f"unknown {field} {ids[field]}")
+
+        if problems:
+            errors.append({"line": line, "errors": problems})
+            continue
+
+        rows.append({
+            "start_time": times["start_time"],
+            "end_time": times["end_time"],
+            "uzman_id": uzman_id,
+            "sekreter_id": row_sekreter_id,
+            "musteri_id": musteri_id,
+            "charge_id": ids["charge_id"],
+            "status_id": ids["status_id"],
+            "is_delete": False,
+            "description": record.get("description") or None,
+        })
+    return rows, errors
+
+
+# Loads the rows with COPY when the session runs on psycopg2, otherwise with a multi-row INSERT
+def load_todos(db, rows):
+    cursor = db.connection().connection.cursor()
+    if not hasattr(cursor, "copy_expert"):
+        db.execute(insert(models.Todos), rows)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # None is written as an unquoted empty field, which COPY reads as NULL
+        writer.writerow([row[column] for column in TODO_COLUMNS])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY todos ({', '.join(TODO_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+# Validates and loads the records of one file; returns the per-row report.
+# sekreter_id is recorded on rows without their own sekreter column (the importing user).
+def import_records(records, sekreter_id=None, skip_invalid=False, dry_run=False):
+    rows, errors, received = [], [], 0
+    with SessionLocal() as db:
+        reference_ids = {
+            "status_id": set(db.scalars(select(models.Status.id))),
+            "charge_id": set(db.scalars(select(models.Charge.id))),
+        }
+        batch = []
+        for line, record in records:
+            received += 1
+            batch.append((line, record))
+            if len(batch) == IMPORT_BATCH_SIZE:
+                valid, invalid = validate_batch(db, batch, reference_ids, sekreter_id)
+                rows += valid
+                errors += invalid
+                batch = []
+        if batch:
+            valid, invalid = validate_batch(db, batch, reference_ids, sekreter_id)
+            rows += valid
+            errors += invalid
+
+        windows = {}
+        for row in rows:
+            start, end = windows.get(row["uzman_id"], (row["start_time"], row["end_time"]))
+            windows[row["uzman_id"]] = (min(start, row["start_time"]), max(end, row["end_time"]))
+
+        load = rows and not dry_run and (skip_invalid or not errors)
+        if load:
+            try:
+                load_todos(db, rows)
+                versions.bump(db, *versions.todo_scopes(*windows))
+                # Generated occurrences of recurring series are not covered by the exclusion constraint
+                scheduling.lock_experts(db, *windows)
+                if scheduling.slots_hit_occurrences(db, [(row["uzman_id"], row["start_time"], row["end_time"])
+                                                         for row in rows]):
+                    db.rollback()
+                    errors.append({"line": None, "errors": ["overlapping bookings: the file overlaps "
+                                                            "occurrences of recurring appointments"]})
+                    load = False
+                else:
+                    live.publish(db, [(uzman_id, start, end) for uzman_id, (start, end) in windows.items()], refetch=True)
+                    db.commit()
+            except Exception as error:
+                db.rollback()
+                if not scheduling.is_overlap_violation(error):
+                    raise
+                # The exclusion constraint names the first clashing pair; nothing was loaded
+                detail = getattr(getattr(getattr(error, "orig", error), "diag", None), "message_detail", None)
+                errors.append({"line": None, "errors": [f"overlapping bookings: {detail or error}"]})
+                load = False
+
+    if load:
+        for uzman_id, (start, end) in windows.items():
+            event_cache.invalidate(uzman_id, start, end)
+
+    return {"received": received, "valid": len(rows), "imported": len(rows) if load else 0,
+            "dry_run": dry_run, "errors": errors}
+
+
+def import_file(filename, content, sekreter_id=None, skip_invalid=False, dry_run=False):
+    return import_records(read_records(filename, content), sekreter_id, skip_invalid, dry_run)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import appointments from a CSV or .ics file")
+    parser.add_argument("path")
+    parser.add_argument("--dry-run", action="store_true", help="validate only, load nothing")
+    parser.add_argument("--skip-invalid", action="store_true", help="load the valid rows even when others fail")
+    parser.add_argument("--sekreter-id", type=int, help="secretary recorded on rows without a sekreter column")
+    args = parser.parse_args()
+
+    with open(args.path, "rb") as file:
+        report = import_file(args.path, file.read(), args.sekreter_id, args.skip_invalid, args.dry_run)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if report["errors"] and not report["imported"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
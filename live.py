@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+import asyncpg
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from cache import event_cache
+from database import SQLALCHEMY_DATABASE_URL
+
+# Live calendar updates.
+# Todo writes queue a notification on their session with publish(); it is sent with pg_notify
+# inside the write transaction just before commit, so PostgreSQL delivers it to every worker once
+# the change is committed and never when it is rolled back. Each worker holds one LISTEN connection
+# (Broker), drops the affected windows from its event cache, resolves the changed todos once and
+# pushes the resulting deltas to its Server-Sent Events subscribers, scoped per expert.
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "todo_changes"
+
+# Deltas buffered per subscriber; a subscriber falling further behind is told to refetch instead
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "256"))
+
+# Seconds between keep-alive queries on the LISTEN connection (and between reconnect attempts)
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "30"))
+
+PENDING_KEY = "live_notifications"
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+
+# Queues a notification for the session's next commit.
+# slots are the (uzman_id, start, end) windows touched by the write; todos are the changed Todos
+# (instances or ids), whose current state subscribers receive. refetch=True asks subscribers of the
+# affected experts to reload their view instead, for changes that are not single todos
+# (recurring series, bulk imports).
+def publish(db, slots, todos=(), refetch=False):
+    db.info.setdefault(PENDING_KEY, []).append((list(slots), list(todos), refetch))
+
+
+def encode_time(value):
+    return value.isoformat() if value is not None else None
+
+
+def decode_time(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def encode_message(slots, ids, refetch):
+    return json.dumps({
+        "slots": [[uzman_id, encode_time(start), encode_time(end)] for uzman_id, start, end in slots],
+        "ids": ids,
+        "refetch": refetch,
+    })
+
+
+# Payloads of one published change. A change too large for a single NOTIFY (a big batch of moves,
+# an import spanning many experts) becomes a refetch of each affected expert's overall window,
+# spread over as many notifications as needed.
+def encode_payloads(slots, ids, refetch):
+    payload = encode_message(slots, ids, refetch)
+    if len(payload.encode()) < MAX_PAYLOAD_BYTES:
+        return [payload]
+
+    windows = {}
+    for uzman_id, start, end in slots:
+        if uzman_id in windows:
+            first, last = windows[uzman_id]
+            # A missing bound means the window is open on that side
+            start = None if start is None or first is None else min(start, first)
+            end = None if end is None or last is None else max(end, last)
+        windows[uzman_id] = (start, end)
+
+    payloads, chunk, size = [], [], len(encode_message([], [], True))
+    for uzman_id, (start, end) in windows.items():
+        slot_size = len(json.dumps([uzman_id, encode_time(start), encode_time(end)])) + len(", ")
+        if chunk and size + slot_size >= MAX_PAYLOAD_BYTES:
+            payloads.append(encode_message(chunk, [], True))
+            chunk, size = [], len(encode_message([], [], True))
+        chunk.append((uzman_id, start, end))
+        size += slot_size
+    payloads.append(encode_message(chunk, [], True))
+    return payloads
+
+
+# Sends a notification on another channel (see Broker.on) as part of the session's transaction
+def notify(db, channel, payload):
+    db.execute(select(func.pg_notify(channel, payload)))
+
+
+@event.listens_for(Session, "before_commit")
+def send_notifications(session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if not pending:
+        return
+    # New todos only get their ids when flushed
+    session.flush()
+    for slots, todos, refetch in pending:
+        ids = [todo if isinstance(todo, int) else todo.id for todo in todos]
+        for payload in encode_payloads(slots, ids, refetch):
+            session.execute(select(func.pg_notify(CHANNEL, payload)))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def drop_notifications(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+class Subscriber:
+    def __init__(self, scope):
+        self.scope = scope  # Expert id the subscriber is restricted to, None for all experts
+        self.queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+
+    def push(self, kind, data):
+        try:
+            self.queue.put_nowait((kind, data))
+        except asyncio.QueueFull:
+            # Too far behind to patch the view: start over from a full reload
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(("refetch", {}))
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    def __init__(self):
+        self.subscribers = set()
+        self.resolve = None
+        self.messages = asyncio.Queue()
+        self.handlers = {CHANNEL: self.messages.put_nowait}  # channel -> handler(payload)
+        self.reconnect_handlers = []  # called on every (re)connect, as notifications may have been missed
+        self.tasks = []
+        self.connected = False
+        self.metrics = {"notifications": 0, "deltas": 0, "reconnects": 0}
+
+    def subscribe(self, scope):
+        subscriber = Subscriber(scope)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    # Registers a handler for another channel heard on the same connection; it runs on the event loop
+    def on(self, channel, handler):
+        self.handlers[channel] = handler
+
+    # Registers a handler run whenever the connection is (re-)established, to drop state that may have
+    # missed notifications
+    def on_reconnect(self, handler):
+        self.reconnect_handlers.append(handler)
+
+    # resolve(ids) loads the current calendar events of the given todo ids, keyed by id;
+    # ids missing from the result were deleted
+    async def start(self, resolve):
+        self.resolve = resolve
+        self.tasks = [asyncio.create_task(self.listen()), asyncio.create_task(self.dispatch())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self):
+        return {"subscribers": len(self.subscribers), "connected": self.connected, **self.metrics}
+
+    async def listen(self):
+        first = True
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(SQLALCHEMY_DATABASE_URL)
+                for channel in self.handlers:
+                    await connection.add_listener(channel, self.on_notify)
+                self.connected = True
+                # Includes the first connection, since requests may be served before it is up
+                for handler in self.reconnect_handlers:
+                    handler()
+                if not first:
+                    # Notifications sent while disconnected are lost: drop cached windows, reload views
+                    self.metrics["reconnects"] += 1
+                    event_cache.clear()
+                    for subscriber in list(self.subscribers):
+                        subscriber.push("refetch", {})
+                first = False
+                while True:
+                    await asyncio.sleep(LIVE_KEEPALIVE_SECONDS)
+                    await connection.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("LISTEN %s connection failed: %r", CHANNEL, e)
+            finally:
+                self.connected = False
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(LIVE_KEEPALIVE_SECONDS if first else 1)
+
+    def on_notify(self, connection, pid, channel, payload):
+        self.handlers[channel](payload)
+
+    # Messages are handled one at a time, so subscribers see the changes in commit order
+    async def dispatch(self):
+        while True:
+            payload = await self.messages.get()
+            try:
+                await self.handle(json.loads(payload))
+            except Exception as e:
+                logger.exception("Could not dispatch %s notification: %r", CHANNEL, e)
+
+    async def handle(self, message):
+        self.metrics["notifications"] += 1
+        experts = set()
+        for uzman_id, start, end in message["slots"]:
+            experts.add(uzman_id)
+            event_cache.invalidate(uzman_id, decode_time(start), decode_time(end))
+
+        if not self.subscribers:
+            return
+        events = {}
+        if message["ids"] and not message["refetch"]:
+            events = await self.resolve(message["ids"])
+            experts.update(event["uzman_id"] for event in events.values())
+
+        for subscriber in list(self.subscribers):
+            if subscriber.scope is not None and subscriber.scope not in experts:
+                continue
+            if message["refetch"]:
+                subscriber.push("refetch", {})
+                continue
+            for todo_id in message["ids"]:
+                event = events.get(todo_id)
+                if event is not None and subscriber.scope in (None, event["uzman_id"]):
+                    subscriber.push("upsert", event)
+                else:
+                    # Deleted, or moved to an expert this subscriber does not see
+                    subscriber.push("delete", {"id": todo_id})
+                self.metrics["deltas"] += 1
+
+
+broker = Broker()
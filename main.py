@@ -1,17 +1,61 @@
-import models
-from database import engine
-from routers import web_auth, web_home, web_todos, web_customers, web_calendar, web_charges, web_documents
+import time
+
+# Boot time is measured from here, before the application modules are imported
+import_started = time.perf_counter()
+
+import logging
+import os
+from contextlib import asynccontextmanager
+
+import live
+import migrate
+from routers import web_auth, web_home, web_todos, web_customers, web_calendar, web_charges, web_documents, web_internal, web_reports
 from starlette.staticfiles import StaticFiles
 from starlette import status
 from starlette.responses import RedirectResponse
 from middlewares.exception import ExceptionHandlerMiddleware
+from middlewares.metrics import MetricsMiddleware
+from middlewares.querystats import QueryStatsMiddleware
 from fastapi import FastAPI
 
-# Initialize FastAPI application
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# The schema is managed by migrate.py; workers only check it is current (one query) unless
+# SKIP_SCHEMA_CHECK is set, e.g. for rolling restarts of a fleet already known to be migrated
+SKIP_SCHEMA_CHECK = os.getenv("SKIP_SCHEMA_CHECK", "").lower() in ("1", "true", "yes")
+
+# Milliseconds a worker may take from import to serving; slower boots are logged as warnings
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "2000"))
+
+imports_done = time.perf_counter()
 
-# Create database tables based on the models if they don't exist
-models.Base.metadata.create_all(bind=engine)
+# Check the schema and start the LISTEN connection that feeds /calendar/live for the lifetime
+# of the worker. Each boot logs where its time went.
+@asynccontextmanager
+async def lifespan(app):
+    phases = {"imports": imports_done - import_started}
+
+    if not SKIP_SCHEMA_CHECK:
+        started = time.perf_counter()
+        migrate.check_schema()
+        phases["schema_check"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await live.broker.start(web_calendar.live_events)
+    phases["live"] = time.perf_counter() - started
+
+    total_ms = (time.perf_counter() - import_started) * 1000
+    summary = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in phases.items())
+    if total_ms > STARTUP_BUDGET_MS:
+        logger.warning("Startup took %.0f ms, over the %.0f ms budget (%s)", total_ms, STARTUP_BUDGET_MS, summary)
+    else:
+        logger.info("Startup took %.0f ms (%s)", total_ms, summary)
+
+    yield
+    await live.broker.stop()
+
+# Initialize FastAPI application
+app = FastAPI(lifespan=lifespan)
 
 # Mount the static files directory for serving static assets (e.g., CSS, JS, images)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -24,6 +68,10 @@ async def root():
 
 # Add custom middleware to handle exceptions
 app.add_middleware(ExceptionHandlerMiddleware)
+# Count the SQL statements of each request into a Server-Timing header and flag likely N+1 queries
+app.add_middleware(QueryStatsMiddleware)
+# Record per-route request metrics; added last so it is outermost and also sees the error responses
+app.add_middleware(MetricsMiddleware)
 
 # Include various routers for handling different sections of the web application
 app.include_router(web_auth.router)        # Authentication routes
@@ -32,3 +80,6 @@ app.include_router(web_todos.router)       # Todo management routes
 app.include_router(web_customers.router)   # Customer management routes
 app.include_router(web_calendar.router)    # Calendar management routes
 app.include_router(web_charges.router)     # Charge management routes
+app.include_router(web_reports.router)     # Revenue reports
+app.include_router(web_internal.router)    # Operational endpoints (pool metrics)
+app.include_router(web_internal.metrics_router)  # Prometheus metrics
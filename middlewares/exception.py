@@ -1,25 +1,41 @@
 from traceback import print_exception
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import FastAPI, Request
 
-# Initialize FastAPI application
-app = FastAPI()
+# Custom middleware to handle exceptions globally.
+# A plain ASGI middleware: unlike BaseHTTPMiddleware it runs the request in the same task and
+# passes the response stream through untouched, so it costs nothing on the way out.
+class ExceptionHandlerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
 
-# Custom middleware to handle exceptions globally
-class ExceptionHandlerMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
         try:
             # Attempt to process the incoming request and pass it to the next middleware or route handler
-            return await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
             # If an exception occurs, print the traceback details to the console
             print_exception(e)
+            # Once the status line is sent (a failing stream) no error response can follow
+            if response_started:
+                raise
             # Return a JSON response with status code 500 (Internal Server Error)
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=500,
                 content={
                     'error': e.__class__.__name__,  # Include the exception class name in the response
                     'messages': e.args  # Include the error message(s) in the response
                 }
             )
+            await response(scope, receive, send)
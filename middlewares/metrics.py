@@ -0,0 +1,164 @@
+import os
+import time
+
+from starlette.routing import Mount
+
+# Request metrics in the Prometheus text format, served on /metrics (routers/web_internal.py).
+#
+# MetricsMiddleware is a plain ASGI middleware recording, per route template (e.g. /todos/todos_edit/{todo_id},
+# so ids do not multiply the series): request counts by status code, a latency histogram and a
+# response size histogram, plus a gauge of requests in progress. Requests matching no route are
+# counted under the route label "unmatched". The values live in the memory of one worker process
+# and are not aggregated across processes: behind one port with several workers (uvicorn --workers N)
+# each scrape reaches a random worker and the counters jump between the workers' values. Scrape a
+# single-worker process, or give every worker its own port and scrape each one.
+
+# Upper bounds of the latency buckets in seconds and of the response size buckets in bytes
+LATENCY_BUCKETS = tuple(float(bound) for bound in os.getenv(
+    "METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(","))
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (last one +Inf), sum]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+
+    def samples(self):
+        bucket_labels = self.labels + ("le",)
+        for label_values, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(bucket_labels, label_values + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}"
+
+
+requests_total = Counter("http_requests_total", "HTTP requests by route and status code",
+                         ("method", "route", "status"))
+request_duration = Histogram("http_request_duration_seconds", "Time from request to the end of the response",
+                             ("method", "route"))
+response_size = Histogram("http_response_size_bytes", "Size of the response bodies",
+                          ("method", "route"), SIZE_BUCKETS)
+requests_in_progress = Gauge("http_requests_in_progress", "Requests being served, open streams included",
+                             ("method",))
+
+METRICS = [requests_total, request_duration, response_size, requests_in_progress]
+
+
+# Text exposition of the request metrics followed by extra (name, kind, help, value) gauges
+def render(extra=()):
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    for name, kind, help_text, value in extra:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        # endpoint -> route template (mounted apps -> their path prefix), read from the app on first use
+        self.endpoints = None
+
+    def route_label(self, application, scope):
+        if self.endpoints is None:
+            self.endpoints = {}
+            for route in getattr(application, "routes", ()):
+                if isinstance(route, Mount):
+                    self.endpoints[route.app] = route.path
+                elif hasattr(route, "endpoint"):
+                    self.endpoints[route.endpoint] = route.path
+        return self.endpoints.get(scope.get("endpoint"), UNMATCHED_ROUTE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # The router replaces scope["app"] inside mounts, so the application is taken up front
+        application = scope.get("app")
+        method = scope["method"]
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        requests_in_progress.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Routing stores the matched endpoint in the scope, so the label is known afterwards
+            route = self.route_label(application, scope)
+            requests_in_progress.dec(method)
+            requests_total.inc(method, route, status_code)
+            request_duration.observe(time.perf_counter() - started, method, route)
+            response_size.observe(size, method, route)
@@ -0,0 +1,46 @@
+import logging
+import os
+
+from starlette.datastructures import MutableHeaders
+
+from database import QueryStats, request_queries
+
+logger = logging.getLogger(__name__)
+
+# A statement text run this many times within one request is reported as a likely N+1 query,
+# typically a lazy relationship loaded once per row of a listing
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+
+# Counts the SQL statements of each request (see the cursor hooks in database.py) and reports
+# them in a Server-Timing header, e.g. 'db;dur=12.4;desc="7 queries"', visible in the browser's
+# network panel. Statements run after the headers went out (streamed responses) still count
+# towards the N+1 check, which runs once the request is done.
+class QueryStatsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"')
+                repeated = stats.repeated(N_PLUS_ONE_THRESHOLD)
+                if repeated:
+                    headers.append("Server-Timing", f'db-repeated;desc="{len(repeated)} repeated statements"')
+            await send(message)
+
+        token = request_queries.set(stats)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_queries.reset(token)
+            for statement, count in stats.repeated(N_PLUS_ONE_THRESHOLD):
+                logger.warning("Possible N+1 query on %s %s: %d executions of %s",
+                               scope["method"], scope["path"], count, statement)
@@ -0,0 +1,144 @@
+import argparse
+import hashlib
+import logging
+import re
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from database import engine
+
+# Versioned schema migrations.
+#
+# Every change to the schema is a file migrations/NNNN_description.sql, applied once and in order
+# of NNNN, each in its own transaction, and recorded in schema_migrations with a checksum of the
+# file. Migrations run at deploy time (python migrate.py, the Procfile release step), never when a
+# worker starts: workers only compare the recorded version with the newest file (check_schema), a
+# single query, and refuse to start on a database that is behind.
+#
+# Usage: python migrate.py [--status]
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+
+MIGRATION_FILE = re.compile(r"^(\d{4})_[\w-]+\.sql$")
+
+# pg_advisory_lock key serialising concurrent migration runs (e.g. two deploys at once)
+MIGRATION_LOCK_ID = 420190001
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+# (version, path) of every migration file, in order
+def available_migrations():
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        match = MIGRATION_FILE.match(path.name)
+        if match is None:
+            raise ValueError(f"Unexpected file in {MIGRATIONS_DIR}: {path.name}")
+        migrations.append((int(match.group(1)), path))
+    return migrations
+
+
+def checksum(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+# version -> checksum of the applied migrations; empty before the first run
+def applied_migrations(connection):
+    try:
+        with connection.begin_nested():
+            rows = connection.execute(text("SELECT version, checksum FROM schema_migrations")).all()
+    except ProgrammingError:
+        return {}
+    return dict(rows)
+
+
+# Applies the pending migrations; returns the applied (version, file name) pairs
+def migrate():
+    applied = []
+    with engine.connect() as connection:
+        # Index builds may take longer than DB_STATEMENT_TIMEOUT_MS allows request queries
+        connection.execute(text("SET statement_timeout = 0"))
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_ID})
+        connection.commit()
+        try:
+            with connection.begin():
+                connection.execute(text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    " version integer PRIMARY KEY,"
+                    " name varchar NOT NULL,"
+                    " checksum varchar NOT NULL,"
+                    " applied_at timestamp NOT NULL DEFAULT now())"
+                ))
+            done = applied_migrations(connection)
+            connection.commit()
+            for version, path in available_migrations():
+                if version in done:
+                    if done[version] != checksum(path):
+                        logger.warning("Migration %s was changed after it was applied", path.name)
+                    continue
+                started = time.perf_counter()
+                with connection.begin():
+                    # Plain driver call, so the file may hold several statements and DO blocks
+                    connection.exec_driver_sql(path.read_text())
+                    connection.execute(
+                        text("INSERT INTO schema_migrations (version, name, checksum) VALUES (:version, :name, :checksum)"),
+                        {"version": version, "name": path.name, "checksum": checksum(path)},
+                    )
+                logger.info("Applied %s in %.0f ms", path.name, (time.perf_counter() - started) * 1000)
+                applied.append((version, path.name))
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_ID})
+            connection.execute(text("RESET statement_timeout"))
+            connection.commit()
+    return applied
+
+
+# Startup check: raises SchemaOutOfDate when migrations are pending
+def check_schema():
+    latest = max((version for version, _ in available_migrations()), default=0)
+    with engine.connect() as connection:
+        try:
+            current = connection.execute(text("SELECT max(version) FROM schema_migrations")).scalar() or 0
+        except ProgrammingError:
+            current = 0
+    if current < latest:
+        raise SchemaOutOfDate(f"Database schema is at version {current}, the code expects {latest}; "
+                              f"run 'python migrate.py' (or set SKIP_SCHEMA_CHECK=1 to start anyway)")
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the pending schema migrations")
+    parser.add_argument("--status", action="store_true", help="list the migrations and whether they are applied")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.status:
+        with engine.connect() as connection:
+            done = applied_migrations(connection)
+        pending = 0
+        for version, path in available_migrations():
+            if version not in done:
+                state = "pending"
+                pending += 1
+            elif done[version] != checksum(path):
+                state = "applied, file changed since"
+            else:
+                state = "applied"
+            print(f"{path.name}: {state}")
+        sys.exit(1 if pending else 0)
+
+    applied = migrate()
+    print(f"{len(applied)} migration(s) applied" if applied else "Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
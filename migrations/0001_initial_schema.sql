@@ -0,0 +1,164 @@
+-- Baseline schema, matching models.py.
+-- Written to be idempotent: databases created earlier by Base.metadata.create_all or by the old
+-- create_tables.py script are brought to the same state without touching their data.
+
+CREATE TABLE IF NOT EXISTS public.users
+(
+    id serial NOT NULL,  -- Auto-incrementing ID for users
+    tc integer,  -- National ID number
+    ad varchar,  -- First name
+    soyad varchar,  -- Last name
+    email varchar,  -- Email address, unique
+    telno varchar,  -- Phone number
+    username varchar,  -- Username, unique
+    hashed_password varchar,  -- Password (hashed)
+    role varchar,  -- User role (e.g., admin, user)
+    owner boolean,  -- Flag indicating if the user is an owner
+    uzman boolean,  -- Flag indicating if the user is an expert
+    sekreter boolean,  -- Flag indicating if the user is a secretary
+    is_active boolean,  -- Flag indicating if the user is active
+    is_delete boolean,  -- Flag indicating if the user is marked as deleted
+    CONSTRAINT users_pkey PRIMARY KEY (id),  -- Primary key constraint
+    CONSTRAINT users_email_key UNIQUE (email),  -- Unique constraint for email
+    CONSTRAINT users_username_key UNIQUE (username)  -- Unique constraint for username
+);
+
+CREATE TABLE IF NOT EXISTS public.customers
+(
+    id serial NOT NULL,  -- Auto-incrementing ID for customers
+    tc integer,  -- National ID number
+    ad varchar,  -- First name
+    soyad varchar,  -- Last name
+    email varchar,  -- Email address, unique
+    telno varchar,  -- Phone number
+    info varchar,  -- Additional customer information
+    address1 varchar,  -- Address
+    city varchar,  -- City
+    url varchar,  -- Website or URL for the customer
+    is_active boolean,  -- Flag indicating if the customer is active
+    is_delete boolean,  -- Flag indicating if the customer is marked as deleted
+    CONSTRAINT customers_pkey PRIMARY KEY (id),  -- Primary key constraint
+    CONSTRAINT customers_email_key UNIQUE (email)  -- Unique constraint for email
+);
+
+-- create_tables.py created customers without url
+ALTER TABLE public.customers ADD COLUMN IF NOT EXISTS url varchar;
+
+CREATE TABLE IF NOT EXISTS public.charge
+(
+    id serial NOT NULL,  -- Auto-incrementing ID for charges
+    net numeric(10, 2),  -- Net charge amount
+    tax numeric(10, 2),  -- Tax amount
+    total numeric(10, 2),  -- Total charge amount
+    charge_name varchar,  -- Charge description
+    is_active boolean,  -- Flag indicating if the charge is active
+    is_delete boolean,  -- Flag indicating if the charge is marked as deleted
+    CONSTRAINT charge_pkey PRIMARY KEY (id)  -- Primary key constraint
+);
+
+CREATE TABLE IF NOT EXISTS public.status
+(
+    id serial NOT NULL,  -- Auto-incrementing ID for status entries
+    status_name varchar,  -- Status description
+    is_active boolean,  -- Flag indicating if the status is active
+    is_delete boolean,  -- Flag indicating if the status is marked as deleted
+    CONSTRAINT status_pkey PRIMARY KEY (id)  -- Primary key constraint
+);
+
+CREATE TABLE IF NOT EXISTS public.documents
+(
+    id serial NOT NULL,  -- Auto-incrementing ID for documents
+    file varchar,  -- File name or path
+    content varchar,  -- Document content or description
+    path varchar,  -- Path to the file
+    size integer,  -- Size of the file
+    customer_id integer REFERENCES public.customers (id),  -- Foreign key to the customer
+    CONSTRAINT documents_pkey PRIMARY KEY (id)  -- Primary key constraint
+);
+
+CREATE TABLE IF NOT EXISTS public.todo_series
+(
+    id serial NOT NULL,  -- Auto-incrementing ID for recurring series
+    dtstart timestamp,  -- Start of the first occurrence
+    duration_minutes integer,  -- Length of every occurrence
+    rrule varchar,  -- RFC 5545 recurrence rule, e.g. 'FREQ=WEEKLY;COUNT=12'
+    exdates timestamp[],  -- Starts of the cancelled occurrences
+    last_end timestamp,  -- End of the last occurrence, NULL when the rule never ends
+    uzman_id integer REFERENCES public.users (id),  -- Foreign key to the expert user
+    sekreter_id integer REFERENCES public.users (id),  -- Foreign key to the secretary user
+    musteri_id integer REFERENCES public.customers (id),  -- Foreign key to the customer
+    charge_id integer REFERENCES public.charge (id),  -- Foreign key to the charge
+    status_id integer REFERENCES public.status (id),  -- Foreign key to the status
+    is_delete boolean,  -- Flag indicating if the series is marked as deleted
+    description varchar,  -- Description shared by the occurrences
+    CONSTRAINT todo_series_pkey PRIMARY KEY (id)  -- Primary key constraint
+);
+
+CREATE TABLE IF NOT EXISTS public.todos
+(
+    id serial NOT NULL,  -- Auto-incrementing ID for tasks
+    start_time timestamp,  -- Task start time
+    end_time timestamp,  -- Task end time
+    uzman_id integer REFERENCES public.users (id),  -- Foreign key to the expert user
+    sekreter_id integer REFERENCES public.users (id),  -- Foreign key to the secretary user
+    musteri_id integer REFERENCES public.customers (id),  -- Foreign key to the customer
+    charge_id integer REFERENCES public.charge (id),  -- Foreign key to the charge
+    status_id integer REFERENCES public.status (id),  -- Foreign key to the status
+    is_delete boolean,  -- Flag indicating if the task is marked as deleted
+    description varchar,  -- Task description
+    CONSTRAINT todos_pkey PRIMARY KEY (id)  -- Primary key constraint
+);
+
+-- Todos rows overriding a single occurrence of a series
+ALTER TABLE public.todos ADD COLUMN IF NOT EXISTS series_id integer REFERENCES public.todo_series (id);
+ALTER TABLE public.todos ADD COLUMN IF NOT EXISTS recurrence_id timestamp;
+
+CREATE TABLE IF NOT EXISTS public.change_versions
+(
+    scope varchar NOT NULL,  -- Data scope, e.g. 'todos', 'todos:uzman:4', 'customers'
+    version integer NOT NULL DEFAULT 0,  -- Incremented on every committed change in the scope
+    updated_at timestamp,  -- Time of the last change in the scope
+    CONSTRAINT change_versions_pkey PRIMARY KEY (scope)  -- Primary key constraint
+);
+
+-- Primary key lookups (the models declare index=True on every id column)
+CREATE INDEX IF NOT EXISTS ix_users_id ON public.users (id);
+CREATE INDEX IF NOT EXISTS ix_customers_id ON public.customers (id);
+CREATE INDEX IF NOT EXISTS ix_charge_id ON public.charge (id);
+CREATE INDEX IF NOT EXISTS ix_status_id ON public.status (id);
+CREATE INDEX IF NOT EXISTS ix_documents_id ON public.documents (id);
+CREATE INDEX IF NOT EXISTS ix_todo_series_id ON public.todo_series (id);
+CREATE INDEX IF NOT EXISTS ix_todos_id ON public.todos (id);
+
+-- Indexes backing the date-windowed calendar feed (/calendar/events)
+CREATE INDEX IF NOT EXISTS ix_todos_uzman_start_end
+    ON public.todos (uzman_id, start_time, end_time);
+
+CREATE INDEX IF NOT EXISTS ix_todos_live_start_end
+    ON public.todos (start_time, end_time)
+    WHERE is_delete = false;
+
+-- Index backing keyset pagination of the todo listing (/todos)
+CREATE INDEX IF NOT EXISTS ix_todos_live_start_id
+    ON public.todos (start_time, id)
+    WHERE is_delete = false;
+
+CREATE INDEX IF NOT EXISTS ix_todo_series_uzman_start_end
+    ON public.todo_series (uzman_id, dtstart, last_end);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_todos_series_recurrence
+    ON public.todos (series_id, recurrence_id)
+    WHERE series_id IS NOT NULL;
+
+-- No two live bookings of an expert may overlap. Adding the constraint fails while
+-- overlapping live bookings exist; those have to be moved or deleted first.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'todos_no_overlap') THEN
+        ALTER TABLE public.todos ADD CONSTRAINT todos_no_overlap
+            EXCLUDE USING gist (uzman_id WITH =, tsrange(start_time, end_time) WITH &&)
+            WHERE (is_delete IS NOT TRUE);
+    END IF;
+END $$;
@@ -0,0 +1,95 @@
+-- Revenue rollups: live (not soft-deleted) bookings counted per expert, month, status and charge.
+-- Kept current by statement-level triggers on todos, so ORM writes, bulk updates and COPY imports
+-- are all counted; a statement touching many rows applies its changes as one grouped upsert.
+-- Amounts come from the charge at report time (count * charge.net/tax/total), so editing a
+-- charge's prices needs no rebuild. Missing ids are stored as -1 (status 0 is a real status).
+-- See rollups.py for the report query and the rebuild command.
+
+CREATE TABLE IF NOT EXISTS public.revenue_rollups (
+    uzman_id integer NOT NULL,
+    month date NOT NULL,
+    status_id integer NOT NULL,
+    charge_id integer NOT NULL,
+    todo_count integer NOT NULL,
+    PRIMARY KEY (uzman_id, month, status_id, charge_id)
+);
+
+-- Month reports across all experts
+CREATE INDEX IF NOT EXISTS ix_revenue_rollups_month ON public.revenue_rollups (month);
+
+-- Adds the grouped +1/-1 changes of the statement's transition tables to the rollups.
+-- Keys are upserted in sorted order so concurrent writers lock rollup rows in the same order.
+CREATE OR REPLACE FUNCTION public.revenue_rollups_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO public.revenue_rollups AS rollup (uzman_id, month, status_id, charge_id, todo_count)
+        SELECT uzman_id, month, status_id, charge_id, sum(delta)
+        FROM (
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), 1
+            FROM new_rows WHERE is_delete = false AND start_time IS NOT NULL
+        ) AS changes (uzman_id, month, status_id, charge_id, delta)
+        GROUP BY uzman_id, month, status_id, charge_id
+        HAVING sum(delta) <> 0
+        ORDER BY uzman_id, month, status_id, charge_id
+        ON CONFLICT (uzman_id, month, status_id, charge_id)
+            DO UPDATE SET todo_count = rollup.todo_count + excluded.todo_count;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO public.revenue_rollups AS rollup (uzman_id, month, status_id, charge_id, todo_count)
+        SELECT uzman_id, month, status_id, charge_id, sum(delta)
+        FROM (
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), 1
+            FROM new_rows WHERE is_delete = false AND start_time IS NOT NULL
+            UNION ALL
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), -1
+            FROM old_rows WHERE is_delete = false AND start_time IS NOT NULL
+        ) AS changes (uzman_id, month, status_id, charge_id, delta)
+        GROUP BY uzman_id, month, status_id, charge_id
+        HAVING sum(delta) <> 0
+        ORDER BY uzman_id, month, status_id, charge_id
+        ON CONFLICT (uzman_id, month, status_id, charge_id)
+            DO UPDATE SET todo_count = rollup.todo_count + excluded.todo_count;
+    ELSE
+        INSERT INTO public.revenue_rollups AS rollup (uzman_id, month, status_id, charge_id, todo_count)
+        SELECT uzman_id, month, status_id, charge_id, sum(delta)
+        FROM (
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), -1
+            FROM old_rows WHERE is_delete = false AND start_time IS NOT NULL
+        ) AS changes (uzman_id, month, status_id, charge_id, delta)
+        GROUP BY uzman_id, month, status_id, charge_id
+        HAVING sum(delta) <> 0
+        ORDER BY uzman_id, month, status_id, charge_id
+        ON CONFLICT (uzman_id, month, status_id, charge_id)
+            DO UPDATE SET todo_count = rollup.todo_count + excluded.todo_count;
+    END IF;
+    RETURN NULL;
+END $$;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS revenue_rollups_insert ON public.todos;
+CREATE TRIGGER revenue_rollups_insert AFTER INSERT ON public.todos
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.revenue_rollups_apply();
+
+DROP TRIGGER IF EXISTS revenue_rollups_update ON public.todos;
+CREATE TRIGGER revenue_rollups_update AFTER UPDATE ON public.todos
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.revenue_rollups_apply();
+
+DROP TRIGGER IF EXISTS revenue_rollups_delete ON public.todos;
+CREATE TRIGGER revenue_rollups_delete AFTER DELETE ON public.todos
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.revenue_rollups_apply();
+
+-- Backfill from the existing bookings (the same query as 'python rollups.py --rebuild')
+TRUNCATE public.revenue_rollups;
+INSERT INTO public.revenue_rollups (uzman_id, month, status_id, charge_id, todo_count)
+SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+       coalesce(charge_id, -1), count(*)
+FROM public.todos
+WHERE is_delete = false AND start_time IS NOT NULL
+GROUP BY 1, 2, 3, 4;
@@ -0,0 +1,11 @@
+-- Trigram index behind the customer typeahead (/customers/search). The expression must match
+-- models.CUSTOMER_SEARCH_TEXT exactly, or the planner cannot use the index for the search.
+-- Only active, non-deleted customers can be picked, so only those are indexed.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_customers_search_trgm
+    ON public.customers USING gin (
+        lower(' ' || coalesce(ad, '') || ' ' || coalesce(soyad, '') || ' ' || coalesce(telno, '')
+              || ' ' || coalesce(email, '') || ' ' || coalesce(CAST(tc AS text), '')) gin_trgm_ops
+    )
+    WHERE is_active = true AND is_delete = false;
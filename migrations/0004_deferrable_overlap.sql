@@ -0,0 +1,11 @@
+-- Checks todos_no_overlap at the end of each statement instead of row by row, so a single UPDATE
+-- moving several bookings (PATCH /calendar/events) is judged on the final positions: moving one
+-- booking into the slot another one of the same statement leaves is not a conflict.
+-- Exclusion constraints cannot be altered, so the constraint is recreated; writes to todos wait
+-- while the index is rebuilt.
+ALTER TABLE public.todos DROP CONSTRAINT IF EXISTS todos_no_overlap;
+
+ALTER TABLE public.todos ADD CONSTRAINT todos_no_overlap
+    EXCLUDE USING gist (uzman_id WITH =, tsrange(start_time, end_time) WITH &&)
+    WHERE (is_delete IS NOT TRUE)
+    DEFERRABLE INITIALLY IMMEDIATE;
@@ -0,0 +1,14 @@
+-- Durable token revocations, checked whenever a worker verifies a token it has not cached, so
+-- restarted or newly started workers and workers that missed a notification reject them as well.
+-- Times are epoch seconds with fractions, like the iat and exp claims.
+
+-- Tokens of the user issued before this time are rejected (password or role change, deletion)
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS tokens_valid_after double precision;
+
+-- Tokens ended by a logout, until they expire
+CREATE TABLE IF NOT EXISTS public.revoked_tokens (
+    digest varchar PRIMARY KEY,
+    exp double precision NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_revoked_tokens_exp ON public.revoked_tokens (exp);
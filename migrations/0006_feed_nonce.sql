@@ -0,0 +1,3 @@
+-- Random part of each expert's iCalendar feed URL, created on first request. Replacing it
+-- (POST /calendar/feed_url/rotate) revokes the previous URL without touching anyone else's.
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS feed_nonce varchar;
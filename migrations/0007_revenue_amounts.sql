@@ -0,0 +1,100 @@
+-- Revenue rollups keep the summed amounts instead of pricing the counts at report time, so editing
+-- a charge's prices no longer rewrites the revenue of past months.
+--
+-- Each booking keeps the net/tax/total of its charge as of when the charge was set (on insert or
+-- when charge_id changes). The rollup triggers add and subtract those snapshots, so an update or
+-- delete removes exactly the amounts its booking added, whatever the charge costs by then.
+-- Existing bookings are priced at their charge's current amounts, the best record there is.
+
+ALTER TABLE public.todos ADD COLUMN IF NOT EXISTS net numeric(10, 2);
+ALTER TABLE public.todos ADD COLUMN IF NOT EXISTS tax numeric(10, 2);
+ALTER TABLE public.todos ADD COLUMN IF NOT EXISTS total numeric(10, 2);
+
+CREATE OR REPLACE FUNCTION public.todos_charge_amounts() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.charge_id IS DISTINCT FROM OLD.charge_id THEN
+        SELECT charge.net, charge.tax, charge.total INTO NEW.net, NEW.tax, NEW.total
+        FROM public.charge WHERE charge.id = NEW.charge_id;
+    END IF;
+    RETURN NEW;
+END $$;
+
+-- Runs before the statement-level rollup triggers see the rows, COPY imports included
+DROP TRIGGER IF EXISTS todos_charge_amounts ON public.todos;
+CREATE TRIGGER todos_charge_amounts BEFORE INSERT OR UPDATE OF charge_id ON public.todos
+    FOR EACH ROW EXECUTE FUNCTION public.todos_charge_amounts();
+
+ALTER TABLE public.revenue_rollups ADD COLUMN IF NOT EXISTS net numeric(12, 2) NOT NULL DEFAULT 0;
+ALTER TABLE public.revenue_rollups ADD COLUMN IF NOT EXISTS tax numeric(12, 2) NOT NULL DEFAULT 0;
+ALTER TABLE public.revenue_rollups ADD COLUMN IF NOT EXISTS total numeric(12, 2) NOT NULL DEFAULT 0;
+
+-- As in 0002, with the amounts summed alongside the count
+CREATE OR REPLACE FUNCTION public.revenue_rollups_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO public.revenue_rollups AS rollup (uzman_id, month, status_id, charge_id, todo_count, net, tax, total)
+        SELECT uzman_id, month, status_id, charge_id, sum(delta), sum(delta * net), sum(delta * tax), sum(delta * total)
+        FROM (
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), 1, coalesce(net, 0), coalesce(tax, 0), coalesce(total, 0)
+            FROM new_rows WHERE is_delete = false AND start_time IS NOT NULL
+        ) AS changes (uzman_id, month, status_id, charge_id, delta, net, tax, total)
+        GROUP BY uzman_id, month, status_id, charge_id
+        HAVING sum(delta) <> 0 OR sum(delta * total) <> 0 OR sum(delta * net) <> 0 OR sum(delta * tax) <> 0
+        ORDER BY uzman_id, month, status_id, charge_id
+        ON CONFLICT (uzman_id, month, status_id, charge_id)
+            DO UPDATE SET todo_count = rollup.todo_count + excluded.todo_count, net = rollup.net + excluded.net,
+                          tax = rollup.tax + excluded.tax, total = rollup.total + excluded.total;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO public.revenue_rollups AS rollup (uzman_id, month, status_id, charge_id, todo_count, net, tax, total)
+        SELECT uzman_id, month, status_id, charge_id, sum(delta), sum(delta * net), sum(delta * tax), sum(delta * total)
+        FROM (
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), 1, coalesce(net, 0), coalesce(tax, 0), coalesce(total, 0)
+            FROM new_rows WHERE is_delete = false AND start_time IS NOT NULL
+            UNION ALL
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), -1, coalesce(net, 0), coalesce(tax, 0), coalesce(total, 0)
+            FROM old_rows WHERE is_delete = false AND start_time IS NOT NULL
+        ) AS changes (uzman_id, month, status_id, charge_id, delta, net, tax, total)
+        GROUP BY uzman_id, month, status_id, charge_id
+        HAVING sum(delta) <> 0 OR sum(delta * total) <> 0 OR sum(delta * net) <> 0 OR sum(delta * tax) <> 0
+        ORDER BY uzman_id, month, status_id, charge_id
+        ON CONFLICT (uzman_id, month, status_id, charge_id)
+            DO UPDATE SET todo_count = rollup.todo_count + excluded.todo_count, net = rollup.net + excluded.net,
+                          tax = rollup.tax + excluded.tax, total = rollup.total + excluded.total;
+    ELSE
+        INSERT INTO public.revenue_rollups AS rollup (uzman_id, month, status_id, charge_id, todo_count, net, tax, total)
+        SELECT uzman_id, month, status_id, charge_id, sum(delta), sum(delta * net), sum(delta * tax), sum(delta * total)
+        FROM (
+            SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+                   coalesce(charge_id, -1), -1, coalesce(net, 0), coalesce(tax, 0), coalesce(total, 0)
+            FROM old_rows WHERE is_delete = false AND start_time IS NOT NULL
+        ) AS changes (uzman_id, month, status_id, charge_id, delta, net, tax, total)
+        GROUP BY uzman_id, month, status_id, charge_id
+        HAVING sum(delta) <> 0 OR sum(delta * total) <> 0 OR sum(delta * net) <> 0 OR sum(delta * tax) <> 0
+        ORDER BY uzman_id, month, status_id, charge_id
+        ON CONFLICT (uzman_id, month, status_id, charge_id)
+            DO UPDATE SET todo_count = rollup.todo_count + excluded.todo_count, net = rollup.net + excluded.net,
+                          tax = rollup.tax + excluded.tax, total = rollup.total + excluded.total;
+    END IF;
+    RETURN NULL;
+END $$;
+
+-- Snapshot the current prices onto the existing bookings. The rollups are rebuilt below, so the
+-- rollup update trigger is kept out of this one statement.
+ALTER TABLE public.todos DISABLE TRIGGER revenue_rollups_update;
+UPDATE public.todos SET net = charge.net, tax = charge.tax, total = charge.total
+FROM public.charge WHERE charge.id = todos.charge_id;
+ALTER TABLE public.todos ENABLE TRIGGER revenue_rollups_update;
+
+-- Rebuild with the amounts (the same query as 'python rollups.py --rebuild')
+TRUNCATE public.revenue_rollups;
+INSERT INTO public.revenue_rollups (uzman_id, month, status_id, charge_id, todo_count, net, tax, total)
+SELECT coalesce(uzman_id, -1), date_trunc('month', start_time)::date, coalesce(status_id, -1),
+       coalesce(charge_id, -1), count(*), coalesce(sum(net), 0), coalesce(sum(tax), 0), coalesce(sum(total), 0)
+FROM public.todos
+WHERE is_delete = false AND start_time IS NOT NULL
+GROUP BY 1, 2, 3, 4;
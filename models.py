@@ -1,5 +1,6 @@
 from database import Base
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, LargeBinary
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Float, ForeignKey, Numeric, LargeBinary, Index, text, func, event, DDL, literal_column
+from sqlalchemy.dialects.postgresql import ARRAY, ExcludeConstraint
 from sqlalchemy.orm import relationship
 
 # The Users class is created to represent the 'users' table in the database.
@@ -21,6 +22,8 @@ class Users(Base):
     sekreter = Column(Boolean, default=False)  # Boolean flag indicating if the user is a secretary
     is_active = Column(Boolean, default=False)  # Boolean flag indicating if the user is active
     is_delete = Column(Boolean, default=False)  # Boolean flag indicating if the user is deleted
+    tokens_valid_after = Column(Float)  # Tokens issued (iat, epoch seconds) before this are revoked
+    feed_nonce = Column(String)  # Random part of the iCalendar feed URL, replaced to revoke it
 
     # Relationships with the Todos table, linking expert and secretary users to tasks
     users_todos_uzman = relationship("Todos", foreign_keys='Todos.uzman_id', back_populates="todos_users_uzman")
@@ -30,6 +33,22 @@ class Users(Base):
 # The Todos class represents the 'todos' table, containing task-related information.
 class Todos(Base):
     __tablename__ = "todos"  # Specifies the table name
+    __table_args__ = (
+        # Per-expert calendar windows: equality on uzman_id, then a range scan on start_time
+        Index('ix_todos_uzman_start_end', 'uzman_id', 'start_time', 'end_time'),
+        # Admin calendar windows across all experts; soft-deleted rows are left out of the index
+        Index('ix_todos_live_start_end', 'start_time', 'end_time', postgresql_where=text('is_delete = false')),
+        # Keyset pagination of the todo listing on (start_time, id), live rows only
+        Index('ix_todos_live_start_id', 'start_time', 'id', postgresql_where=text('is_delete = false')),
+        # At most one override row per series occurrence
+        Index('ux_todos_series_recurrence', 'series_id', 'recurrence_id', unique=True,
+              postgresql_where=text('series_id IS NOT NULL')),
+        # No two live bookings of an expert may overlap (needs the btree_gist extension for '=').
+        # Checked at the end of each statement, so one statement may move bookings past each other.
+        ExcludeConstraint(('uzman_id', '='), (func.tsrange(text('start_time'), text('end_time')), '&&'),
+                          name='todos_no_overlap', using='gist', where=text('is_delete IS NOT TRUE'),
+                          deferrable=True, initially='IMMEDIATE'),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)  # Primary key, auto-incremented
     start_time = Column(DateTime)  # Task start time
@@ -41,6 +60,12 @@ class Todos(Base):
     status_id = Column(Integer, ForeignKey("status.id"))  # Foreign key linking to the status
     is_delete = Column(Boolean, default=False)  # Boolean flag indicating if the task is deleted
     description = Column(String)  # Task description
+    series_id = Column(Integer, ForeignKey("todo_series.id"))  # Series this row overrides one occurrence of
+    recurrence_id = Column(DateTime)  # Original start of the overridden occurrence
+    # Amounts of the charge as of when it was set on the booking (migrations/0007_revenue_amounts.sql)
+    net = Column(Numeric(precision=10, scale=2))
+    tax = Column(Numeric(precision=10, scale=2))
+    total = Column(Numeric(precision=10, scale=2))
 
     # Relationships linking the task to an expert user, secretary, customer, charge, and status
     todos_users_uzman = relationship("Users", uselist=False, foreign_keys=[uzman_id], back_populates="users_todos_uzman")
@@ -50,6 +75,35 @@ class Todos(Base):
     todos_status = relationship("Status", uselist=False, foreign_keys=[status_id], back_populates="status_todos")
 
 
+# The exclusion constraint above compares uzman_id with '=' inside a GiST index, which btree_gist provides
+event.listen(Todos.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+
+
+# The TodoSeries class represents the 'todo_series' table: recurring appointments stored once.
+# Occurrences are expanded from the RRULE only for the requested calendar window; edited occurrences
+# are stored as Todos rows pointing back at the series (series_id, recurrence_id).
+class TodoSeries(Base):
+    __tablename__ = "todo_series"  # Specifies the table name
+    __table_args__ = (
+        # Series of an expert that may have occurrences in a calendar window
+        Index('ix_todo_series_uzman_start_end', 'uzman_id', 'dtstart', 'last_end'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)  # Primary key, auto-incremented
+    dtstart = Column(DateTime)  # Start of the first occurrence
+    duration_minutes = Column(Integer)  # Length of every occurrence
+    rrule = Column(String)  # RFC 5545 recurrence rule, e.g. 'FREQ=WEEKLY;COUNT=12'
+    exdates = Column(ARRAY(DateTime), default=list)  # Starts of the cancelled occurrences
+    last_end = Column(DateTime)  # End of the last occurrence, NULL when the rule never ends
+    uzman_id = Column(Integer, ForeignKey("users.id"))  # Foreign key linking to the expert user
+    sekreter_id = Column(Integer, ForeignKey("users.id"))  # Foreign key linking to the secretary user
+    musteri_id = Column(Integer, ForeignKey("customers.id"))  # Foreign key linking to the customer
+    charge_id = Column(Integer, ForeignKey("charge.id"))  # Foreign key linking to the charge
+    status_id = Column(Integer, ForeignKey("status.id"))  # Foreign key linking to the status
+    is_delete = Column(Boolean, default=False)  # Boolean flag indicating if the series is deleted
+    description = Column(String)  # Description shared by the occurrences
+
+
 # The Charge class represents the 'charge' table, containing pricing-related information.
 class Charge(Base):
     __tablename__ = 'charge'  # Specifies the table name
@@ -66,9 +120,21 @@ class Charge(Base):
     charge_todos = relationship("Todos", foreign_keys="Todos.charge_id", back_populates="todos_charge")
 
 
+# Text the customer typeahead (/customers/search) matches against: the searchable fields, lower-cased,
+# each preceded by a space so a search for ' term' finds the fields starting with the term.
+# Must stay identical to the expression of ix_customers_search_trgm (migrations/0003_customer_search.sql).
+CUSTOMER_SEARCH_TEXT = ("lower(' ' || coalesce(ad, '') || ' ' || coalesce(soyad, '') || ' ' || coalesce(telno, '')"
+                        " || ' ' || coalesce(email, '') || ' ' || coalesce(CAST(tc AS text), ''))")
+
+
 # The Customers class represents the 'customers' table, containing customer-related information.
 class Customers(Base):
     __tablename__ = 'customers'  # Specifies the table name
+    __table_args__ = (
+        # Trigram index serving the typeahead's LIKE patterns, active customers only (needs pg_trgm)
+        Index('ix_customers_search_trgm', text(f"{CUSTOMER_SEARCH_TEXT} gin_trgm_ops"), postgresql_using='gin',
+              postgresql_where=text('is_active = true AND is_delete = false')),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)  # Primary key, auto-incremented
     tc = Column(Integer)  # National ID number
@@ -88,6 +154,12 @@ class Customers(Base):
     customers_documents = relationship("Documents", foreign_keys="Documents.customer_id", back_populates="documents_customers")
 
 
+# The trigram operator class of the search index comes from pg_trgm
+event.listen(Customers.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+customer_search_text = literal_column(CUSTOMER_SEARCH_TEXT)
+
+
 # The Documents class represents the 'documents' table, containing document-related information.
 class Documents(Base):
     __tablename__ = "documents"  # Specifies the table name
@@ -114,3 +186,39 @@ class Status(Base):
 
     # Relationship linking the status to tasks (Todos)
     status_todos = relationship("Todos", foreign_keys="Todos.status_id", back_populates="todos_status")
+
+
+# The ChangeVersions class represents the 'change_versions' table: one monotonic counter per data scope.
+# Write handlers bump the counters they affect, and readers derive ETags from them.
+class ChangeVersions(Base):
+    __tablename__ = "change_versions"  # Specifies the table name
+
+    scope = Column(String, primary_key=True)  # Scope name, e.g. 'todos:uzman:4', 'customers'
+    version = Column(Integer, nullable=False, default=0)  # Incremented on every committed change in the scope
+    updated_at = Column(DateTime)  # Time of the last change in the scope
+
+
+# The RevenueRollups class represents the 'revenue_rollups' table: live bookings counted and their
+# amounts summed per expert, month, status and charge. Triggers on todos keep it current
+# (migrations/0002_revenue_rollups.sql and 0007_revenue_amounts.sql); ids missing on the booking
+# are stored as -1.
+class RevenueRollups(Base):
+    __tablename__ = "revenue_rollups"  # Specifies the table name
+
+    uzman_id = Column(Integer, primary_key=True)  # Expert of the bookings
+    month = Column(Date, primary_key=True)  # First day of the month the bookings start in
+    status_id = Column(Integer, primary_key=True)  # Status of the bookings
+    charge_id = Column(Integer, primary_key=True)  # Charge of the bookings
+    todo_count = Column(Integer, nullable=False)  # Number of live bookings with this key
+    net = Column(Numeric(precision=12, scale=2), nullable=False, default=0)  # Summed net of those bookings
+    tax = Column(Numeric(precision=12, scale=2), nullable=False, default=0)  # Summed tax of those bookings
+    total = Column(Numeric(precision=12, scale=2), nullable=False, default=0)  # Summed total of those bookings
+
+
+# The RevokedTokens class represents the 'revoked_tokens' table: tokens ended by a logout, kept
+# until they expire, so every worker rejects them even after a restart.
+class RevokedTokens(Base):
+    __tablename__ = "revoked_tokens"  # Specifies the table name
+
+    digest = Column(String, primary_key=True)  # sha256 hex digest of the token
+    exp = Column(Float, nullable=False, index=True)  # Expiry of the token (epoch seconds); purged after it
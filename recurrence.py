@@ -0,0 +1,177 @@
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice, takewhile
+
+from dateutil.rrule import rrule, rrulestr
+from sqlalchemy import func, or_, select, update
+
+import models
+from clinic_time import clinic_now, to_clinic_time
+
+# Recurring appointments.
+# A series is stored once (models.TodoSeries) and expanded into occurrences only for the window a
+# reader asks for, so the cost follows the visible occurrences rather than the length of the rule.
+# Cancelled occurrences are kept in exdates; an edited occurrence becomes a Todos row carrying
+# (series_id, recurrence_id), which replaces the generated occurrence.
+
+# Reads without a window end expand never-ending series this many days ahead
+RECURRENCE_HORIZON_DAYS = int(os.getenv("RECURRENCE_HORIZON_DAYS", "365"))
+
+# Largest number of occurrences a bounded rule (COUNT or UNTIL) may produce
+RECURRENCE_MAX_OCCURRENCES = int(os.getenv("RECURRENCE_MAX_OCCURRENCES", "1000"))
+
+# Format of recurrence ids in occurrence ids and URLs
+RECURRENCE_ID_FORMAT = "%Y%m%dT%H%M%S"
+
+
+# All times are the clinic's naive wall-clock time, so a UTC UNTIL is converted to it to match the
+# naive DTSTART (a date-only UNTIL just loses the marker)
+def normalise_rule(text):
+    text = text.strip().removeprefix("RRULE:").upper()
+    return re.sub(r"UNTIL=(\d{8})(T\d{6})?Z", clinic_until, text)
+
+
+def clinic_until(match):
+    if not match[2]:
+        return f"UNTIL={match[1]}"
+    until = datetime.strptime(match[1] + match[2], RECURRENCE_ID_FORMAT).replace(tzinfo=timezone.utc)
+    return f"UNTIL={to_clinic_time(until):{RECURRENCE_ID_FORMAT}}"
+
+
+@lru_cache(maxsize=1024)
+def compile_rule(text, dtstart):
+    rule = rrulestr(text, dtstart=dtstart)
+    if not isinstance(rule, rrule):
+        raise ValueError("expected a single RRULE")
+    return rule
+
+
+# Validates the rule of a new series; returns the normalised rule and the end of the last
+# occurrence (None for rules without COUNT or UNTIL). Raises ValueError on unusable rules.
+def prepare_series(text, dtstart, duration):
+    text = normalise_rule(text)
+    rule = compile_rule(text, dtstart)
+    if not re.search(r"(^|;)(COUNT|UNTIL)=", text):
+        return text, None
+    starts = list(islice(rule, RECURRENCE_MAX_OCCURRENCES + 1))
+    if not starts:
+        raise ValueError("the rule has no occurrences")
+    if len(starts) > RECURRENCE_MAX_OCCURRENCES:
+        raise ValueError(f"the rule has more than {RECURRENCE_MAX_OCCURRENCES} occurrences")
+    return text, starts[-1] + duration
+
+
+# Starts of a new series' occurrences that conflict checks cover: all of them for bounded rules,
+# RECURRENCE_HORIZON_DAYS ahead for never-ending ones
+def checked_starts(text, dtstart, last_end):
+    window_end = last_end if last_end is not None else default_window_end(dtstart)
+    starts = takewhile(lambda start: start < window_end, compile_rule(text, dtstart))
+    return list(islice(starts, RECURRENCE_MAX_OCCURRENCES))
+
+
+def occurrence_id(series_id, recurrence_id):
+    return f"s{series_id}-{recurrence_id.strftime(RECURRENCE_ID_FORMAT)}"
+
+
+def parse_recurrence_id(value):
+    return datetime.strptime(value, RECURRENCE_ID_FORMAT)
+
+
+# True when recurrence_id is a generated, non-cancelled occurrence of the series
+def is_occurrence(series, recurrence_id):
+    if recurrence_id in (series.exdates or ()):
+        return False
+    return recurrence_id in compile_rule(series.rrule, series.dtstart)
+
+
+# Cancels one occurrence; array_append also handles series without exdates (NULL)
+def exclude_occurrence(db, series_id, recurrence_id):
+    db.execute(
+        update(models.TodoSeries)
+        .where(models.TodoSeries.id == series_id)
+        .values(exdates=func.array_append(models.TodoSeries.exdates, recurrence_id))
+    )
+
+
+# Series of the window, each with its customer and expert names, for expand_occurrences
+def series_query(expert_filter, status_id, window_start, window_end):
+    query = (
+        select(models.TodoSeries, models.Customers.ad, models.Customers.soyad, models.Users.ad)
+        .join(models.Customers, models.Customers.id == models.TodoSeries.musteri_id)
+        .join(models.Users, models.Users.id == models.TodoSeries.uzman_id)
+        .where(models.TodoSeries.is_delete == False, models.TodoSeries.dtstart < window_end)
+    )
+    if expert_filter is not None:
+        query = query.where(models.TodoSeries.uzman_id == expert_filter)
+    if status_id is not None:
+        query = query.where(models.TodoSeries.status_id == status_id)
+    if window_start is not None:
+        query = query.where(or_(models.TodoSeries.last_end.is_(None), models.TodoSeries.last_end > window_start))
+    return query
+
+
+# Overrides whose original slot could fall in the window, including soft-deleted ones
+def overrides_query(found, window_start, window_end):
+    query = (
+        select(models.Todos.series_id, models.Todos.recurrence_id)
+        .where(models.Todos.series_id.in_([series.id for series, *_ in found]),
+               models.Todos.recurrence_id < window_end)
+    )
+    if window_start is not None:
+        longest = max(timedelta(minutes=series.duration_minutes) for series, *_ in found)
+        query = query.where(models.Todos.recurrence_id > window_start - longest)
+    return query
+
+
+def default_window_end(window_start):
+    now = clinic_now()
+    return max(window_start or now, now) + timedelta(days=RECURRENCE_HORIZON_DAYS)
+
+
+def expand_occurrences(found, overridden, window_start, window_end):
+    rows = []
+    for series, musteri_ad, musteri_soyad, uzman_ad in found:
+        duration = timedelta(minutes=series.duration_minutes)
+        excluded = set(series.exdates or ())
+        rule = compile_rule(series.rrule, series.dtstart)
+        # An occurrence overlaps the window when it starts before its end and ends after its start
+        if window_start is None:
+            starts = rule.xafter(series.dtstart, inc=True)
+        else:
+            starts = rule.xafter(window_start - duration)
+        for start in starts:
+            if start >= window_end:
+                break
+            if start in excluded or (series.id, start) in overridden:
+                continue
+            rows.append(((occurrence_id(series.id, start), start, start + duration, series.description,
+                          series.uzman_id, series.musteri_id, musteri_ad, musteri_soyad, uzman_ad,
+                          series.status_id), series.id, start))
+    rows.sort(key=lambda row: row[2])
+    return rows
+
+
+# Generated occurrences overlapping [window_start, window_end), as rows shaped like the
+# events query rows, each returned with its series id and recurrence id. Occurrences that were
+# cancelled or replaced by an override row are left out; the override rows come from todos.
+async def occurrence_rows(db, expert_filter, status_id, window_start, window_end):
+    if window_end is None:
+        window_end = default_window_end(window_start)
+    found = (await db.execute(series_query(expert_filter, status_id, window_start, window_end))).all()
+    if not found:
+        return []
+    overridden = set((await db.execute(overrides_query(found, window_start, window_end))).all())
+    return expand_occurrences(found, overridden, window_start, window_end)
+
+
+# The same on a synchronous session, for the conflict checks made inside write transactions
+def occurrence_rows_sync(db, expert_filter, status_id, window_start, window_end):
+    if window_end is None:
+        window_end = default_window_end(window_start)
+    found = db.execute(series_query(expert_filter, status_id, window_start, window_end)).all()
+    if not found:
+        return []
+    overridden = set(db.execute(overrides_query(found, window_start, window_end)).all())
+    return expand_occurrences(found, overridden, window_start, window_end)
@@ -0,0 +1,116 @@
+import argparse
+import time
+from datetime import date
+
+from sqlalchemy import delete, func, select, text
+
+import models
+from database import SessionLocal
+
+# Revenue reporting from the revenue_rollups table (migrations/0002_revenue_rollups.sql).
+#
+# Triggers on todos keep the rollups current on every write, so a report reads a few rows per
+# expert and month instead of scanning the bookings. Amounts are summed from the prices each booking
+# was given with its charge (todos.net/tax/total), so editing a charge's prices leaves past months
+# as they were reported. The rebuild command recomputes the rollups from todos; it is only needed
+# after the triggers were bypassed (session_replication_role = replica, a restore without them)
+# or to check them.
+#
+# Usage: python rollups.py --rebuild [--from 2024-01] [--to 2024-12]
+
+# Stored instead of a missing expert, status or charge id
+NO_ID = -1
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+# 'YYYY-MM' -> first day of that month
+def parse_month(value):
+    year, month = value.split("-")
+    return date(int(year), int(month), 1)
+
+
+# Revenue per expert, month and status for the months [first_month, last_month]
+def report_query(first_month, last_month, uzman_id=None):
+    rollup = models.RevenueRollups
+    query = (
+        select(
+            rollup.uzman_id,
+            models.Users.ad.label("uzman_ad"),
+            models.Users.soyad.label("uzman_soyad"),
+            rollup.month,
+            rollup.status_id,
+            models.Status.status_name,
+            func.sum(rollup.todo_count).label("count"),
+            func.sum(rollup.net).label("net"),
+            func.sum(rollup.tax).label("tax"),
+            func.sum(rollup.total).label("total"),
+        )
+        .outerjoin(models.Users, models.Users.id == rollup.uzman_id)
+        .outerjoin(models.Status, models.Status.id == rollup.status_id)
+        .where(rollup.month >= month_start(first_month), rollup.month <= month_start(last_month),
+               rollup.todo_count > 0)
+        .group_by(rollup.uzman_id, models.Users.ad, models.Users.soyad, rollup.month, rollup.status_id,
+                  models.Status.status_name)
+        .order_by(rollup.month, rollup.uzman_id, rollup.status_id)
+    )
+    if uzman_id is not None:
+        query = query.where(rollup.uzman_id == uzman_id)
+    return query
+
+
+# Recomputes the rollups of the given months (all when None) from todos; returns the rows written.
+# Writes to todos wait until the rebuild commits, so no trigger update falls between the two steps.
+def rebuild(first_month=None, last_month=None):
+    key = (
+        func.coalesce(models.Todos.uzman_id, NO_ID),
+        func.date_trunc('month', models.Todos.start_time).cast(models.RevenueRollups.month.type),
+        func.coalesce(models.Todos.status_id, NO_ID),
+        func.coalesce(models.Todos.charge_id, NO_ID),
+    )
+    source = (
+        select(*key, func.count(), func.coalesce(func.sum(models.Todos.net), 0),
+               func.coalesce(func.sum(models.Todos.tax), 0), func.coalesce(func.sum(models.Todos.total), 0))
+        .where(models.Todos.is_delete == False, models.Todos.start_time.isnot(None))
+        .group_by(*key)
+    )
+    target = delete(models.RevenueRollups)
+    if first_month is not None:
+        source = source.where(models.Todos.start_time >= month_start(first_month))
+        target = target.where(models.RevenueRollups.month >= month_start(first_month))
+    if last_month is not None:
+        # Bookings starting before the first day of the following month
+        following = date(last_month.year + last_month.month // 12, last_month.month % 12 + 1, 1)
+        source = source.where(models.Todos.start_time < following)
+        target = target.where(models.RevenueRollups.month <= month_start(last_month))
+
+    with SessionLocal() as db:
+        db.execute(text("SET LOCAL statement_timeout = 0"))
+        db.execute(text("LOCK TABLE todos IN SHARE MODE"))
+        db.execute(target)
+        written = db.execute(
+            models.RevenueRollups.__table__.insert().from_select(
+                ["uzman_id", "month", "status_id", "charge_id", "todo_count", "net", "tax", "total"], source)
+        ).rowcount
+        db.commit()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revenue rollup maintenance")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from the bookings")
+    parser.add_argument("--from", dest="first_month", type=parse_month, help="first month to rebuild, YYYY-MM")
+    parser.add_argument("--to", dest="last_month", type=parse_month, help="last month to rebuild, YYYY-MM")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error("nothing to do; use --rebuild")
+
+    started = time.perf_counter()
+    written = rebuild(args.first_month, args.last_month)
+    print(f"{written} rollup rows written in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
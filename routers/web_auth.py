@@ -1,6 +1,14 @@
+import asyncio
+import hashlib
+import json
+import os
 import sys
+import time
+import uuid
 sys.path.append("..")
 
+from concurrent.futures import ThreadPoolExecutor
+
 from typing import Annotated, Optional
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer # For handling OAuth2 authentication
 from datetime import timedelta, datetime
@@ -13,10 +21,15 @@ from passlib.context import CryptContext # For password hashing and verification
 from starlette import status
 from starlette.responses import RedirectResponse
 import models
-from database import engine, SessionLocal
+from database import SessionLocal, AsyncSessionLocal
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
+from cache import event_cache, reference_cache, token_cache
+import live
+import versions
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
@@ -27,11 +40,38 @@ ALGORITHM = 'HS256'
 # Directory for Jinja2 templates
 templates = Jinja2Templates(directory="templates")
 
-# Password hashing context using bcrypt
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor. When it changes, stored hashes are rehashed on the user's next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Worker threads running bcrypt (bcrypt releases the GIL, so the threads hash in parallel)
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+
+# Maximum number of hashing jobs admitted at once; further logins wait for a free slot
+HASH_CONCURRENCY = int(os.getenv("HASH_CONCURRENCY", "8"))
+
+# Password hashing context using bcrypt.
+# min_rounds/max_rounds pin the accepted cost so hashes with any other cost are reported as needing an update.
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                              bcrypt__default_rounds=BCRYPT_ROUNDS,
+                              bcrypt__min_rounds=BCRYPT_ROUNDS,
+                              bcrypt__max_rounds=BCRYPT_ROUNDS)
+
+# Bounded pool and limiter keeping bcrypt's ~200 ms of CPU per call off the event loop
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+hash_limiter = asyncio.Semaphore(HASH_CONCURRENCY)
+
+# Channel carrying token revocations to the other workers
+REVOCATION_CHANNEL = "auth_revocations"
+
+# Session.info key of the revocations applied to this worker's token cache once the session commits
+PENDING_REVOCATIONS_KEY = "auth_revocations"
+
+# Marks this worker's revocation notifications, which it applied on commit already
+WORKER_ID = uuid.uuid4().hex
 
-# Create all database tables if they do not exist
-models.Base.metadata.create_all(bind=engine)
+# Counters for the hashing pool, exposed through /auth/metrics
+hash_metrics = {"jobs": 0, "pending": 0, "rehashed": 0,
+                "queue_time_total": 0.0, "queue_time_max": 0.0, "run_time_total": 0.0}
 
 # OAuth2 scheme for token-based authentication
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="token")
@@ -67,19 +107,69 @@ def get_db():
 # Dependency for injecting the database session into routes
 db_dependency = Annotated[Session, Depends(get_db)]
 
+# Runs inside a hashing worker thread and reports when the job actually started
+def _timed_hash_job(func, args):
+    started = time.perf_counter()
+    result = func(*args)
+    return started, time.perf_counter(), result
+
+# Function to run a bcrypt operation in the hashing pool, recording how long it queued
+async def run_hash_job(func, *args):
+    queued = time.perf_counter()
+    hash_metrics["pending"] += 1
+    try:
+        async with hash_limiter:
+            loop = asyncio.get_running_loop()
+            started, finished, result = await loop.run_in_executor(hash_executor, _timed_hash_job, func, args)
+    finally:
+        hash_metrics["pending"] -= 1
+
+    queue_time = started - queued
+    hash_metrics["jobs"] += 1
+    hash_metrics["queue_time_total"] += queue_time
+    hash_metrics["queue_time_max"] = max(hash_metrics["queue_time_max"], queue_time)
+    hash_metrics["run_time_total"] += finished - started
+    return result
+
+# Function to summarise the hashing pool counters
+def hash_pool_stats():
+    jobs = hash_metrics["jobs"] or 1
+    return {
+        "rounds": BCRYPT_ROUNDS,
+        "workers": HASH_WORKERS,
+        "concurrency": HASH_CONCURRENCY,
+        "jobs": hash_metrics["jobs"],
+        "pending": hash_metrics["pending"],
+        "rehashed": hash_metrics["rehashed"],
+        "avg_queue_ms": round(hash_metrics["queue_time_total"] / jobs * 1000, 2),
+        "max_queue_ms": round(hash_metrics["queue_time_max"] * 1000, 2),
+        "avg_run_ms": round(hash_metrics["run_time_total"] / jobs * 1000, 2),
+    }
+
 # Function to hash a plain text password
-def get_password_hash(password):
-    return bcrypt_context.hash(password)
+async def get_password_hash(password):
+    return await run_hash_job(bcrypt_context.hash, password)
 
 # Function to verify if the plain password matches the hashed password
-def verify_password(plain_password, hashed_password):
-    return bcrypt_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await run_hash_job(bcrypt_context.verify, plain_password, hashed_password)
 
 # Function to authenticate a user by username and password
-def authenticate_user(username: str, password: str, db):
+async def authenticate_user(username: str, password: str, db):
     user = db.query(models.Users).filter(models.Users.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return False
+
+    valid, new_hash = await run_hash_job(bcrypt_context.verify_and_update, password, user.hashed_password)
+    if not valid:
         return False
+
+    # The stored hash uses an outdated cost factor; replace it while the plain password is at hand
+    if new_hash:
+        user.hashed_password = new_hash
+        db.add(user)
+        db.commit()
+        hash_metrics["rehashed"] += 1
     return user
 
 # Function to create a JWT token for authenticated users
@@ -87,32 +177,113 @@ def create_access_token(username: str,
                         user_id: int,
                         role: str,
                         expires_delta: Optional[timedelta] = None):
-    encode = {"sub": username, "id": user_id, 'role': role}
+    # iat keeps sub-second precision (allowed for NumericDate), so a token issued right after a
+    # revocation is told apart from the ones it revoked
+    encode = {"sub": username, "id": user_id, 'role': role, "iat": time.time()}
     expire = datetime.utcnow() + expires_delta if expires_delta else datetime.utcnow() + timedelta(minutes=30)
     encode.update({"exp": expire})
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
-# Function to retrieve the current authenticated user by decoding the JWT token
+# Key of a token in the verified-token cache and in revocations
+def token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# Function to retrieve the current authenticated user by decoding the JWT token.
+# Verified claims are cached until the token expires, so repeat requests skip the signature check.
 async def get_current_user(request: Request):
     try:
         token = request.cookies.get("access_token")
         if not token:
             return None
+        digest = token_digest(token)
+        user = token_cache.get(digest)
+        if user is not None:
+            return user
+        generation = token_cache.generation
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
         user_id = payload.get("id")
         user_role = payload.get('role')
         if not username or not user_id:
             logout(request)
-        return {'username': username, 'id': user_id, 'user_role': user_role}
+        # Tokens issued before iat was added count as issued at the epoch
+        if user_id and await is_revoked(digest, user_id, payload.get("iat", 0)):
+            return None
+        user = {'username': username, 'id': user_id, 'user_role': user_role}
+        if username and user_id and "exp" in payload:
+            # Skipped when a revocation arrived while the token was being checked
+            token_cache.set(digest, user, payload["exp"], generation)
+        return user
     except JWTError:
         raise HTTPException(status_code=404, detail="Not found")
 
+# Revocations are stored in the database and looked up whenever a token is verified (token cache
+# misses only), so every worker honours them, restarted ones included. A token whose user no longer
+# exists is revoked as well.
+async def is_revoked(digest, user_id, issued_at):
+    revoked_token = select(models.RevokedTokens.digest).where(models.RevokedTokens.digest == digest).exists()
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(models.Users.tokens_valid_after, revoked_token).where(models.Users.id == user_id)
+        )).first()
+    return row is None or row[1] or issued_at < (row[0] or 0)
+
+# Drops the cached claims a revocation ends
+def apply_revocation(message):
+    if "token" in message:
+        token_cache.revoke_token(message["token"])
+    else:
+        token_cache.revoke_user(message["user"])
+
+# Revocations sent by the other workers; this worker's own come back as well and are skipped
+def on_revocation_notify(payload):
+    message = json.loads(payload)
+    if message.get("worker") != WORKER_ID:
+        apply_revocation(message)
+
+live.broker.on(REVOCATION_CHANNEL, on_revocation_notify)
+# Revocations sent while the LISTEN connection was down are lost; the cache refills from the database
+live.broker.on_reconnect(token_cache.clear)
+
+# Revocation hooks. The revocation is written in the session's transaction; once that commits, it is
+# applied to this worker's token cache and reaches the other workers through pg_notify.
+def revoke(db, message):
+    live.notify(db, REVOCATION_CHANNEL, json.dumps({**message, "worker": WORKER_ID}))
+    db.info.setdefault(PENDING_REVOCATIONS_KEY, []).append(message)
+
+@event.listens_for(Session, "after_commit")
+def apply_committed_revocations(session):
+    for message in session.info.pop(PENDING_REVOCATIONS_KEY, ()):
+        apply_revocation(message)
+
+@event.listens_for(Session, "after_soft_rollback")
+def drop_revocations(session, previous_transaction):
+    session.info.pop(PENDING_REVOCATIONS_KEY, None)
+
+# Function to revoke one token (logout); invalid or expired tokens need no revocation
+def revoke_token(db, token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return
+    if "exp" in payload:
+        digest = token_digest(token)
+        db.execute(insert(models.RevokedTokens).values(digest=digest, exp=payload["exp"]).on_conflict_do_nothing())
+        # Expired tokens fail verification anyway, so their revocations can go
+        db.execute(delete(models.RevokedTokens).where(models.RevokedTokens.exp <= time.time()))
+        revoke(db, {"token": digest})
+
+# Function to revoke every token issued to a user so far (deactivation, role or password change)
+def revoke_user(db, user_id):
+    valid_after = func.greatest(func.coalesce(models.Users.tokens_valid_after, 0), time.time())
+    db.execute(update(models.Users).where(models.Users.id == user_id).values(tokens_valid_after=valid_after))
+    revoke(db, {"user": user_id})
+
 # Route to handle user login and token generation
 @router.post("/token")
 async def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(),
                                  db: Session = Depends(get_db)):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         return False
     token_expires = timedelta(minutes=60)
@@ -143,14 +314,27 @@ async def login(request: Request, db: Session = Depends(get_db)):
         msg = "Unknown Error"
         return templates.TemplateResponse("auth_login.html", {"request": request, "msg": msg})
 
-# Route to handle user logout and clear the authentication cookie
+# Route to handle user logout, revoking the token and clearing the authentication cookie
 @router.get("/logout")
-async def logout(request: Request):
+async def logout(request: Request, db: Session = Depends(get_db)):
+    token = request.cookies.get("access_token")
+    if token:
+        revoke_token(db, token)
+        db.commit()
+
     msg = "Logout Successful"
     response = templates.TemplateResponse("auth_login.html", {"request": request, "msg": msg})
     response.delete_cookie(key="access_token")
     return response
 
+# Route exposing the password hashing pool counters (only accessible to admins)
+@router.get("/metrics")
+async def auth_metrics(request: Request):
+    user = await get_current_user(request)
+    if user is None or user.get('user_role') != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return {"hashing": hash_pool_stats(), "tokens": token_cache.stats()}
+
 # Other routes related to user registration, password change, and user management follow here...
 
 # Example of password change route:
@@ -165,15 +349,21 @@ async def user_password_change(request: Request,
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
     user_data = db.query(models.Users).filter(models.Users.username == username).first()
-    msg = "Invalid username or password"
-
-    if user_data and verify_password(password, user_data.hashed_password):
-        user_data.hashed_password = get_password_hash(password2)
+    new_token = None
+    if user_data and await verify_password(password, user_data.hashed_password):
+        user_data.hashed_password = await get_password_hash(password2)
         db.add(user_data)
+        # Sessions opened with the old password end; the user changing their own password gets a new token
+        revoke_user(db, user_data.id)
         db.commit()
-        msg = 'Password updated'
+        if user_data.id == user.get("id"):
+            new_token = create_access_token(user_data.username, user_data.id, user_data.role, expires_delta=timedelta(minutes=60))
 
-    return templates.TemplateResponse("home.html", {"request": request, "user": user, "msg": msg})
+    # home.html is rendered by /home together with its dashboard summary
+    response = RedirectResponse(url="/home", status_code=status.HTTP_302_FOUND)
+    if new_token:
+        response.set_cookie(key="access_token", value=new_token, httponly=True)
+    return response
 
 # Route to render the user registration page (only accessible to admins)
 @router.get("/register", response_class=HTMLResponse)
@@ -243,13 +433,15 @@ async def register_user(request: Request,
     user_model.is_delete = is_delete
 
     # Hash the user's password and activate the user
-    hash_password = get_password_hash(password)
+    hash_password = await get_password_hash(password)
     user_model.hashed_password = hash_password
     user_model.is_active = True
 
     # Add the new user to the database
     db.add(user_model)
+    versions.bump(db, versions.USERS)
     db.commit()
+    reference_cache.invalidate("uzm", "sek")
 
     msg = "User successfully created"
 
@@ -313,7 +505,7 @@ async def users_edit_commit(request: Request,
     users_model.soyad = soyad
     users_model.email = email
     users_model.telno = telno
-    users_model.hashed_password = get_password_hash(password)
+    users_model.hashed_password = await get_password_hash(password)
     users_model.role = role
     users_model.owner = owner
     users_model.uzman = uzman
@@ -321,11 +513,22 @@ async def users_edit_commit(request: Request,
     users_model.is_active = is_active
     users_model.is_delete = False
 
-    # Commit the changes to the database
+    # Commit the changes to the database; the role, password or active flag may have changed
     db.add(users_model)
+    versions.bump(db, versions.USERS)
+    revoke_user(db, users_id)
     db.commit()
+    reference_cache.invalidate("uzm", "sek")
 
-    return RedirectResponse(url="/auth/users", status_code=status.HTTP_302_FOUND)
+    # Expert names are part of every cached event title
+    event_cache.clear()
+
+    response = RedirectResponse(url="/auth/users", status_code=status.HTTP_302_FOUND)
+    # An admin editing their own record keeps their session, with a token carrying the new role
+    if users_id == user.get("id"):
+        new_token = create_access_token(users_model.username, users_model.id, users_model.role, expires_delta=timedelta(minutes=60))
+        response.set_cookie(key="access_token", value=new_token, httponly=True)
+    return response
 
 # Route to soft delete a user (mark user as deleted)
 @router.get("/delete/{users_id}")
@@ -336,7 +539,10 @@ async def users_delete(request: Request, users_id: int, db: Session = Depends(ge
 
     # Query to soft delete the user
     db.query(models.Users).filter(models.Users.id == users_id).update({models.Users.is_delete: True})
+    versions.bump(db, versions.USERS)
+    revoke_user(db, users_id)
     db.commit()
+    reference_cache.invalidate("uzm", "sek")
 
     return RedirectResponse(url="/auth/users", status_code=status.HTTP_302_FOUND)
 
@@ -349,7 +555,10 @@ async def users_hard_delete(request: Request, users_id: int, db: Session = Depen
 
     # Query to permanently delete the user
     db.query(models.Users).filter(models.Users.id == users_id).delete()
+    versions.bump(db, versions.USERS)
+    revoke_user(db, users_id)
     db.commit()
+    reference_cache.invalidate("uzm", "sek")
 
     return RedirectResponse(url="/auth/users", status_code=status.HTTP_302_FOUND)
 
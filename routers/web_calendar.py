@@ -1,5 +1,5 @@
 import sys
-from typing import Annotated
+from typing import Annotated, List, Union
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
@@ -7,19 +7,59 @@ from pydantic import BaseModel
 sys.path.append("..")
 
 from starlette import status
-from starlette.responses import RedirectResponse, Response, JSONResponse
+from starlette.responses import RedirectResponse, Response, JSONResponse, StreamingResponse
 from fastapi import Request, APIRouter, Depends, File
 import models
-from database import engine, SessionLocal
+from database import SessionLocal, AsyncSessionLocal
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, values, column, func, Integer, DateTime
+from sqlalchemy.exc import IntegrityError
 
-from datetime import datetime
+from datetime import datetime, time, timedelta
 from fastapi import Depends, APIRouter, Path, HTTPException, Request, Form, Query
 from routers.web_auth import get_current_user
+from cache import event_cache, reference_cache, reference_data
+from clinic_time import clinic_now, clinic_to_utc, clinic_today, to_clinic_time
+import live
+import recurrence
+import scheduling
+import versions
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
+import asyncio
+import hmac
 import json
+import os
+import secrets
+
+try:
+    import orjson
+
+    def dump_json(value):
+        return orjson.dumps(value)
+except ImportError:
+    def dump_json(value):
+        return json.dumps(value, default=datetime.isoformat, separators=(",", ":")).encode()
+
+# Rows fetched per round trip when /calendar/events?stream=true walks the server-side cursor
+EVENT_STREAM_BATCH_SIZE = int(os.getenv("EVENT_STREAM_BATCH_SIZE", "1000"))
+
+# Seconds of silence after which /calendar/live sends a keep-alive comment
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+
+# Days of past appointments kept in the per-expert iCalendar feeds; future ones are all included
+ICS_FEED_PAST_DAYS = int(os.getenv("ICS_FEED_PAST_DAYS", "90"))
+
+# Most moves accepted by one PATCH /calendar/events request
+MAX_EVENT_MOVES = int(os.getenv("MAX_EVENT_MOVES", "200"))
+
+# Right-hand side of the VEVENT UIDs, which must stay stable for clients to track updates
+ICS_UID_DOMAIN = os.getenv("ICS_UID_DOMAIN", "calendar.local")
+
+ICS_HEADER = (b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//FastAPI FullCalendar//Todos//EN\r\n"
+              b"CALSCALE:GREGORIAN\r\nMETHOD:PUBLISH\r\nX-PUBLISHED-TTL:PT15M\r\n")
+ICS_FOOTER = b"END:VCALENDAR\r\n"
 
 router = APIRouter(
     prefix="/calendar",
@@ -27,8 +67,6 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 templates = Jinja2Templates(directory="templates")
 
 
@@ -40,6 +78,97 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# The calendar page sends the visible range and moves as ISO 8601 wall-clock strings
+# (e.g. '2024-05-26T00:00:00'). The todo columns hold the clinic's naive wall-clock time, so values
+# with an offset are converted to it, the same way the importer converts them.
+def parse_calendar_datetime(value):
+    if value is None:
+        return None
+    try:
+        # An unencoded '+hh:mm' offset arrives as a space after query-string decoding
+        parsed = datetime.fromisoformat(value.strip().replace(' ', '+'))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid date: {value}")
+    return to_clinic_time(parsed)
+
+
+# Calendar colour per status_id; anything else gets the default blue
+STATUS_COLORS = {
+    0: '#3788d8',
+    1: '#52b21f',
+    2: '#595654',
+    3: '#de8b44',
+    9: 'red',
+}
+
+
+# Builds the FullCalendar event for a row of the read_events query
+def event_from_row(row):
+    return {
+        "id": row[0],
+        # End time as HH:MM
+        "title": f" - {row[2].hour:02d}:{row[2].minute:02d}  {row[8]} {row[6]} {row[7]} {row[3]}",
+        "start": row[1],
+        "end": row[2],
+        "uzman_id": row[4],
+        "musteri_id": row[5],
+        "status_id": row[9],
+        "musteri_ad": row[6],
+        "musteri_soyad": row[7],
+        "uzman_ad": row[8],
+        "description": row[3],
+        "color": STATUS_COLORS.get(row[9], '#3788d8')
+    }
+
+
+# Generated occurrences of a series also carry the ids the client needs to edit or cancel them
+def occurrence_event(row, series_id, recurrence_id):
+    event = event_from_row(row)
+    event["series_id"] = series_id
+    event["recurrence_id"] = recurrence_id.strftime(recurrence.RECURRENCE_ID_FORMAT)
+    return event
+
+
+# Row query shared by the JSON event feed and the iCalendar feed; None leaves a filter out
+def events_query(expert_filter, status_id, window_start, window_end):
+    query = (
+        select(
+            models.Todos.id,
+            models.Todos.start_time,
+            models.Todos.end_time,
+            models.Todos.description,
+            models.Todos.uzman_id,
+            models.Customers.id,
+            models.Customers.ad,
+            models.Customers.soyad,
+            models.Users.ad,
+            models.Todos.status_id
+        )
+        .where(models.Todos.is_delete == False)
+        .join(models.Todos.todos_users_uzman)
+        .join(models.Todos.todos_customers)
+        .order_by(models.Todos.id)
+    )
+
+    if expert_filter is not None:
+        query = query.where(models.Todos.uzman_id == expert_filter)
+
+    if status_id is not None:
+        query = query.where(models.Todos.status_id == status_id)
+
+    # Only events overlapping the visible window [start, end) are returned
+    if window_start is not None:
+        query = query.where(models.Todos.end_time > window_start)
+    if window_end is not None:
+        query = query.where(models.Todos.start_time < window_end)
+    return query
+
+
 # Define a model for the event
 class Event(BaseModel):
     id: int
@@ -48,105 +177,333 @@ class Event(BaseModel):
     end: str
 
 
+# New slot of a dragged or resized booking; times in FullCalendar's ISO 8601 form
+class EventMove(BaseModel):
+    id: int
+    start: str
+    end: str
+    uzman_id: int
+
+
 @router.get("/", response_class=HTMLResponse)
-async def calendar(request: Request, db: Session = Depends(get_db)):
+async def calendar(request: Request):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
+    # Events are loaded by the calendar from /calendar/events and customers picked through
+    # /customers/search, so the page itself only carries the short reference lists
+    uzm, sek, chg, sts = await reference_data("uzm", "sek", "chg", "sts")
 
-    if user.get('user_role') == 'user':
-        todos = db.query(models.Todos).filter(models.Todos.uzman_id == user.get("id")).all()
-
-    if user.get('user_role') == 'admin':
-        todos = db.query(models.Todos).all()
-
-    uzm = db.query(models.Users).filter(models.Users.uzman == True and models.Users.is_active == True and models.Users.is_delete == False ).all()
-    sek = db.query(models.Users).filter(models.Users.sekreter == True and models.Users.is_active == True and models.Users.is_delete == False).all()
-    mus = db.query(models.Customers).filter(models.Customers.is_active == True and models.Customers.is_delete == False).all()
-    chg = db.query(models.Charge).filter(models.Charge.is_active == True and models.Charge.is_delete == False).all()
-    sts = db.query(models.Status).filter(models.Status.is_active == True and models.Status.is_delete == False).all()
-
-    return templates.TemplateResponse("calendar.html", {"request": request, "todos": todos,  "uzm": uzm, "sek": sek, "mus": mus, "chg": chg, "sts": sts, "user": user})
+    return templates.TemplateResponse("calendar.html", {"request": request, "uzm": uzm, "sek": sek, "chg": chg, "sts": sts, "user": user})
 
 
 @router.get("/events", status_code=status.HTTP_200_OK)
 async def read_events(
         request: Request,
-        db: Session = Depends(get_db),
-        status_id: int = Query(None)
+        response: Response,
+        db: AsyncSession = Depends(get_async_db),
+        status_id: int = Query(None),
+        start: str = Query(None),
+        end: str = Query(None),
+        uzman_id: int = Query(None),
+        stream: bool = Query(False)
 ):
     user = await get_current_user(request)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    query = (
-        select(
-            models.Todos.id,
-            models.Todos.start_time,
-            models.Todos.end_time,
-            models.Todos.description,
-            models.Todos.uzman_id,
-            models.Customers.id,
-            models.Customers.ad,
-            models.Customers.soyad,
-            models.Users.ad,
-            models.Todos.status_id
-        )
-        .where(models.Todos.is_delete == False)
-        .join(models.Todos.todos_users_uzman)
-        .join(models.Todos.todos_customers)
-        .order_by(models.Todos.id)
-    )
+    window_start = parse_calendar_datetime(start)
+    window_end = parse_calendar_datetime(end)
 
+    # Experts only ever see their own bookings; admins may narrow the feed to one expert
     if user.get('user_role') == 'user':
-        query = query.where(models.Todos.uzman_id == user.get("id"))
+        scope = expert_filter = user.get("id")
+    else:
+        scope, expert_filter = user.get('user_role'), uzman_id
 
-    if status_id is not None:
-        query = query.where(models.Todos.status_id == status_id)
+    cache_key = (scope, expert_filter, status_id, window_start, window_end)
 
-    result = db.execute(query).all()
+    # Event titles include customer and expert names, so those tables are part of the version
+    todo_scope = versions.TODOS if expert_filter is None else versions.expert_scope(expert_filter)
+    version_rows = (await db.execute(versions.versions_query(todo_scope, versions.CUSTOMERS, versions.USERS))).all()
+    etag = versions.make_etag(version_rows, *cache_key)
+    if versions.etag_matches(request, etag):
+        return versions.not_modified(etag)
+    response.headers.update(versions.etag_headers(etag))
 
-    events = []
-    for row in result:
-        # Determine color based on status_id
-        color = '#3788d8'  # Default color
-        if row[9] == 0:  # Assuming status_id 1 corresponds to a certain status
-            color = '#3788d8'  # Set color to yellow for this status
-        elif row[9] == 1:  # Assuming status_id 2 corresponds to another status
-            color = '#52b21f'  # Set color to green for this status
+    events = None if stream else event_cache.get(cache_key, tag=etag)
+    if events is not None:
+        return events
 
-        elif row[9] == 2:  # Assuming status_id 2 corresponds to another status
-            color = '#595654'  # Set color to green for this status
+    window = (expert_filter, status_id, window_start, window_end)
+    query = events_query(*window)
 
-        elif row[9] == 3:
-            color = '#de8b44'
+    if stream:
+        # Exports skip the cache both ways: the point is to never hold the whole window in memory
+        return StreamingResponse(stream_events(query, window), media_type="application/json",
+                                 headers=versions.etag_headers(etag))
 
-        elif row[9] == 9:
-            color = 'red'
+    result = (await db.execute(query)).all()
 
+    events = [event_from_row(row) for row in result]
+    # Recurring series are expanded for the requested window only
+    events += [occurrence_event(*occurrence) for occurrence in await recurrence.occurrence_rows(db, *window)]
 
+    event_cache.set(cache_key, events, tag=etag)
+    return events
 
-        # Formatting end time
-        end_time_str = row[2].strftime("%H:%M")  # ("%Y-%m-%d %H:%M:%S")
 
-        event = {
-            "id": row[0],
-            "title": f" - {end_time_str}  {row[8]} {row[6]} {row[7]} {row[3]}",
-            "start": row[1],
-            "end": row[2],
-            "uzman_id": row[4],
-            "musteri_id": row[5],
-            "status_id": row[9],
-            "musteri_ad": row[6],
-            "musteri_soyad": row[7],
-            "uzman_ad": row[8],
-            "description": row[3],
-            "color": color  # Add color information to the event data
-        }
-        events.append(event)
+# Serializes the events of a query as a JSON array, one server-side cursor batch at a time.
+# FastAPI closes yield dependencies before a streaming body runs, so the generator owns its session.
+async def stream_events(query, window):
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EVENT_STREAM_BATCH_SIZE))
+        separator = b"["
+        async for rows in result.partitions():
+            yield separator + b",".join(dump_json(event_from_row(row)) for row in rows)
+            separator = b","
+        occurrences = await recurrence.occurrence_rows(db, *window)
+        if occurrences:
+            yield separator + b",".join(dump_json(occurrence_event(*occurrence)) for occurrence in occurrences)
+            separator = b","
+        yield b"]" if separator == b"," else b"[]"
+
+
+# Current events of the given todo ids, keyed by id; deleted todos are missing.
+# Called by the live broker once per change notification, whatever the number of subscribers.
+async def live_events(ids):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(events_query(None, None, None, None).where(models.Todos.id.in_(ids)))
+        return {row[0]: event_from_row(row) for row in result}
+
+
+# Server-Sent Events stream of booking changes (see live.py): 'upsert' carries an event in the
+# /calendar/events format, 'delete' the id of an event to drop and 'refetch' asks for a reload.
+# Experts only hear about their own bookings.
+@router.get("/live")
+async def live_updates(request: Request):
+    user = await get_current_user(request)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    return events
+    subscriber = live.broker.subscribe(user.get("id") if user.get('user_role') == 'user' else None)
+
+    async def stream():
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(subscriber.get(), LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"event: " + kind.encode() + b"\ndata: " + dump_json(data) + b"\n\n"
+        finally:
+            live.broker.unsubscribe(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Next free slots of `duration` minutes within working hours, for one expert or all of them.
+# Experts only search their own calendar.
+@router.get("/free_slots")
+async def find_free_slots(request: Request,
+                          duration: int = Query(..., ge=5, le=720),
+                          uzman_id: int = Query(None),
+                          after: str = Query(None),
+                          limit: int = Query(10, ge=1, le=100),
+                          days: int = Query(31, ge=1, le=92),
+                          db: AsyncSession = Depends(get_async_db)):
+    user = await get_current_user(request)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+    if user.get('user_role') == 'user':
+        uzman_id = user.get("id")
+
+    uzm, = await reference_data("uzm")
+    names = {expert["id"]: expert["ad"] for expert in uzm if expert["is_active"] and not expert["is_delete"]}
+    if uzman_id is not None:
+        if uzman_id not in names:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Expert not found")
+        names = {uzman_id: names[uzman_id]}
+
+    start = parse_calendar_datetime(after) or clinic_now()
+    end = start + timedelta(days=days)
+    slots = await scheduling.search_free_slots(db, list(names), start, end, timedelta(minutes=duration), limit) if names else []
+
+    return [{"uzman_id": slot_uzman_id, "uzman_ad": names[slot_uzman_id], "start": slot_start, "end": slot_end}
+            for slot_uzman_id, slot_start, slot_end in slots]
+
+
+# Feed URLs are capabilities, so calendar clients can poll the feed without a session cookie:
+# the token is the expert id with the expert's random feed nonce, and replacing the nonce revokes it
+def feed_token(uzman_id, nonce):
+    return f"{uzman_id}-{nonce}"
+
+
+# Feed nonce of a user, created on first use; rotate replaces it. None if the user does not exist.
+# Only creating or replacing the nonce writes, so polling GET /calendar/feed_url stays a read.
+async def feed_nonce(db, uzman_id, rotate=False):
+    if not rotate:
+        nonce = (await db.execute(select(models.Users.feed_nonce).where(models.Users.id == uzman_id))).scalar()
+        if nonce is not None:
+            return nonce
+    nonce = secrets.token_urlsafe(24)
+    # Concurrent first requests must agree on one nonce, so an existing one is kept unless rotating
+    value = nonce if rotate else func.coalesce(models.Users.feed_nonce, nonce)
+    result = await db.execute(
+        update(models.Users).where(models.Users.id == uzman_id).values(feed_nonce=value)
+        .returning(models.Users.feed_nonce)
+    )
+    nonce = result.scalar()
+    await db.commit()
+    return nonce
+
+
+# Expert id of a valid feed token, None otherwise; deleted users' feeds are gone
+async def feed_owner(db, token):
+    uzman_id, _, nonce = token.partition("-")
+    # Ids beyond the integer column would fail the query instead of matching nothing
+    if not uzman_id.isdigit() or len(uzman_id) > 9 or not nonce:
+        return None
+    stored = (await db.execute(
+        select(models.Users.feed_nonce).where(models.Users.id == int(uzman_id), models.Users.is_delete.isnot(True))
+    )).scalar()
+    if stored is None or not hmac.compare_digest(stored, nonce):
+        return None
+    return int(uzman_id)
+
+
+def ics_escape(value):
+    return (str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+# Appointments are stored as the clinic's wall-clock time, so they are published as floating times,
+# which calendar clients show unchanged instead of shifting them from UTC
+def ics_datetime(value):
+    return f"{value:%Y%m%dT%H%M%S}"
+
+
+# DTSTAMP must be UTC (RFC 5545); change times are kept in UTC
+def ics_utc_datetime(value):
+    return f"{value:%Y%m%dT%H%M%S}Z"
+
+
+# Content line folded at 75 octets (RFC 5545), never inside a UTF-8 sequence
+def ics_line(line):
+    data = line.encode()
+    chunks = []
+    while len(data) > 75:
+        # Continuation lines start with a space, which counts towards the limit
+        cut = 74 if chunks else 75
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+    chunks.append(data)
+    return b"\r\n ".join(chunks) + b"\r\n"
+
+
+# Builds the VEVENT for a row of the events query
+def vevent_from_row(row, dtstamp):
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:todo-{row[0]}@{ICS_UID_DOMAIN}",
+        f"DTSTAMP:{dtstamp}",
+        f"DTSTART:{ics_datetime(row[1])}",
+        f"DTEND:{ics_datetime(row[2])}",
+        f"SUMMARY:{ics_escape(f'{row[6]} {row[7]}')}",
+    ]
+    if row[3]:
+        lines.append(f"DESCRIPTION:{ics_escape(row[3])}")
+    lines.append("END:VEVENT")
+    return b"".join(ics_line(line) for line in lines)
+
+
+# Subscription URL of the current user's feed; admins may ask for any expert's
+@router.get("/feed_url")
+async def feed_url(request: Request,
+                   uzman_id: int = Query(None),
+                   db: AsyncSession = Depends(get_async_db)):
+    return await feed_url_response(request, uzman_id, db, rotate=False)
+
+
+# Replaces the feed URL, e.g. after it leaked; subscriptions to the old one stop updating
+@router.post("/feed_url/rotate")
+async def feed_url_rotate(request: Request,
+                          uzman_id: int = Query(None),
+                          db: AsyncSession = Depends(get_async_db)):
+    return await feed_url_response(request, uzman_id, db, rotate=True)
+
+
+async def feed_url_response(request, uzman_id, db, rotate):
+    user = await get_current_user(request)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+    if user.get('user_role') == 'user' or uzman_id is None:
+        uzman_id = user.get("id")
+
+    nonce = await feed_nonce(db, uzman_id, rotate)
+    if nonce is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    return {"url": str(request.url_for("expert_feed", token=feed_token(uzman_id, nonce)))}
+
+
+# Per-expert iCalendar feed for phone and desktop calendar subscriptions.
+# Clients poll it every few minutes, so unchanged feeds answer 304 after one primary key lookup,
+# and the rendered feed is kept in the event cache, where the expert's writes invalidate it.
+@router.get("/feed/{token}.ics")
+async def expert_feed(request: Request,
+                      token: str,
+                      db: AsyncSession = Depends(get_async_db)):
+    uzman_id = await feed_owner(db, token)
+    if uzman_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+
+    # The window rolls at the clinic's midnight, which is therefore the earliest possible modification time
+    today = datetime.combine(clinic_today(), time())
+    window_start = today - timedelta(days=ICS_FEED_PAST_DAYS)
+    cache_key = ("ics", uzman_id, None, window_start, None)
+
+    version_rows = (await db.execute(versions.versions_query(versions.expert_scope(uzman_id), versions.CUSTOMERS))).all()
+    etag = versions.make_etag(version_rows, *cache_key)
+    modified = versions.last_modified(version_rows, floor=clinic_to_utc(today))
+    if versions.etag_matches(request, etag) or versions.not_modified_since(request, modified):
+        return versions.not_modified(etag, modified)
+    headers = versions.etag_headers(etag, modified)
+
+    chunks = event_cache.get(cache_key, tag=etag)
+    if chunks is not None:
+        return Response(b"".join(chunks), media_type="text/calendar", headers=headers)
+
+    window = (uzman_id, None, window_start, None)
+    return StreamingResponse(stream_feed(events_query(*window), window, cache_key, etag, ics_utc_datetime(modified)),
+                             media_type="text/calendar", headers=headers)
+
+
+# Streams the VEVENTs of a feed batch by batch and caches the rendered chunks once complete
+async def stream_feed(query, window, cache_key, etag, dtstamp):
+    chunks = [ICS_HEADER]
+    yield ICS_HEADER
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EVENT_STREAM_BATCH_SIZE))
+        async for rows in result.partitions():
+            chunk = b"".join(vevent_from_row(row, dtstamp) for row in rows)
+            chunks.append(chunk)
+            yield chunk
+        # Series are published as their expanded occurrences, up to the recurrence horizon
+        chunk = b"".join(vevent_from_row(row, dtstamp) for row, _, _ in await recurrence.occurrence_rows(db, *window))
+        if chunk:
+            chunks.append(chunk)
+            yield chunk
+    chunks.append(ICS_FOOTER)
+    yield ICS_FOOTER
+    event_cache.set(cache_key, chunks, tag=etag)
 
 
 @router.post("/event_add", response_class=HTMLResponse)
@@ -159,12 +516,52 @@ async def todos_create(request: Request,
                        musteri_id: int = Form(...),
                        charge_id: int = Form(1),
                        status_id: int = Form(0),
+                       rrule: str = Form(None),
 
                        db: Session = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
+    # With a recurrence rule the booking is stored once as a series and expanded when read
+    if rrule:
+        series_model = models.TodoSeries()
+        series_model.description = description
+        series_model.dtstart = datetime.strptime(start_time, '%Y-%m-%dT%H:%M')
+        duration = datetime.strptime(end_time, '%Y-%m-%dT%H:%M') - series_model.dtstart
+        if duration <= timedelta(0):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="End time must be after start time")
+        try:
+            series_model.rrule, series_model.last_end = recurrence.prepare_series(rrule, series_model.dtstart, duration)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid recurrence rule: {e}")
+        series_model.duration_minutes = int(duration.total_seconds() // 60)
+        series_model.exdates = []
+        series_model.uzman_id = uzman_id
+        series_model.sekreter_id = sekreter_id
+        series_model.musteri_id = musteri_id
+        series_model.charge_id = charge_id
+        series_model.status_id = status_id
+        series_model.is_delete = False
+        new_slot = (uzman_id, series_model.dtstart, series_model.last_end)
+
+        versions.bump(db, *versions.todo_scopes(uzman_id))
+        # The occurrences are never rows, so the exclusion constraint cannot check them
+        scheduling.lock_experts(db, uzman_id)
+        starts = recurrence.checked_starts(series_model.rrule, series_model.dtstart, series_model.last_end)
+        conflicts = scheduling.find_series_conflicts(db, uzman_id, starts, duration)
+        if conflicts:
+            db.rollback()
+            return scheduling.conflict_response(conflicts)
+
+        db.add(series_model)
+        live.publish(db, [new_slot], refetch=True)
+        db.commit()
+
+        event_cache.invalidate(*new_slot)
+
+        return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
+
     todo_model = models.Todos()
     todo_model.description = description
     todo_model.start_time = datetime.strptime(start_time, '%Y-%m-%dT%H:%M')  # '%Y-%m-%d %H:%M'
@@ -174,9 +571,17 @@ async def todos_create(request: Request,
     todo_model.musteri_id = musteri_id
     todo_model.charge_id = charge_id
     todo_model.status_id = status_id
+    new_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+    scheduling.validate_slot(*new_slot[1:])
 
     db.add(todo_model)
-    db.commit()
+    versions.bump(db, *versions.todo_scopes(uzman_id))
+    live.publish(db, [new_slot], [todo_model])
+    conflict = scheduling.commit_booking(db, new_slot)
+    if conflict is not None:
+        return conflict
+
+    event_cache.invalidate(*new_slot)
 
     return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
 
@@ -194,9 +599,19 @@ async def delete_todo(request: Request,
     if todo_model is None:
         return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
 
+    old_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+
+    # Deleting an edited occurrence cancels it, rather than bringing back the generated one
+    if todo_model.series_id is not None:
+        recurrence.exclude_occurrence(db, todo_model.series_id, todo_model.recurrence_id)
+
     db.delete(todo_model)
+    versions.bump(db, *versions.todo_scopes(old_slot[0]))
+    live.publish(db, [old_slot], [todo_id])
     db.commit()
 
+    event_cache.invalidate(*old_slot)
+
     return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
 
 
@@ -229,6 +644,8 @@ async def event_edit_commit(request: Request,
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
     todo_model = db.query(models.Todos).filter(models.Todos.id == todo_id).first()
+    old_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+
     todo_model.description = description
     todo_model.start_time = datetime.strptime(start_time, '%Y-%m-%dT%H:%M')  # '%Y-%m-%d %H:%M'
     todo_model.end_time = datetime.strptime(end_time, '%Y-%m-%dT%H:%M')  # '%Y-%m-%d %H:%M'
@@ -237,14 +654,244 @@ async def event_edit_commit(request: Request,
     todo_model.musteri_id = musteri_id
     todo_model.charge_id = charge_id
     todo_model.status_id = status_id
+    new_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+    scheduling.validate_slot(*new_slot[1:])
 
     db.add(todo_model)
+    versions.bump(db, *versions.todo_scopes(old_slot[0], new_slot[0]))
+    live.publish(db, [old_slot, new_slot], [todo_id])
+    conflict = scheduling.commit_booking(db, new_slot, exclude_id=todo_id)
+    if conflict is not None:
+        return conflict
+
+    event_cache.invalidate(*old_slot)
+    event_cache.invalidate(*new_slot)
+
+    return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
+
+
+# Drag-and-drop moves and resizes, one move or a list of them, applied in one transaction by a single
+# UPDATE ... FROM (VALUES ...) statement. The todos table is joined a second time as `old`, whose
+# columns still hold the values from before the update, so RETURNING yields both slots of every
+# booking without a separate SELECT. All moves are applied or none: unknown (or, for experts, other
+# experts') bookings give a 404 and overlaps a 409 listing the conflicts of the whole batch.
+# Generated occurrences of a series have no row yet and are edited through the occurrence endpoint.
+@router.patch("/events")
+async def move_events(request: Request,
+                      moves: Union[EventMove, List[EventMove]],
+                      db: Session = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+    if isinstance(moves, EventMove):
+        moves = [moves]
+    if not moves:
+        return []
+    if len(moves) > MAX_EVENT_MOVES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_EVENT_MOVES} moves per request")
+    if len({move.id for move in moves}) < len(moves):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each booking may only be moved once per request")
+
+    # Experts only ever move their own bookings, and keep them
+    expert_id = user.get("id") if user.get('user_role') == 'user' else None
+    if expert_id is not None and any(move.uzman_id != expert_id for move in moves):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Bookings cannot be moved to other experts")
+
+    rows = []
+    for move in moves:
+        start, end = parse_calendar_datetime(move.start), parse_calendar_datetime(move.end)
+        scheduling.validate_slot(start, end)
+        rows.append((move.id, move.uzman_id, start, end))
+
+    todos = models.Todos.__table__
+    old = todos.alias("old")
+    new_slots = values(column("id", Integer), column("uzman_id", Integer), column("start_time", DateTime),
+                       column("end_time", DateTime), name="moves").data(rows)
+    statement = (
+        update(todos)
+        .where(todos.c.id == new_slots.c.id, old.c.id == new_slots.c.id, todos.c.is_delete.isnot(True))
+        .values(start_time=new_slots.c.start_time, end_time=new_slots.c.end_time, uzman_id=new_slots.c.uzman_id)
+        .returning(todos.c.id, todos.c.start_time, todos.c.end_time, todos.c.uzman_id, todos.c.musteri_id,
+                   todos.c.status_id, todos.c.description, old.c.uzman_id.label("old_uzman_id"),
+                   old.c.start_time.label("old_start_time"), old.c.end_time.label("old_end_time"))
+    )
+    if expert_id is not None:
+        statement = statement.where(todos.c.uzman_id == expert_id)
+
+    # Locks are taken in the order every booking writer uses: the version rows and schedule locks of
+    # the old and new experts, then the todo rows. The bookings' current experts are read first and
+    # again once locked; if one changed hands meanwhile, the locks are released and taken anew.
+    current_experts = select(todos.c.uzman_id).where(todos.c.id.in_([move.id for move in moves]))
+    locked = set()
+    while True:
+        experts = ({move.uzman_id for move in moves} | set(db.execute(current_experts).scalars())) - {None}
+        if experts <= locked:
+            break
+        db.rollback()
+        versions.bump(db, *versions.todo_scopes(*experts))
+        scheduling.lock_experts(db, *experts)
+        locked = experts
+
+    try:
+        updated = db.execute(statement).all()
+    except IntegrityError as error:
+        db.rollback()
+        if not scheduling.is_overlap_violation(error):
+            raise
+        return scheduling.conflict_response(scheduling.find_move_conflicts(db, rows))
+
+    missing = sorted({move.id for move in moves} - {row.id for row in updated})
+    if missing:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={"message": "Bookings not found", "ids": missing})
+
+    # Generated occurrences are not covered by the exclusion constraint
+    if scheduling.slots_hit_occurrences(db, [slot for _, *slot in rows]):
+        db.rollback()
+        return scheduling.conflict_response(scheduling.find_move_conflicts(db, rows))
+
+    slots = [(row.old_uzman_id, row.old_start_time, row.old_end_time) for row in updated]
+    slots += [(row.uzman_id, row.start_time, row.end_time) for row in updated]
+    live.publish(db, slots, [row.id for row in updated])
     db.commit()
 
+    for slot in slots:
+        event_cache.invalidate(*slot)
+
+    return [{
+        "id": row.id,
+        "start": row.start_time,
+        "end": row.end_time,
+        "uzman_id": row.uzman_id,
+        "musteri_id": row.musteri_id,
+        "status_id": row.status_id,
+        "description": row.description,
+    } for row in updated]
+
+
+# Edits one occurrence of a series by storing it as an override row (series_id, recurrence_id).
+# An occurrence edited before is already a todo, and the client then edits it through PUT /{todo_id}.
+@router.put("/series/{series_id}/occurrences/{recurrence_id}", response_class=HTMLResponse)
+async def occurrence_edit_commit(request: Request,
+                                 series_id: int,
+                                 recurrence_id: str,
+                                 description: str = Form(...),
+                                 start_time: str = Form(...),
+                                 end_time: str = Form(...),
+                                 uzman_id: int = Form(...),
+                                 sekreter_id: int = Form(3),
+                                 musteri_id: int = Form(...),
+                                 charge_id: int = Form(None),
+                                 status_id: int = Form(None),
+
+                                 db: Session = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    series_model, original_start = get_occurrence(db, series_id, recurrence_id)
+
+    todo_model = db.query(models.Todos).filter(models.Todos.series_id == series_id,
+                                               models.Todos.recurrence_id == original_start).first()
+    if todo_model is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Occurrence was already edited")
+
+    old_slot = (series_model.uzman_id, original_start, original_start + timedelta(minutes=series_model.duration_minutes))
+
+    todo_model = models.Todos()
+    todo_model.series_id = series_id
+    todo_model.recurrence_id = original_start
+    todo_model.description = description
+    todo_model.start_time = datetime.strptime(start_time, '%Y-%m-%dT%H:%M')  # '%Y-%m-%d %H:%M'
+    todo_model.end_time = datetime.strptime(end_time, '%Y-%m-%dT%H:%M')  # '%Y-%m-%d %H:%M'
+    todo_model.uzman_id = uzman_id
+    todo_model.sekreter_id = sekreter_id
+    todo_model.musteri_id = musteri_id
+    todo_model.charge_id = series_model.charge_id if charge_id is None else charge_id
+    todo_model.status_id = series_model.status_id if status_id is None else status_id
+    todo_model.is_delete = False
+    new_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+    scheduling.validate_slot(*new_slot[1:])
+
+    db.add(todo_model)
+    versions.bump(db, *versions.todo_scopes(old_slot[0], new_slot[0]))
+    # The generated occurrence has no todo id to retract, so the affected views are reloaded
+    live.publish(db, [old_slot, new_slot], refetch=True)
+    conflict = scheduling.commit_booking(db, new_slot)
+    if conflict is not None:
+        return conflict
+
+    event_cache.invalidate(*old_slot)
+    event_cache.invalidate(*new_slot)
+
+    return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
+
+
+# Cancels one occurrence of a series
+@router.delete("/series/{series_id}/occurrences/{recurrence_id}")
+async def occurrence_delete(request: Request,
+                            series_id: int,
+                            recurrence_id: str,
+                            db: Session = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    series_model, original_start = get_occurrence(db, series_id, recurrence_id)
+    old_slot = (series_model.uzman_id, original_start, original_start + timedelta(minutes=series_model.duration_minutes))
+
+    recurrence.exclude_occurrence(db, series_id, original_start)
+    versions.bump(db, *versions.todo_scopes(old_slot[0]))
+    live.publish(db, [old_slot], refetch=True)
+    db.commit()
+
+    event_cache.invalidate(*old_slot)
+
     return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
 
 
+# Deletes a whole series together with its edited occurrences
+@router.delete("/series/{series_id}")
+async def series_delete(request: Request,
+                        series_id: int,
+                        db: Session = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    series_model = db.query(models.TodoSeries).filter(models.TodoSeries.id == series_id,
+                                                      models.TodoSeries.is_delete == False).first()
+    if series_model is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Series not found")
+
+    old_slot = (series_model.uzman_id, series_model.dtstart, series_model.last_end)
+    override_experts = {uzman_id for uzman_id, in db.query(models.Todos.uzman_id).filter(models.Todos.series_id == series_id)}
+
+    series_model.is_delete = True
+    db.query(models.Todos).filter(models.Todos.series_id == series_id).update({models.Todos.is_delete: True})
+    versions.bump(db, *versions.todo_scopes(old_slot[0], *override_experts))
+    live.publish(db, [old_slot, *((uzman_id, None, None) for uzman_id in override_experts)], refetch=True)
+    db.commit()
+
+    event_cache.invalidate(*old_slot)
+    for uzman_id in override_experts:
+        event_cache.invalidate(uzman_id)
 
+    return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
+
+
+# Live series and parsed start of one of its generated occurrences, 404 otherwise
+def get_occurrence(db, series_id, recurrence_id):
+    series_model = db.query(models.TodoSeries).filter(models.TodoSeries.id == series_id,
+                                                      models.TodoSeries.is_delete == False).first()
+    try:
+        original_start = recurrence.parse_recurrence_id(recurrence_id)
+    except ValueError:
+        original_start = None
+    if series_model is None or original_start is None or not recurrence.is_occurrence(series_model, original_start):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Occurrence not found")
+    return series_model, original_start
 
 
 @router.post("/customers_add", response_class=HTMLResponse)
@@ -277,6 +924,7 @@ async def create_customers(request: Request,
     customers_model.is_delete = False
 
     db.add(customers_model)
+    versions.bump(db, versions.CUSTOMERS)
     db.commit()
 
     return RedirectResponse(url="/calendar", status_code=status.HTTP_302_FOUND)
\ No newline at end of file
@@ -9,10 +9,12 @@ from starlette import status
 from starlette.responses import RedirectResponse
 from fastapi import Depends, APIRouter, Request, Form
 import models
-from database import engine, SessionLocal
+from database import SessionLocal
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from routers.web_auth import get_current_user
+import versions
+from cache import reference_cache
 
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
@@ -24,8 +26,6 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 templates = Jinja2Templates(directory="templates")
 
 
@@ -58,10 +58,16 @@ async def read_by_user(request: Request, db: Session = Depends(get_db)):
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
+    version_rows = db.execute(versions.versions_query(versions.CHARGES)).all()
+    etag = versions.make_etag(version_rows, user.get("id"), request.url.query)
+    if versions.etag_matches(request, etag):
+        return versions.not_modified(etag)
+
     #charges = db.query(models.charges).filter(models.charges.id == customer.get("id")).all()
     charge = db.query(models.Charge).all()
 
-    return templates.TemplateResponse("charges.html", {"request": request, "charge": charge, "user": user})
+    return templates.TemplateResponse("charges.html", {"request": request, "charge": charge, "user": user},
+                                      headers=versions.etag_headers(etag))
 
 
 @router.get("/charges_add", response_class=HTMLResponse)
@@ -99,7 +105,9 @@ async def create_charges(request: Request,
 
 
     db.add(charge_model)
+    versions.bump(db, versions.CHARGES)
     db.commit()
+    reference_cache.invalidate("chg")
 
     return RedirectResponse(url="/charges", status_code=status.HTTP_302_FOUND)
 
@@ -143,7 +151,9 @@ async def charges_edit_commit(request: Request,
 
 
     db.add(charge_model)
+    versions.bump(db, versions.CHARGES)
     db.commit()
+    reference_cache.invalidate("chg")
 
     return RedirectResponse(url="/charges", status_code=status.HTTP_302_FOUND)
 
@@ -166,8 +176,10 @@ async def charges_delete(request: Request,
         return RedirectResponse(url="/charges", status_code=status.HTTP_302_FOUND)
 
     db.query(models.Charge).filter(models.Charge.id == charge_id).update({models.Charge.is_delete: True})
+    versions.bump(db, versions.CHARGES)
 
     db.commit()
+    reference_cache.invalidate("chg")
 
     return RedirectResponse(url="/charges", status_code=status.HTTP_302_FOUND)
 
@@ -192,8 +204,10 @@ async def charges_hard_delete(request: Request,
         return RedirectResponse(url="/charges", status_code=status.HTTP_302_FOUND)
 
     db.query(models.Charge).filter(models.Charge.id == charge_id).delete()
+    versions.bump(db, versions.CHARGES)
 
     db.commit()
+    reference_cache.invalidate("chg")
 
     return RedirectResponse(url="/charges", status_code=status.HTTP_302_FOUND)
 
@@ -12,12 +12,16 @@ from passlib.context import CryptContext
 
 from starlette import status
 from starlette.responses import RedirectResponse
-from fastapi import Depends, APIRouter, Request, Form, File, UploadFile
+from fastapi import Depends, APIRouter, HTTPException, Request, Form, File, UploadFile, Query
 import models
-from database import engine, SessionLocal
+from database import SessionLocal, AsyncSessionLocal
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from routers.web_auth import get_current_user
+from cache import event_cache
+import versions
 
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
@@ -28,10 +32,13 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 templates = Jinja2Templates(directory="templates")
 
+# Number of matches the customer typeahead returns by default, and the shortest term it searches for
+# (trigram matching needs at least two characters to narrow the index scan)
+CUSTOMER_SEARCH_LIMIT = int(os.getenv("CUSTOMER_SEARCH_LIMIT", "20"))
+CUSTOMER_SEARCH_MIN_LENGTH = 2
+
 
 def get_db():
     db = SessionLocal()
@@ -41,6 +48,11 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
@@ -58,10 +70,54 @@ async def read_by_user(request: Request, db: Session = Depends(get_db)):
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
+    version_rows = db.execute(versions.versions_query(versions.CUSTOMERS)).all()
+    etag = versions.make_etag(version_rows, user.get("id"), request.url.query)
+    if versions.etag_matches(request, etag):
+        return versions.not_modified(etag)
+
     # customers = db.query(models.Customers).filter(models.Customers.id == customer.get("id")).all()
     customers = db.query(models.Customers).all()
 
-    return templates.TemplateResponse("customers.html", {"request": request, "customers": customers, "user": user})
+    return templates.TemplateResponse("customers.html", {"request": request, "customers": customers, "user": user},
+                                      headers=versions.etag_headers(etag))
+
+
+# Escapes the LIKE wildcards in a search term
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# Typeahead for the customer pickers: active customers with a name, surname, phone, email or TC
+# starting with every word of q, served by the trigram index on models.CUSTOMER_SEARCH_TEXT
+@router.get("/search")
+async def customers_search(request: Request,
+                           q: str = Query(""),
+                           limit: int = Query(CUSTOMER_SEARCH_LIMIT, ge=1, le=100),
+                           db: AsyncSession = Depends(get_async_db)):
+    user = await get_current_user(request)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+    terms = q.lower().split()
+    if not any(len(term) >= CUSTOMER_SEARCH_MIN_LENGTH for term in terms):
+        return []
+
+    query = (
+        select(models.Customers.id, models.Customers.ad, models.Customers.soyad, models.Customers.email,
+               models.Customers.telno, models.Customers.tc)
+        .where(models.Customers.is_active == True, models.Customers.is_delete == False)
+        .order_by(models.Customers.ad, models.Customers.soyad, models.Customers.id)
+        .limit(limit)
+    )
+    for term in terms:
+        query = query.where(models.customer_search_text.like(f"% {escape_like(term)}%", escape="\\"))
+
+    return [
+        {**row._asdict(),
+         "label": f"{row.ad or ''} {row.soyad or ''}".strip(),
+         "detail": " ".join(str(value) for value in (row.telno, row.email, row.tc) if value)}
+        for row in await db.execute(query)
+    ]
 
 
 @router.get("/customers_add", response_class=HTMLResponse)
@@ -104,6 +160,7 @@ async def create_customers(request: Request,
     customers_model.is_delete = False
 
     db.add(customers_model)
+    versions.bump(db, versions.CUSTOMERS)
     db.commit()
 
     return RedirectResponse(url="/customers", status_code=status.HTTP_302_FOUND)
@@ -159,8 +216,12 @@ async def customers_edit_commit(request: Request,
     customers_model.is_delete = False
 
     db.add(customers_model)
+    versions.bump(db, versions.CUSTOMERS)
     db.commit()
 
+    # Customer names are part of every cached event title
+    event_cache.clear()
+
     msg = "Successfuly uploaded"
 
     return RedirectResponse(url=f"/customers/customers_edit/{customer_id}?msg={msg}", status_code=status.HTTP_302_FOUND)
@@ -180,6 +241,7 @@ async def customers_delete(request: Request,
 
 
     db.query(models.Customers).filter(models.Customers.id == customer_id).update({models.Customers.is_delete: True})
+    versions.bump(db, versions.CUSTOMERS)
 
     db.commit()
 
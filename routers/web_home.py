@@ -6,10 +6,15 @@ from starlette.responses import RedirectResponse
 
 from fastapi import Depends, APIRouter, Path, HTTPException, Request, Form, Query
 import models
-from database import engine, SessionLocal
+from database import SessionLocal, AsyncSessionLocal
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
 from routers.web_auth import get_current_user
-from datetime import date, datetime
+from cache import dashboard_cache
+from clinic_time import clinic_today
+from datetime import date, datetime, time, timedelta
+import os
 
 
 from fastapi.responses import HTMLResponse
@@ -22,10 +27,12 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 templates = Jinja2Templates(directory="templates")
 
+# Status ids counted as completed appointments on the dashboard; every other status counts as open
+COMPLETED_STATUS_IDS = {int(status_id) for status_id in os.getenv("COMPLETED_STATUS_IDS", "1").split(",")}
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -34,25 +41,69 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Aggregates shown on the home page, computed in SQL for the given expert (None = all experts)
+async def dashboard_summary(db: AsyncSession, uzman_id, today):
+    day_start = datetime.combine(today, time.min)
+    week_start = day_start - timedelta(days=today.weekday())  # Monday of the current week
+    week_end = week_start + timedelta(days=7)
+
+    live = [models.Todos.is_delete == False]
+    if uzman_id is not None:
+        live.append(models.Todos.uzman_id == uzman_id)
+
+    status_rows = (await db.execute(
+        select(models.Todos.status_id, models.Status.status_name, func.count().label("count"))
+        .outerjoin(models.Todos.todos_status)
+        .where(*live)
+        .group_by(models.Todos.status_id, models.Status.status_name)
+        .order_by(models.Todos.status_id)
+    )).all()
+
+    expert_rows = (await db.execute(
+        select(
+            models.Todos.uzman_id,
+            models.Users.ad.label("uzman_ad"),
+            func.count().filter(models.Todos.start_time >= day_start,
+                                models.Todos.start_time < day_start + timedelta(days=1)).label("today"),
+            func.count().label("week")
+        )
+        .join(models.Todos.todos_users_uzman)
+        .where(*live, models.Todos.start_time >= week_start, models.Todos.start_time < week_end)
+        .group_by(models.Todos.uzman_id, models.Users.ad)
+        .order_by(models.Users.ad)
+    )).all()
+
+    total = sum(row.count for row in status_rows)
+    completed = sum(row.count for row in status_rows if row.status_id in COMPLETED_STATUS_IDS)
+    return {
+        "statuses": [dict(row._mapping) for row in status_rows],
+        "experts": [dict(row._mapping) for row in expert_rows],
+        "total": total,
+        "completed": completed,
+        "open": total - completed,
+    }
+
 
 @router.get("/", response_class=HTMLResponse)
-async def read_all_by_user(request: Request, db: Session = Depends(get_db)):
+async def read_all_by_user(request: Request, db: AsyncSession = Depends(get_async_db)):
 
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    if user.get('user_role') == 'user':
-        todos = db.query(models.Todos).filter(models.Todos.uzman_id == user.get("id")).all()
-
-    if user.get('user_role') == 'admin':
-        todos = db.query(models.Todos).all()
-
+    # Experts see the numbers of their own bookings, admins the totals of all experts
+    uzman_id = user.get("id") if user.get('user_role') == 'user' else None
+    today = clinic_today()
 
-    uzm = db.query(models.Users).filter(models.Users.uzman == True and models.Users.is_active == True and models.Users.is_delete == False ).all()
-    sek = db.query(models.Users).filter(models.Users.sekreter == True and models.Users.is_active == True and models.Users.is_delete == False).all()
-    mus = db.query(models.Customers).filter(models.Customers.is_active == True and models.Customers.is_delete == False).all()
-    chg = db.query(models.Charge).filter(models.Charge.is_active == True and models.Charge.is_delete == False).all()
-    sts = db.query(models.Status).filter(models.Status.is_active == True and models.Status.is_delete == False).all()
+    cache_key = (uzman_id, today)
+    summary = dashboard_cache.get(cache_key)
+    if summary is None:
+        summary = await dashboard_summary(db, uzman_id, today)
+        dashboard_cache.set(cache_key, summary)
 
-    return templates.TemplateResponse("home.html", {"request": request, "todos": todos,  "uzm": uzm, "sek": sek, "mus": mus, "chg": chg, "sts": sts, "user": user})
\ No newline at end of file
+    return templates.TemplateResponse("home.html", {"request": request, "summary": summary, "user": user})
@@ -0,0 +1,72 @@
+import hmac
+import os
+import sys
+sys.path.append("..")
+
+from starlette import status
+from starlette.responses import PlainTextResponse
+from fastapi import APIRouter, HTTPException, Request
+
+import database
+import live
+from middlewares import metrics
+from routers.web_auth import get_current_user
+
+# Bearer token the Prometheus scraper sends to /metrics; without it only admins may read the page
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"],
+    responses={404: {"description": "Not found"}}
+)
+
+# Unprefixed, at the path scrapers expect
+metrics_router = APIRouter(tags=["internal"])
+
+
+# Connection pool usage of this worker, for sizing the pools against the worker count
+# (only accessible to admins). Counters are per process and start at zero on restart.
+@router.get("/pool")
+async def pool_stats(request: Request):
+    user = await get_current_user(request)
+    if user is None or user.get('user_role') != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+    return {
+        "settings": {
+            "pool_size": database.DB_POOL_SIZE,
+            "max_overflow": database.DB_MAX_OVERFLOW,
+            "pool_timeout": database.DB_POOL_TIMEOUT,
+            "pool_recycle": database.DB_POOL_RECYCLE,
+            "pool_pre_ping": database.DB_POOL_PRE_PING,
+            "connect_timeout": database.DB_CONNECT_TIMEOUT,
+            "statement_timeout_ms": database.DB_STATEMENT_TIMEOUT_MS,
+        },
+        "sync": database.engine.pool.stats(),
+        "async": database.async_engine.pool.stats(),
+    }
+
+
+# Request metrics of this worker in the Prometheus text format (see middlewares/metrics.py),
+# followed by the connection pool and live stream gauges
+@metrics_router.get("/metrics")
+async def prometheus_metrics(request: Request):
+    authorization = request.headers.get("authorization", "")
+    if not (METRICS_TOKEN and hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")):
+        user = await get_current_user(request)
+        if user is None or user.get('user_role') != 'admin':
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+    extra = []
+    for name, engine in (("sync", database.engine), ("async", database.async_engine)):
+        pool = engine.pool.stats()
+        extra += [
+            (f"db_pool_{name}_checked_out", "gauge", f"Connections in use in the {name} pool", pool["checked_out"]),
+            (f"db_pool_{name}_timeouts_total", "counter", f"Checkouts of the {name} pool that timed out", pool["timeouts"]),
+            (f"db_pool_{name}_wait_seconds_max", "gauge", f"Longest wait for a connection of the {name} pool",
+             pool["max_wait_ms"] / 1000),
+        ]
+    extra.append(("live_subscribers", "gauge", "Open /calendar/live streams", live.broker.stats()["subscribers"]))
+
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,70 @@
+import sys
+sys.path.append("..")
+
+from starlette import status
+from fastapi import Depends, APIRouter, HTTPException, Request, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import rollups
+from clinic_time import clinic_today
+from database import AsyncSessionLocal
+from routers.web_auth import get_current_user
+
+router = APIRouter(
+    prefix="/reports",
+    tags=["reports"],
+    responses={404: {"description": "Not found"}}
+)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def optional_id(value):
+    return None if value == rollups.NO_ID else value
+
+
+# Revenue per expert, month and status from the rollup table, for the months start..end (YYYY-MM,
+# by default the current year up to this month). Experts only get their own figures.
+@router.get("/revenue")
+async def revenue_report(request: Request,
+                         start: str = Query(None),
+                         end: str = Query(None),
+                         uzman_id: int = Query(None),
+                         db: AsyncSession = Depends(get_async_db)):
+    user = await get_current_user(request)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    if user.get('user_role') == 'user':
+        uzman_id = user.get("id")
+
+    today = clinic_today()
+    try:
+        first_month = rollups.parse_month(start) if start else today.replace(month=1, day=1)
+        last_month = rollups.parse_month(end) if end else today
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Months are given as YYYY-MM")
+
+    rows = (await db.execute(rollups.report_query(first_month, last_month, uzman_id))).all()
+
+    report = [{
+        "uzman_id": optional_id(row.uzman_id),
+        "uzman_ad": row.uzman_ad,
+        "uzman_soyad": row.uzman_soyad,
+        "month": row.month.strftime("%Y-%m"),
+        "status_id": optional_id(row.status_id),
+        "status_name": row.status_name,
+        "count": row.count,
+        "net": row.net,
+        "tax": row.tax,
+        "total": row.total,
+    } for row in rows]
+
+    return {
+        "start": first_month.strftime("%Y-%m"),
+        "end": last_month.strftime("%Y-%m"),
+        "rows": report,
+        "totals": {key: sum(row[key] for row in report) for key in ("count", "net", "tax", "total")},
+    }
@@ -1,15 +1,26 @@
+import base64
 import sys
 sys.path.append("..")
 
 from starlette import status
-from starlette.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import RedirectResponse, JSONResponse
 
-from fastapi import Depends, APIRouter, Path, HTTPException, Request, Form, Query
+from fastapi import Depends, APIRouter, Path, HTTPException, Request, Form, Query, File, UploadFile
 import models
-from database import engine, SessionLocal
+import importer
+import live
+import recurrence
+import scheduling
+from database import SessionLocal, AsyncSessionLocal
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, tuple_
 from routers.web_auth import get_current_user
-from datetime import datetime
+from cache import event_cache, reference_data
+import versions
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
 
 
 from fastapi.responses import HTMLResponse
@@ -22,8 +33,6 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 templates = Jinja2Templates(directory="templates")
 
 def get_db():
@@ -34,50 +43,181 @@ def get_db():
         db.close()
 
 
-@router.get("/", response_class=HTMLResponse)
-async def read_all_by_user(request: Request, db: Session = Depends(get_db)):
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-    user = await get_current_user(request)
-    if user is None:
-        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    if user.get('user_role') == 'user':
-        todos = db.query(models.Todos).filter(models.Todos.uzman_id == user.get("id")).all()
+# Page cursors are the (start_time, id) key of the boundary row, base64-encoded for the URL
+def encode_cursor(todo):
+    raw = f"{todo.start_time.isoformat()}|{todo.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
-    if user.get('user_role') == 'admin':
-        todos = db.query(models.Todos).all()
 
+def decode_cursor(cursor):
+    try:
+        start_time, todo_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(start_time), int(todo_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page cursor")
 
-    uzm = db.query(models.Users).filter(models.Users.uzman == True and models.Users.is_active == True and models.Users.is_delete == False ).all()
-    sek = db.query(models.Users).filter(models.Users.sekreter == True and models.Users.is_active == True and models.Users.is_delete == False).all()
-    mus = db.query(models.Customers).filter(models.Customers.is_active == True and models.Customers.is_delete == False).all()
-    chg = db.query(models.Charge).filter(models.Charge.is_active == True and models.Charge.is_delete == False).all()
-    sts = db.query(models.Status).filter(models.Status.is_active == True and models.Status.is_delete == False).all()
 
-    return templates.TemplateResponse("todos.html", {"request": request, "todos": todos,  "uzm": uzm, "sek": sek, "mus": mus, "chg": chg, "sts": sts, "user": user})
+# The filter form submits its empty choices ('all uzman', no date) as empty strings, which mean no filter
+def optional_int(value, name):
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {name}: {value}")
 
 
+def optional_date(value, name):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {name}: {value}")
+
+
+# Link to another page of the listing, keeping the current filters
+def page_url(request: Request, **cursor):
+    params = {key: value for key, value in request.query_params.items() if key not in ("after", "before")}
+    params.update(cursor)
+    return "?" + urlencode(params)
+
+
+@router.get("/", response_class=HTMLResponse)
+async def read_all_by_user(request: Request,
+                           after: str = Query(None),
+                           before: str = Query(None),
+                           uzman_id: str = Query(None),
+                           status_id: str = Query(None),
+                           date_from: str = Query(None),
+                           date_to: str = Query(None),
+                           limit: int = Query(50, ge=1, le=200),
+                           db: AsyncSession = Depends(get_async_db)):
 
-@router.get("/todos_add", response_class=HTMLResponse)
-async def todos_new_add(request: Request,
-                       db: Session = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
+    uzman_id = optional_int(uzman_id, "uzman_id")
+    status_id = optional_int(status_id, "status_id")
+    date_from = optional_date(date_from, "date_from")
+    date_to = optional_date(date_to, "date_to")
+
+    # The page shows todos with customer, expert, status and charge details
+    todo_scope = versions.expert_scope(user.get("id")) if user.get('user_role') == 'user' else versions.TODOS
+    version_rows = (await db.execute(versions.versions_query(
+        todo_scope, versions.CUSTOMERS, versions.USERS, versions.CHARGES))).all()
+    etag = versions.make_etag(version_rows, user.get("id"), user.get('user_role'), request.url.query)
+    if versions.etag_matches(request, etag):
+        return versions.not_modified(etag)
+
+    # Display names are resolved here in one joined query instead of by scanning the
+    # reference lists for every row in the template
+    query = (
+        select(
+            models.Todos.id,
+            models.Todos.start_time,
+            models.Todos.end_time,
+            models.Todos.description,
+            models.Todos.uzman_id,
+            models.Todos.musteri_id,
+            models.Todos.status_id,
+            models.Todos.charge_id,
+            models.Customers.ad.label("musteri_ad"),
+            models.Users.ad.label("uzman_ad"),
+            models.Status.status_name,
+            models.Charge.total.label("charge_total")
+        )
+        .outerjoin(models.Todos.todos_customers)
+        .outerjoin(models.Todos.todos_users_uzman)
+        .outerjoin(models.Todos.todos_status)
+        .outerjoin(models.Todos.todos_charge)
+        .where(models.Todos.is_delete == False)
+    )
+
+    # Experts only ever see their own bookings; admins may narrow the list to one expert
+    if user.get('user_role') == 'user':
+        query = query.where(models.Todos.uzman_id == user.get("id"))
+    elif uzman_id is not None:
+        query = query.where(models.Todos.uzman_id == uzman_id)
+
+    if status_id is not None:
+        query = query.where(models.Todos.status_id == status_id)
+    if date_from is not None:
+        query = query.where(models.Todos.start_time >= date_from)
+    if date_to is not None:
+        query = query.where(models.Todos.start_time < date_to + timedelta(days=1))
+
+    # Keyset pagination on (start_time, id): each page seeks past its cursor instead of using OFFSET,
+    # so every page costs the same however deep it is. One extra row tells whether another page exists.
+    page_key = tuple_(models.Todos.start_time, models.Todos.id)
+    if before is not None:
+        query = query.where(page_key < tuple_(*decode_cursor(before)))
+        query = query.order_by(models.Todos.start_time.desc(), models.Todos.id.desc())
+    else:
+        if after is not None:
+            query = query.where(page_key > tuple_(*decode_cursor(after)))
+        query = query.order_by(models.Todos.start_time, models.Todos.id)
+
+    todos = (await db.execute(query.limit(limit + 1))).all()
+    has_more = len(todos) > limit
+    todos = todos[:limit]
+    if before is not None:
+        todos.reverse()
+
+    # Walking forwards the extra row means a next page; walking backwards it means a previous one,
+    # and the next page is the one we came from
+    if before is None:
+        has_next, has_prev = has_more, after is not None
+    else:
+        has_next, has_prev = True, has_more
+    next_url = page_url(request, after=encode_cursor(todos[-1])) if todos and has_next else None
+    prev_url = page_url(request, before=encode_cursor(todos[0])) if todos and has_prev else None
+
+    # Only the filter dropdowns still need reference lists
+    uzm, sts = await reference_data("uzm", "sts")
+
+    return templates.TemplateResponse("todos.html", {"request": request, "todos": todos,  "uzm": uzm, "sts": sts, "user": user,
+                                                     "next_url": next_url, "prev_url": prev_url,
+                                                     "filters": {"uzman_id": uzman_id, "status_id": status_id,
+                                                                 "date_from": date_from, "date_to": date_to}},
+                                      headers=versions.etag_headers(etag))
+
+
+
+# Dropdown lists of the add and edit forms; experts can only book themselves
+async def form_lists(db, user):
     if user.get('user_role') == 'user':
         uzm = db.query(models.Users).filter(models.Users.id == user.get("id")).all()
+    else:
+        uzm, = await reference_data("uzm")
+    sek, chg, sts = await reference_data("sek", "chg", "sts")
+    return {"uzm": uzm, "sek": sek, "chg": chg, "sts": sts}
 
-    if user.get('user_role') == 'admin':
-        uzm = db.query(models.Users).filter(models.Users.uzman == True and models.Users.is_active == True and models.Users.is_delete == False ).all()
 
+# Only the booked customer is rendered; the picker searches the others through /customers/search
+def customer_option(db, musteri_id):
+    if musteri_id is None:
+        return None
+    return db.execute(
+        select(models.Customers.id, models.Customers.ad, models.Customers.soyad, models.Customers.email,
+               models.Customers.telno).where(models.Customers.id == musteri_id)
+    ).first()
 
-    sek = db.query(models.Users).filter(models.Users.sekreter == True and models.Users.is_active == True and models.Users.is_delete == False).all()
-    mus = db.query(models.Customers).filter(models.Customers.is_active == True and models.Customers.is_delete == False).all()
-    chg = db.query(models.Charge).filter(models.Charge.is_active == True and models.Charge.is_delete == False).all()
-    sts = db.query(models.Status).filter(models.Status.is_active == True and models.Status.is_delete == False).all()
 
-    return templates.TemplateResponse("todos_add.html", {"request": request, "uzm": uzm, "sek": sek, "mus": mus, "chg": chg, "sts": sts, "user": user})
+@router.get("/todos_add", response_class=HTMLResponse)
+async def todos_new_add(request: Request,
+                       db: Session = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    return templates.TemplateResponse("todos_add.html", {"request": request, "user": user, **await form_lists(db, user)})
 
 
 @router.post("/todos_add", response_class=HTMLResponse)
@@ -105,13 +245,44 @@ async def todos_create(request: Request,
     todo_model.charge_id = charge_id
     todo_model.status_id = status_id
     todo_model.description = description
+    new_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+    scheduling.validate_slot(*new_slot[1:])
 
     db.add(todo_model)
-    db.commit()
+    versions.bump(db, *versions.todo_scopes(uzman_id))
+    live.publish(db, [new_slot], [todo_model])
+    conflicts = scheduling.try_commit_booking(db, new_slot)
+    if conflicts is not None:
+        # The form is shown again with what was entered and the clashing bookings
+        return templates.TemplateResponse("todos_add.html", {
+            "request": request, "user": user, **await form_lists(db, user),
+            "start_time": start_time, "end_time": end_time, "description": description, "uzman_id": uzman_id,
+            "customer": customer_option(db, musteri_id), "conflicts": conflicts,
+        }, status_code=status.HTTP_409_CONFLICT)
+
+    event_cache.invalidate(*new_slot)
 
     return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
 
 
+# Bulk import of appointments from a CSV or .ics upload (only accessible to admins).
+# Responds with the per-row report; 422 when errors kept the file from being loaded.
+@router.post("/import")
+async def todos_import(request: Request,
+                       file: UploadFile = File(...),
+                       skip_invalid: bool = Form(False),
+                       dry_run: bool = Form(False)):
+    user = await get_current_user(request)
+    if user is None or user.get('user_role') != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+    content = await file.read()
+    # Parsing, validation and COPY run on the sync engine, off the event loop
+    report = await run_in_threadpool(importer.import_file, file.filename, content,
+                                     user.get("id"), skip_invalid, dry_run)
+
+    rejected = report["errors"] and not report["imported"] and not dry_run
+    return JSONResponse(report, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY if rejected else status.HTTP_200_OK)
 
 
 @router.get("/todos_edit/{todo_id}", response_class=HTMLResponse)
@@ -123,19 +294,11 @@ async def todo_edit(request: Request,
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    if user.get('user_role') == 'user':
-        uzm = db.query(models.Users).filter(models.Users.id == user.get("id")).all()
-
-    if user.get('user_role') == 'admin':
-        uzm = db.query(models.Users).filter(models.Users.uzman == True and models.Users.is_active == True and models.Users.is_delete == False ).all()
-
     todo = db.query(models.Todos).filter(models.Todos.id == todo_id).first()
-    sek = db.query(models.Users).filter(models.Users.sekreter == True and models.Users.is_active == True and models.Users.is_delete == False).all()
-    mus = db.query(models.Customers).filter(models.Customers.is_active == True and models.Customers.is_delete == False).all()
-    chg = db.query(models.Charge).filter(models.Charge.is_active == True and models.Charge.is_delete == False).all()
-    sts = db.query(models.Status).filter(models.Status.is_active == True and models.Status.is_delete == False).all()
+    customer = customer_option(db, todo.musteri_id) if todo is not None else None
 
-    return templates.TemplateResponse("todos_edit.html", {"request": request, "todo": todo, "uzm": uzm, "mus": mus, "sek": sek, "chg": chg, "sts": sts, "user": user})
+    return templates.TemplateResponse("todos_edit.html", {"request": request, "todo": todo, "customer": customer, "user": user,
+                                                          **await form_lists(db, user)})
 
 
 @router.post("/todos_edit/{todo_id}", response_class=HTMLResponse)
@@ -164,6 +327,8 @@ async def todos_edit_commit(request: Request,
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
     todo_model = db.query(models.Todos).filter(models.Todos.id == todo_id).first()
+    old_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+
     todo_model.description = description
     todo_model.start_time = datetime.strptime(start_time, '%Y-%m-%dT%H:%M')  # '%Y-%m-%d %H:%M'
     todo_model.end_time = datetime.strptime(end_time, '%Y-%m-%dT%H:%M')  # '%Y-%m-%d %H:%M'
@@ -172,9 +337,25 @@ async def todos_edit_commit(request: Request,
     todo_model.musteri_id = musteri_id
     todo_model.charge_id = charge_id
     todo_model.status_id = status_id
+    new_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+    scheduling.validate_slot(*new_slot[1:])
 
     db.add(todo_model)
-    db.commit()
+    versions.bump(db, *versions.todo_scopes(old_slot[0], new_slot[0]))
+    live.publish(db, [old_slot, new_slot], [todo_id])
+    conflicts = scheduling.try_commit_booking(db, new_slot, exclude_id=todo_id)
+    if conflicts is not None:
+        # The form is shown again with the entered values (the stored todo is unchanged)
+        todo = models.Todos(id=todo_id, description=description, start_time=new_slot[1], end_time=new_slot[2],
+                            uzman_id=uzman_id, sekreter_id=sekreter_id, musteri_id=musteri_id,
+                            charge_id=charge_id, status_id=status_id)
+        return templates.TemplateResponse("todos_edit.html", {
+            "request": request, "todo": todo, "customer": customer_option(db, musteri_id), "user": user,
+            **await form_lists(db, user), "conflicts": conflicts,
+        }, status_code=status.HTTP_409_CONFLICT)
+
+    event_cache.invalidate(*old_slot)
+    event_cache.invalidate(*new_slot)
 
     return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
 
@@ -200,10 +381,16 @@ async def delete_todo(request: Request,
     if todo_model is None:
         return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
 
+    old_slot = (todo_model.uzman_id, todo_model.start_time, todo_model.end_time)
+
     db.query(models.Todos).filter(models.Todos.id == todo_id).update({models.Todos.is_delete: True})
+    versions.bump(db, *versions.todo_scopes(old_slot[0]))
+    live.publish(db, [old_slot], [todo_id])
 
     db.commit()
 
+    event_cache.invalidate(*old_slot)
+
     return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
 
 
@@ -229,10 +416,20 @@ async def todos_hard_delete(request: Request,
     if todos_model is None:
         return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
 
+    old_slot = (todos_model.uzman_id, todos_model.start_time, todos_model.end_time)
+
+    # Deleting an edited occurrence cancels it, rather than bringing back the generated one
+    if todos_model.series_id is not None:
+        recurrence.exclude_occurrence(db, todos_model.series_id, todos_model.recurrence_id)
+
     db.query(models.Todos).filter(models.Todos.id == todos_id).delete()
+    versions.bump(db, *versions.todo_scopes(old_slot[0]))
+    live.publish(db, [old_slot], [todos_id])
 
     db.commit()
 
+    event_cache.invalidate(*old_slot)
+
     return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
 
 
@@ -0,0 +1,332 @@
+import heapq
+from bisect import bisect_left, bisect_right
+import os
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from starlette import status
+from starlette.responses import JSONResponse
+
+import models
+import recurrence
+
+# Booking conflicts and free-slot search.
+# The todos_no_overlap exclusion constraint keeps the live bookings of an expert from overlapping,
+# so concurrent writers cannot both get through. Generated occurrences of recurring series have no
+# rows, so writes check them in code under a per-expert advisory lock (lock_experts); new series are
+# checked over their whole expansion (find_series_conflicts). Handlers commit through commit_booking,
+# which turns a clash into a 409 listing the bookings that clash with the rejected one (batches of
+# moves list the clashes of the whole batch, see find_move_conflicts).
+# Free slots are found by a sorted merge of each expert's busy intervals with the working hours.
+
+OVERLAP_CONSTRAINT = "todos_no_overlap"
+
+# SQLSTATE of exclusion_violation
+EXCLUSION_VIOLATION = "23P01"
+
+# pg_advisory_xact_lock class of the per-expert schedule locks (the second key is the expert id)
+SCHEDULE_LOCK_ID = 420190002
+
+CONFLICT_MESSAGE = "The booking overlaps other bookings of the expert"
+
+# Working hours offered by the free-slot search, in the clinic's wall-clock time, e.g. '09:00-18:00'
+WORKDAY_START, WORKDAY_END = (time.fromisoformat(value) for value in os.getenv("WORKDAY_HOURS", "09:00-18:00").split("-"))
+
+# Working days as weekday numbers, Monday being 0
+WORKDAYS = frozenset(int(day) for day in os.getenv("WORKDAYS", "0,1,2,3,4").split(","))
+
+# Free slots start on multiples of this many minutes past midnight
+SLOT_STEP_MINUTES = int(os.getenv("SLOT_STEP_MINUTES", "15"))
+
+# Days of bookings read per step of the free-slot search
+SLOT_SEARCH_CHUNK_DAYS = int(os.getenv("SLOT_SEARCH_CHUNK_DAYS", "7"))
+
+
+# Accepts SQLAlchemy errors and raw DBAPI errors (raised by COPY on a driver cursor)
+def is_overlap_violation(error):
+    orig = getattr(error, "orig", error)
+    code = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+    if code != EXCLUSION_VIOLATION:
+        return False
+    diag = getattr(orig, "diag", None)
+    constraint = getattr(diag, "constraint_name", None) or getattr(orig, "constraint_name", None)
+    return constraint in (None, OVERLAP_CONSTRAINT)
+
+
+# Bookings need a positive length; tsrange would reject an inverted range with a 500
+def validate_slot(start, end):
+    if end <= start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="End time must be after start time")
+
+
+def conflict_entry(todo_id, start, end, uzman_id, musteri_ad, musteri_soyad, description):
+    return {"id": todo_id, "start": start.isoformat(), "end": end.isoformat(), "uzman_id": uzman_id,
+            "musteri_ad": musteri_ad, "musteri_soyad": musteri_soyad, "description": description}
+
+
+def conflicts_query(uzman_id, start, end, exclude_id=None):
+    query = (
+        select(models.Todos.id, models.Todos.start_time, models.Todos.end_time, models.Todos.description,
+               models.Todos.uzman_id, models.Customers.ad, models.Customers.soyad)
+        .outerjoin(models.Todos.todos_customers)
+        .where(models.Todos.uzman_id == uzman_id,
+               models.Todos.is_delete.isnot(True),
+               models.Todos.start_time < end,
+               models.Todos.end_time > start)
+        .order_by(models.Todos.start_time)
+    )
+    if exclude_id is not None:
+        query = query.where(models.Todos.id != exclude_id)
+    return query
+
+
+# Live bookings of the expert overlapping [start, end), other than the booking being edited
+def find_conflicts(db, uzman_id, start, end, exclude_id=None):
+    return [
+        conflict_entry(row.id, row.start_time, row.end_time, row.uzman_id, row.ad, row.soyad, row.description)
+        for row in db.execute(conflicts_query(uzman_id, start, end, exclude_id))
+    ]
+
+
+# Generated occurrences of the expert's series overlapping [start, end). They have no rows, so
+# the exclusion constraint cannot see them; writes check them while holding the schedule lock.
+def find_occurrence_conflicts(db, uzman_id, start, end):
+    return [
+        conflict_entry(row[0], row[1], row[2], row[4], row[6], row[7], row[3])
+        for row, _, _ in recurrence.occurrence_rows_sync(db, uzman_id, None, start, end)
+    ]
+
+
+# Takes the schedule locks of the experts until the transaction ends. Every booking write takes the
+# lock of the expert it books before checking generated occurrences, so two writers cannot both
+# pass the check for the same expert; the locks are taken in id order to avoid deadlocks.
+def lock_experts(db, *uzman_ids):
+    for uzman_id in sorted({uzman_id for uzman_id in uzman_ids if uzman_id is not None}):
+        db.execute(select(func.pg_advisory_xact_lock(SCHEDULE_LOCK_ID, uzman_id)))
+
+
+# Bookings and generated occurrences of the expert clashing with the occurrences of a new series,
+# given by their sorted starts and common duration
+def find_series_conflicts(db, uzman_id, starts, duration):
+    if not starts:
+        return []
+    window_start, window_end = starts[0], starts[-1] + duration
+    busy = [(row.start_time, row.end_time, conflict_entry(row.id, row.start_time, row.end_time, row.uzman_id,
+                                                            row.ad, row.soyad, row.description))
+            for row in db.execute(conflicts_query(uzman_id, window_start, window_end))]
+    busy += [(row[1], row[2], conflict_entry(row[0], row[1], row[2], row[4], row[6], row[7], row[3]))
+             for row, _, _ in recurrence.occurrence_rows_sync(db, uzman_id, None, window_start, window_end)]
+    conflicts = []
+    for busy_start, busy_end, entry in sorted(busy, key=lambda item: item[0]):
+        # The first occurrence ending after the busy interval starts must start before it ends
+        index = bisect_right(starts, busy_start - duration)
+        if index < len(starts) and starts[index] < busy_end:
+            conflicts.append(entry)
+    return conflicts
+
+
+# Conflicts of a rejected batch of moves [(id, uzman_id, start, end)], read after the rollback:
+# bookings and generated occurrences outside the batch overlapping a new slot, then moved bookings
+# overlapping each other
+def find_move_conflicts(db, moves):
+    moved_ids = {todo_id for todo_id, *_ in moves}
+    conflicts, seen = [], set()
+    for todo_id, uzman_id, start, end in moves:
+        for conflict in find_conflicts(db, uzman_id, start, end) + find_occurrence_conflicts(db, uzman_id, start, end):
+            if conflict["id"] not in moved_ids and conflict["id"] not in seen:
+                seen.add(conflict["id"])
+                conflicts.append(conflict)
+
+    clashing = {}
+    for index, (todo_id, uzman_id, start, end) in enumerate(moves):
+        for other_id, other_uzman_id, other_start, other_end in moves[index + 1:]:
+            if uzman_id == other_uzman_id and start < other_end and end > other_start:
+                clashing[todo_id] = (uzman_id, start, end)
+                clashing[other_id] = (other_uzman_id, other_start, other_end)
+    if clashing:
+        query = (
+            select(models.Todos.id, models.Todos.description, models.Customers.ad, models.Customers.soyad)
+            .outerjoin(models.Todos.todos_customers)
+            .where(models.Todos.id.in_(clashing))
+        )
+        for row in db.execute(query):
+            conflicts.append(conflict_entry(row.id, clashing[row.id][1], clashing[row.id][2], clashing[row.id][0],
+                                            row.ad, row.soyad, row.description))
+    return conflicts
+
+
+# True when one of the slots [(uzman_id, start, end)] being written (moves, imports) overlaps a
+# generated occurrence; one expansion per expert over the span of its slots
+def slots_hit_occurrences(db, slots):
+    spans = {}
+    for uzman_id, start, end in slots:
+        first, last = spans.get(uzman_id, (start, end))
+        spans[uzman_id] = (min(first, start), max(last, end))
+    occurrences = {}
+    for uzman_id, (first, last) in spans.items():
+        rows = recurrence.occurrence_rows_sync(db, uzman_id, None, first, last)
+        if rows:
+            # Sorted by start; an overlapping occurrence starts before the slot ends and at most
+            # the longest occurrence before the slot starts
+            occurrences[uzman_id] = ([row[1] for row, _, _ in rows], [row[2] for row, _, _ in rows],
+                                     max(row[2] - row[1] for row, _, _ in rows))
+    for uzman_id, start, end in slots:
+        if uzman_id not in occurrences:
+            continue
+        starts, ends, longest = occurrences[uzman_id]
+        index = bisect_left(starts, end) - 1
+        while index >= 0 and starts[index] > start - longest:
+            if ends[index] > start:
+                return True
+            index -= 1
+    return False
+
+
+def conflict_response(conflicts):
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={
+        "detail": CONFLICT_MESSAGE,
+        "conflicts": conflicts,
+    })
+
+
+# Commits a booking write after checking the new slot (uzman_id, start, end) against the expert's
+# other live bookings (the exclusion constraint) and generated occurrences. On a clash the
+# transaction is rolled back and the conflicts are returned; None means the commit succeeded.
+def try_commit_booking(db, slot, exclude_id=None):
+    try:
+        lock_experts(db, slot[0])
+        db.flush()
+        # Read before the rollback: an occurrence replaced by the row being written is not a clash
+        conflicts = find_occurrence_conflicts(db, *slot)
+        if not conflicts:
+            db.commit()
+            return None
+    except IntegrityError as error:
+        db.rollback()
+        if not is_overlap_violation(error):
+            raise
+        return find_conflicts(db, *slot, exclude_id=exclude_id)
+    db.rollback()
+    return conflicts
+
+
+# As try_commit_booking, answering a clash with the 409 response
+def commit_booking(db, slot, exclude_id=None):
+    conflicts = try_commit_booking(db, slot, exclude_id)
+    return None if conflicts is None else conflict_response(conflicts)
+
+
+# Busy intervals per expert overlapping [start, end), each list sorted by start.
+# Single bookings come from one range query on (uzman_id, start_time, end_time); generated
+# occurrences of recurring series are expanded for the same window.
+async def busy_intervals(db, expert_ids, start, end):
+    query = (
+        select(models.Todos.uzman_id, models.Todos.start_time, models.Todos.end_time)
+        .where(models.Todos.uzman_id.in_(expert_ids),
+               models.Todos.is_delete.isnot(True),
+               models.Todos.start_time < end,
+               models.Todos.end_time > start)
+        .order_by(models.Todos.uzman_id, models.Todos.start_time)
+    )
+    busy = {uzman_id: [] for uzman_id in expert_ids}
+    for uzman_id, busy_start, busy_end in await db.execute(query):
+        busy[uzman_id].append((busy_start, busy_end))
+
+    expert_filter = expert_ids[0] if len(expert_ids) == 1 else None
+    occurrences = await recurrence.occurrence_rows(db, expert_filter, None, start, end)
+    if occurrences:
+        for row, _, _ in occurrences:
+            if row[4] in busy:
+                busy[row[4]].append((row[1], row[2]))
+        for intervals in busy.values():
+            intervals.sort()
+    return busy
+
+
+# Merges sorted intervals into disjoint ones; touching intervals are joined
+def merge_intervals(intervals):
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Working-hour windows clipped to [start, end), in order
+def working_windows(start, end):
+    day = start.date()
+    while True:
+        opens, closes = datetime.combine(day, WORKDAY_START), datetime.combine(day, WORKDAY_END)
+        if opens >= end:
+            return
+        if day.weekday() in WORKDAYS:
+            window_start, window_end = max(opens, start), min(closes, end)
+            if window_start < window_end:
+                yield window_start, window_end
+        day += timedelta(days=1)
+
+
+# Rounds up to the next slot boundary
+def align(value, step):
+    minutes = value.hour * 60 + value.minute + (1 if value.second or value.microsecond else 0)
+    return datetime.combine(value.date(), time()) + timedelta(minutes=-(-minutes // step) * step)
+
+
+# Free slots of the given length, in order, walking the working windows and the merged busy
+# intervals side by side (both are sorted, so each interval is looked at about once).
+# Within a gap, each slot starts at the first slot boundary after the previous one ends.
+def free_slots(busy, start, end, duration, step=SLOT_STEP_MINUTES):
+    busy = merge_intervals(busy)
+    first = 0
+    for window_start, window_end in working_windows(start, end):
+        # Intervals ending before this window cannot matter for later windows either
+        while first < len(busy) and busy[first][1] <= window_start:
+            first += 1
+        cursor = window_start
+        index = first
+        while cursor < window_end:
+            gap_end = window_end
+            while index < len(busy) and busy[index][1] <= cursor:
+                index += 1
+            if index < len(busy) and busy[index][0] < window_end:
+                if busy[index][0] <= cursor:
+                    cursor = busy[index][1]
+                    continue
+                gap_end = busy[index][0]
+            slot = align(cursor, step)
+            while slot + duration <= gap_end:
+                yield slot, slot + duration
+                slot = align(slot + duration, step)
+            cursor = gap_end
+
+
+def expert_free_slots(uzman_id, intervals, start, end, duration):
+    for slot_start, slot_end in free_slots(intervals, start, end, duration):
+        yield slot_start, uzman_id, slot_end
+
+
+# The first `limit` free slots across the given experts, ordered by start then expert.
+# Each expert's slots are generated lazily, so only as many are computed as the merge consumes.
+def next_free_slots(busy, start, end, duration, limit):
+    streams = [expert_free_slots(uzman_id, intervals, start, end, duration) for uzman_id, intervals in busy.items()]
+    return [(uzman_id, slot_start, slot_end) for slot_start, uzman_id, slot_end in islice(heapq.merge(*streams), limit)]
+
+
+# The first `limit` free slots in [start, end). The range is searched in chunks of
+# SLOT_SEARCH_CHUNK_DAYS ending at midnight, so a search answered within the next few days only
+# reads those days' bookings. Slots never span midnight, so none is lost at a chunk boundary.
+async def search_free_slots(db, expert_ids, start, end, duration, limit):
+    slots = []
+    chunk_start = start
+    while chunk_start < end and len(slots) < limit:
+        chunk_end = min(datetime.combine(chunk_start.date() + timedelta(days=SLOT_SEARCH_CHUNK_DAYS), time()), end)
+        busy = await busy_intervals(db, expert_ids, chunk_start, chunk_end)
+        slots += next_free_slots(busy, chunk_start, chunk_end, duration, limit - len(slots))
+        chunk_start = chunk_end
+    return slots
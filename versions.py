@@ -0,0 +1,119 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from starlette.responses import Response
+
+import models
+
+# Scopes tracked in the change_versions table
+TODOS = 'todos'
+CUSTOMERS = 'customers'
+CHARGES = 'charges'
+USERS = 'users'
+
+# Part of every ETag, so a deploy that changes templates or payload shapes invalidates browser copies
+APP_RELEASE = os.getenv("APP_RELEASE", "dev")
+
+
+# Scope holding the todos of a single expert
+def expert_scope(uzman_id):
+    return f'{TODOS}:uzman:{uzman_id}'
+
+
+# Scopes touched by a write to todos owned by the given experts (old and new owner on edits).
+# There is no counter row for all todos, so writes for different experts never wait on one row;
+# versions_query derives the TODOS version from the expert scopes.
+def todo_scopes(*uzman_ids):
+    return [expert_scope(uzman_id) for uzman_id in uzman_ids if uzman_id is not None]
+
+
+# Increments the counters of the given scopes inside the caller's transaction,
+# so readers only observe the new version once the change itself is committed
+def bump(db, *scopes):
+    if not scopes:
+        return
+    now = datetime.utcnow()
+    # Sorted to take the row locks in the same order in every concurrent writer
+    rows = [{"scope": scope, "version": 1, "updated_at": now} for scope in sorted(set(scopes))]
+    statement = insert(models.ChangeVersions).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[models.ChangeVersions.scope],
+        set_={"version": models.ChangeVersions.version + 1, "updated_at": statement.excluded.updated_at}
+    )
+    db.execute(statement)
+
+
+# Query returning the current counters of the given scopes (one primary key lookup per scope).
+# TODOS is the sum of the expert counters, which only grow, and their latest change time.
+def versions_query(*scopes):
+    query = (
+        select(models.ChangeVersions.scope, models.ChangeVersions.version, models.ChangeVersions.updated_at)
+        .where(models.ChangeVersions.scope.in_([scope for scope in scopes if scope != TODOS]))
+    )
+    if TODOS in scopes:
+        query = query.union_all(
+            select(literal(TODOS), func.coalesce(func.sum(models.ChangeVersions.version), 0),
+                   func.max(models.ChangeVersions.updated_at))
+            .where(models.ChangeVersions.scope.startswith(expert_scope("")))
+        )
+    return query
+
+
+# Weak ETag over the scope counters plus whatever else shapes the response (user scope, filters)
+def make_etag(version_rows, *parts):
+    versions = sorted((row.scope, row.version) for row in version_rows)
+    digest = hashlib.sha1(repr((APP_RELEASE, versions, parts)).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+# If-None-Match uses the weak comparison, so the W/ prefix is ignored on both sides
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+# Time of the latest change among the given scope rows (naive UTC), never earlier than floor
+def last_modified(version_rows, floor=None):
+    times = [row.updated_at for row in version_rows if row.updated_at is not None]
+    if floor is not None:
+        times.append(floor)
+    return max(times, default=None)
+
+
+def http_date(value):
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+# If-Modified-Since is only consulted when the client sent no If-None-Match (RFC 9110)
+def not_modified_since(request, modified):
+    header = request.headers.get("if-modified-since")
+    if not header or modified is None or request.headers.get("if-none-match"):
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return modified.replace(microsecond=0) <= since
+
+
+# Headers sent with every versioned response: browsers keep the copy but revalidate before reuse
+def etag_headers(etag, modified=None):
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified is not None:
+        headers["Last-Modified"] = http_date(modified)
+    return headers
+
+
+def not_modified(etag, modified=None):
+    return Response(status_code=304, headers=etag_headers(etag, modified))